@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# usage: from attribute_validators import AttributeValidators
+__license__ = "Apache 2"
+
+from jsonschema import Draft7Validator, RefResolver, draft7_format_checker
+
+
+def required_message(name):
+  return "'{}' is a required property".format(name)
+
+
+class AttributeValidators:
+  """One compiled sub-validator per attribute path of a JSON schema.
+
+  Each path (dotted, as in weights.v2.json, or a top-level name as in
+  REPORTING_ATTRIBUTES) is resolved to the sub-schema that governs it,
+  following $refs, and compiled on its own. Checking a document then only
+  validates the attributes that are scored: an attribute fails when its
+  value violates its sub-schema, or when its parent is present and requires
+  it but it is missing. As in full validation, an attribute is required when
+  the parent object schema, or any of its allOf branches, lists it; a
+  required list inside an anyOf/oneOf branch only fails the parent as a
+  whole, so it is left to the parent's own check. Failures are reported per path, so no
+  error message has to be parsed to find the attribute it belongs to.
+  """
+
+  def __init__(self, schema, paths):
+    """
+    @param schema: the full JSON schema document
+    @param paths: attribute paths to compile, e.g. 'summary.publisher.name'
+    """
+    self.resolver = RefResolver.from_schema(schema)
+    self.checks = []
+    for path in dict.fromkeys(paths):
+      parts = path.split('.')
+      parent, node = None, schema
+      for depth, part in enumerate(parts):
+        parent = node
+        _, node = self._child(node, part)
+        if node is None:
+          break
+      # a path the schema does not describe can still be required by its parent
+      required = depth == len(parts) - 1 and parts[-1] in self._required(parent)
+      validator = None
+      if node is not None:
+        validator = Draft7Validator(node, resolver=RefResolver.from_schema(schema),
+                                    format_checker=draft7_format_checker)
+      self.checks.append((path, parts, required, validator))
+
+  def _resolve(self, node):
+    """Follow $refs to the schema object they point at"""
+    while isinstance(node, dict) and '$ref' in node:
+      _, node = self.resolver.resolve(node['$ref'])
+    return node
+
+  def _required(self, node):
+    """Property names an object schema requires, itself or through its allOf branches"""
+    node = self._resolve(node)
+    if not isinstance(node, dict):
+      return set()
+    required = set(node.get('required', []))
+    for branch in node.get('allOf', []):
+      required |= self._required(branch)
+    return required
+
+  def _child(self, node, part):
+    """(object schema declaring part, sub-schema of part), looking through allOf/anyOf/oneOf"""
+    node = self._resolve(node)
+    if not isinstance(node, dict):
+      return None, None
+    child = node.get('properties', {}).get(part, None)
+    if child is not None:
+      return node, child
+    for keyword in ('allOf', 'anyOf', 'oneOf'):
+      for branch in node.get(keyword, []):
+        parent, child = self._child(branch, part)
+        if child is not None:
+          return parent, child
+    return node, None
+
+  def failures(self, document):
+    """Failing paths of document, each with the first error message
+
+    @return: dict of path -> message, in path order
+    """
+    failed = {}
+    for path, parts, required, validator in self.checks:
+      parent = document
+      for part in parts[:-1]:
+        parent = parent.get(part, None) if isinstance(parent, dict) else None
+      if not isinstance(parent, dict):
+        continue
+      if parts[-1] not in parent:
+        if required:
+          failed[path] = required_message(parts[-1])
+        continue
+      if validator is None:
+        continue
+      errors = sorted(validator.iter_errors(parent[parts[-1]]), key=lambda e: e.path)
+      if len(errors):
+        failed[path] = errors[0].message
+    return failed
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# usage: python -m pytest attribute_validators_test.py
+#
+# Checks that AttributeValidators fails the same attributes as full Draft7Validator validation
+# on a schema that spreads properties and required lists over $refs and combinators.
+__license__ = "Apache 2"
+
+from jsonschema import Draft7Validator, draft7_format_checker
+
+from attribute_validators import AttributeValidators, required_message
+
+COMBINATOR_SCHEMA = {
+  'type': 'object',
+  'definitions': {
+    'titled': {'properties': {'title': {'type': 'string', 'maxLength': 10}}},
+    'dated': {'required': ['issued'], 'properties': {'issued': {'type': 'string'}}},
+  },
+  'properties': {
+    'summary': {
+      'type': 'object',
+      'required': ['title'],
+      'allOf': [{'$ref': '#/definitions/titled'}, {'$ref': '#/definitions/dated'}],
+      'properties': {'abstract': {'type': 'string'}},
+    },
+    'access': {
+      'type': 'object',
+      'anyOf': [{'required': ['url']}, {'required': ['email']}],
+      'properties': {'url': {'type': 'string'}, 'email': {'type': 'string'}},
+    },
+  },
+}
+PATHS = ['summary.title', 'summary.issued', 'summary.abstract', 'access.url', 'access.email']
+
+
+def full_validation_failures(schema, document, paths):
+  """Attribute paths full validation fails: errors at the attribute, or missing required properties of its parent"""
+  failed = set()
+  for error in Draft7Validator(schema, format_checker=draft7_format_checker).iter_errors(document):
+    path = '.'.join(str(token) for token in error.absolute_path)
+    if error.validator == 'required':
+      path = '.'.join([path, error.message.split("'")[1]]) if path else error.message.split("'")[1]
+    failed.add(path)
+  return set(paths) & failed
+
+
+def test_required_through_combinators():
+  validators = AttributeValidators(COMBINATOR_SCHEMA, PATHS)
+  failures = validators.failures({'summary': {}})
+  assert failures == {'summary.title': required_message('title'), 'summary.issued': required_message('issued')}
+
+
+def test_matches_full_validation():
+  validators = AttributeValidators(COMBINATOR_SCHEMA, PATHS)
+  for document in ({'summary': {}},
+                   {'summary': {'title': 'a title that is too long', 'issued': 1}},
+                   {'summary': {'title': 'short', 'issued': '2020', 'abstract': 3}},
+                   {'summary': {'title': 'short', 'issued': '2020'}, 'access': {}},
+                   {'access': {'url': 5}}):
+    assert set(validators.failures(document)) == full_validation_failures(COMBINATOR_SCHEMA, document, PATHS), document
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# usage: benchmark.py [datasets|test_urls|utility] [--runs 3] [--models 300] [--latency 0.05] [--workers 8]
+#
+# Runs a crawl script against a local fixture_server.py and reports wall time, requests/sec and peak memory.
+__license__ = "Apache 2"
+
+import os
+import sys
+import json
+import time
+import socket
+import resource
+import tempfile
+import contextlib
+import subprocess
+import tracemalloc
+
+import requests
+
+from fixture_server import server_environment
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TARGETS = ['datasets', 'test_urls', 'utility']
+
+
+def free_port():
+  with contextlib.closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as s:
+    s.bind(('127.0.0.1', 0))
+    return s.getsockname()[1]
+
+
+def start_fixture_server(server_args, timeout=30):
+  """Start fixture_server.py in its own process so it does not compete with the crawl for the GIL"""
+  port = free_port()
+  base_url = "http://127.0.0.1:{}".format(port)
+  process = subprocess.Popen([sys.executable, os.path.join(HERE, 'fixture_server.py'), '--port', str(port)] + server_args,
+                             stdout=subprocess.DEVNULL)
+  deadline = time.time() + timeout
+  while time.time() < deadline:
+    try:
+      requests.get(base_url + '/__stats', timeout=1)
+      return process, base_url
+    except requests.ConnectionError:
+      time.sleep(0.1)
+  process.terminate()
+  raise RuntimeError("fixture server did not start on " + base_url)
+
+
+def server_stats(base_url):
+  return requests.get(base_url + '/__stats', timeout=10).json()
+
+
+def crawl(target, base_url, workers, harvest_workers, cache):
+  """Run one crawl of target; the crawl modules read their base URLs from the environment on import"""
+  if target == 'datasets':
+    import datasets
+    datasets.main(workers=workers, harvest_workers=harvest_workers, full=True,
+                  cache_dir=datasets.HTTP_CACHE_DIR if cache else None)
+  elif target == 'test_urls':
+    import test_urls
+    test_urls.main()
+  elif target == 'utility':
+    import pandas as pd
+    import remove_data_utility_duplicates
+    csv_df = pd.DataFrame(columns=['title', 'id', 'pid', 'publisher'])
+    remove_data_utility_duplicates.Update_Utility_scores(csv_df, base_url)
+
+
+def run(target, base_url, workers=4, harvest_workers=4, cache=False, trace_memory=False, verbose=False):
+  """Time one crawl and measure its requests and memory.
+
+  Peak RSS is always reported; tracemalloc gives the peak of Python allocations
+  during the run but slows the crawl down, so it is opt-in.
+  """
+  before = server_stats(base_url)
+  if trace_memory:
+    tracemalloc.start()
+  start = time.perf_counter()
+  with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(sys.stdout if verbose else devnull):
+    crawl(target, base_url, workers, harvest_workers, cache)
+  wall = time.perf_counter() - start
+  peak = None
+  if trace_memory:
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+  after = server_stats(base_url)
+  requests_made = after['requests'] - before['requests']
+  statuses = {k: v - before['statuses'].get(k, 0) for k, v in after['statuses'].items()
+              if v - before['statuses'].get(k, 0) > 0}
+  return {
+    'target': target,
+    'wall_seconds': round(wall, 3),
+    'requests': requests_made,
+    'requests_per_second': round(requests_made / wall, 1) if wall > 0 else None,
+    'statuses': statuses,
+    'bytes': after['bytes'] - before['bytes'],
+    'peak_traced_mb': round(peak / 2 ** 20, 1) if peak is not None else None,
+    # ru_maxrss is reported in KiB on Linux
+    'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+  }
+
+
+def main(target='datasets', runs=1, workers=4, harvest_workers=4, cache=False, server_args=None, workdir=None,
+         output=None, trace_memory=False, verbose=False):
+  process, base_url = start_fixture_server(server_args or [])
+  os.environ.update(server_environment(base_url))
+  workdir = workdir or tempfile.mkdtemp(prefix='crawl-benchmark-')
+  os.makedirs(os.path.join(workdir, 'reports'), exist_ok=True)
+  sys.path.insert(0, HERE)
+  cwd = os.getcwd()
+  os.chdir(workdir)
+  results = []
+  try:
+    for i in range(runs):
+      result = run(target, base_url, workers=workers, harvest_workers=harvest_workers, cache=cache,
+                   trace_memory=trace_memory, verbose=verbose)
+      result['run'] = i + 1
+      results.append(result)
+      print("run {run}: {wall_seconds}s, {requests} requests, {requests_per_second} req/s, "
+            "peak {max_rss_mb} MB RSS / {peak_traced_mb} MB traced, statuses {statuses}".format(**result))
+  finally:
+    os.chdir(cwd)
+    process.terminate()
+    process.wait()
+  if output is not None:
+    with open(output, 'w') as jsonfile:
+      json.dump({'target': target, 'server': server_args, 'workers': workers,
+                 'harvest_workers': harvest_workers, 'runs': results}, jsonfile, indent=2)
+  return results
+
+
+if __name__ == "__main__":
+  import argparse
+  parser = argparse.ArgumentParser(description='Benchmark a crawl against the local fixture server')
+  parser.add_argument('target', nargs='?', choices=TARGETS, default='datasets')
+  parser.add_argument('--runs', metavar='N', type=int, default=1)
+  parser.add_argument('--workers', metavar='N', type=int, default=4)
+  parser.add_argument('--harvest-workers', metavar='N', dest='harvest_workers', type=int, default=4)
+  parser.add_argument('--cache', action='store_true', help='Keep the HTTP response cache between runs')
+  parser.add_argument('--workdir', metavar='DIR', type=str, default=None,
+                      help='Directory the crawl writes its outputs to (default: a new temporary directory)')
+  parser.add_argument('--output', metavar='FILE', type=str, default=None, help='Write the results as JSON')
+  parser.add_argument('--trace-memory', dest='trace_memory', action='store_true',
+                      help='Also report the peak of Python allocations (slows the crawl)')
+  parser.add_argument('--verbose', action='store_true', help='Show the crawl output')
+  args, server_args = parser.parse_known_args()
+  # Any other options (--models, --latency, --error-rate, --throttle-rate, ...) go to fixture_server.py
+  main(args.target, runs=args.runs, workers=args.workers, harvest_workers=args.harvest_workers, cache=args.cache,
+       server_args=server_args, workdir=args.workdir, output=args.output, trace_memory=args.trace_memory, verbose=args.verbose)
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# usage: from catalogue_store import CatalogueStore, CATALOGUE_DB
+__license__ = "Apache 2"
+
+import os
+import json
+import sqlite3
+
+CATALOGUE_DB = "datasets.sqlite"
+
+SCHEMA = """
+CREATE TABLE data_models (
+  id TEXT PRIMARY KEY,
+  position INTEGER NOT NULL,
+  pid TEXT,
+  label TEXT,
+  publisher TEXT,
+  publisher_v2 TEXT,
+  version TEXT,
+  modified TEXT,
+  issued TEXT,
+  has_v2 INTEGER NOT NULL,
+  document TEXT NOT NULL,
+  document_v2 TEXT
+);
+CREATE TABLE data_classes (
+  id TEXT NOT NULL,
+  model_id TEXT NOT NULL,
+  position INTEGER NOT NULL,
+  name TEXT,
+  description TEXT,
+  data_elements_count INTEGER,
+  document TEXT NOT NULL,
+  PRIMARY KEY (model_id, id)
+);
+CREATE TABLE data_elements (
+  id TEXT NOT NULL,
+  model_id TEXT NOT NULL,
+  class_id TEXT NOT NULL,
+  position INTEGER NOT NULL,
+  name TEXT,
+  description TEXT,
+  data_type TEXT,
+  document TEXT NOT NULL
+);
+CREATE TABLE revisions (
+  model_id TEXT NOT NULL,
+  version TEXT NOT NULL,
+  revision_id TEXT,
+  PRIMARY KEY (model_id, version)
+);
+CREATE TABLE pids (
+  dataset_id TEXT PRIMARY KEY,
+  pid TEXT NOT NULL
+);
+CREATE INDEX data_models_pid ON data_models (pid);
+CREATE INDEX data_models_publisher ON data_models (publisher);
+CREATE INDEX data_models_publisher_v2 ON data_models (publisher_v2);
+CREATE INDEX data_models_position ON data_models (position);
+CREATE INDEX data_classes_model ON data_classes (model_id, position);
+CREATE INDEX data_elements_class ON data_elements (model_id, class_id, position);
+CREATE INDEX data_elements_id ON data_elements (id);
+CREATE INDEX revisions_revision ON revisions (revision_id);
+CREATE INDEX pids_pid ON pids (pid);
+"""
+
+
+class CatalogueStore:
+  """Normalised SQLite copy of datasets.json and datasets.v2.json.
+
+  Data models are stored once, with their v1 and v2 documents minus the data
+  class trees; classes and elements live in their own tables and are only
+  joined back in when a caller asks for them. Rows keep the listing order.
+  """
+
+  def __init__(self, filename=CATALOGUE_DB):
+    self.filename = filename
+    self.connection = None
+    self._position = 0
+
+  # -- writing ---------------------------------------------------------------
+
+  def create(self):
+    """Start a new store, written to a temporary file until close()"""
+    self._tmp_name = self.filename + '.part'
+    if os.path.exists(self._tmp_name):
+      os.remove(self._tmp_name)
+    self.connection = sqlite3.connect(self._tmp_name)
+    self.connection.executescript(SCHEMA)
+    return self
+
+  def write_data_model(self, row, row_v2):
+    """Add one model's v1 row and optional v2 row"""
+    document = dict(row)
+    data_classes = document.get('dataClasses', None)
+    if data_classes is not None:
+      # Placeholder keeps the key order when the classes are joined back in
+      document['dataClasses'] = None
+    document_v2 = None
+    publisher_v2 = None
+    if row_v2 is not None:
+      document_v2 = dict(row_v2)
+      structural_metadata = dict(document_v2.get('structuralMetadata', {}))
+      if data_classes is None:
+        data_classes = structural_metadata.get('dataClasses', None)
+      if 'dataClasses' in structural_metadata:
+        structural_metadata['dataClasses'] = None
+        document_v2['structuralMetadata'] = structural_metadata
+      publisher_v2 = ((row_v2.get('summary', None) or {}).get('publisher', None) or {}).get('name', None)
+    publisher = row.get('publisher', None)
+    self.connection.execute(
+      "INSERT INTO data_models VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+      (row['id'], self._position, row.get('pid', None), row.get('label', None),
+       publisher if isinstance(publisher, str) else json.dumps(publisher), publisher_v2,
+       row.get('version', None), row.get('modified', None), row.get('issued', None),
+       int(row_v2 is not None), json.dumps(document),
+       json.dumps(document_v2) if document_v2 is not None else None))
+    self._position += 1
+
+    self.connection.executemany(
+      "INSERT INTO revisions VALUES (?, ?, ?)",
+      [(row['id'], version, revision_id) for version, revision_id in (row.get('revisions', None) or {}).items()])
+
+    for i, dc in enumerate(data_classes or []):
+      dc_document = dict(dc)
+      data_elements = dc_document.pop('dataElements', [])
+      self.connection.execute(
+        "INSERT OR REPLACE INTO data_classes VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (dc.get('id', None), row['id'], i, dc.get('name', None), dc.get('description', None),
+         dc.get('dataElementsCount', None), json.dumps(dc_document)))
+      self.connection.executemany(
+        "INSERT INTO data_elements VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(de.get('id', None), row['id'], dc.get('id', None), j, de.get('name', None), de.get('description', None),
+          de.get('dataType', None), json.dumps(de)) for j, de in enumerate(data_elements)])
+
+  def write_pids(self, pid_index):
+    self.connection.executemany("INSERT INTO pids VALUES (?, ?)", sorted(pid_index.items()))
+
+  def close(self):
+    if self.connection is None:
+      return
+    self.connection.commit()
+    self.connection.close()
+    self.connection = None
+    if getattr(self, '_tmp_name', None) is not None:
+      os.replace(self._tmp_name, self.filename)
+      self._tmp_name = None
+
+  def abort(self):
+    self.connection.close()
+    self.connection = None
+    os.remove(self._tmp_name)
+    self._tmp_name = None
+
+  def __enter__(self):
+    if self.connection is None:
+      self.open()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is not None and getattr(self, '_tmp_name', None) is not None:
+      self.abort()
+    else:
+      self.close()
+
+  # -- reading ---------------------------------------------------------------
+
+  def open(self):
+    self._tmp_name = None
+    self.connection = sqlite3.connect(self.filename)
+    return self
+
+  def data_classes(self, model_id, with_elements=True):
+    """Data classes of a model in catalogue order, optionally with their elements"""
+    data_classes = []
+    for class_id, document in self.connection.execute(
+        "SELECT id, document FROM data_classes WHERE model_id = ? ORDER BY position", (model_id,)):
+      dc = json.loads(document)
+      if with_elements:
+        dc['dataElements'] = [json.loads(de) for (de,) in self.connection.execute(
+          "SELECT document FROM data_elements WHERE model_id = ? AND class_id = ? ORDER BY position",
+          (model_id, class_id))]
+      data_classes.append(dc)
+    return data_classes
+
+  def _document(self, model_id, document, version, with_classes):
+    dm = json.loads(document)
+    if version == 1:
+      if 'dataClasses' in dm:
+        if with_classes:
+          dm['dataClasses'] = self.data_classes(model_id)
+        else:
+          dm.pop('dataClasses')
+    else:
+      structural_metadata = dm.get('structuralMetadata', None)
+      if structural_metadata is not None and 'dataClasses' in structural_metadata:
+        if with_classes:
+          structural_metadata['dataClasses'] = self.data_classes(model_id)
+        else:
+          structural_metadata.pop('dataClasses')
+    return dm
+
+  def _select(self, version, where="", params=()):
+    column = 'document' if version == 1 else 'document_v2'
+    query = "SELECT id, {} FROM data_models WHERE {} IS NOT NULL {} ORDER BY position".format(column, column, where)
+    return self.connection.execute(query, params).fetchall()
+
+  def data_models(self, version=1, with_classes=True):
+    """Yield v1 or v2 documents in listing order"""
+    for model_id, document in self._select(version):
+      yield self._document(model_id, document, version, with_classes)
+
+  def load(self, version=1, with_classes=True):
+    """Drop-in replacement for get_json('datasets.json') / get_json('datasets.v2.json')"""
+    data_models = list(self.data_models(version, with_classes))
+    return {'count': len(data_models), 'dataModels': data_models}
+
+  def get(self, model_id, version=1, with_classes=True):
+    rows = self._select(version, "AND id = ?", (model_id,))
+    return self._document(rows[0][0], rows[0][1], version, with_classes) if len(rows) else None
+
+  def by_pid(self, pid, version=1, with_classes=False):
+    return [self._document(i, d, version, with_classes) for i, d in self._select(version, "AND pid = ?", (pid,))]
+
+  def by_publisher(self, publisher, version=1, with_classes=False):
+    column = 'publisher' if version == 1 else 'publisher_v2'
+    rows = self._select(version, "AND {} = ?".format(column), (publisher,))
+    return [self._document(i, d, version, with_classes) for i, d in rows]
+
+  def resolve_pid(self, dataset_id):
+    row = self.connection.execute("SELECT pid FROM pids WHERE dataset_id = ?", (dataset_id,)).fetchone()
+    return row[0] if row is not None else None
+
+  def revisions(self, model_id):
+    return dict(self.connection.execute(
+      "SELECT version, revision_id FROM revisions WHERE model_id = ?", (model_id,)).fetchall())
+
+
+def load_catalogue(json_uri, version=1, with_classes=True, filename=CATALOGUE_DB):
+  """Read the catalogue from the SQLite store when it is at least as new as json_uri.
+
+  @return: {'count': ..., 'dataModels': [...]} as get_json would
+  """
+  if os.path.isfile(filename) and (not os.path.isfile(json_uri) or
+                                   os.path.getmtime(filename) >= os.path.getmtime(json_uri)):
+    with CatalogueStore(filename) as store:
+      return store.load(version=version, with_classes=with_classes)
+  with open(json_uri, 'r') as json_file:
+    return json.load(json_file)
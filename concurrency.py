@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# usage: from concurrency import ordered_map
+__license__ = "Apache 2"
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def ordered_map(fn, items, workers=1, max_in_flight=None):
+  """Apply fn to each item on a bounded thread pool, yielding results in input order.
+
+  @param fn: callable applied to every item
+  @param items: any iterable; it is consumed lazily as slots free up
+  @param workers: number of worker threads, 1 runs serially in the calling thread
+  @param max_in_flight: maximum submitted-but-unconsumed items, defaults to 2 * workers
+  @return: generator of fn(item) in the same order as items
+  """
+  if workers is None or workers <= 1:
+    for item in items:
+      yield fn(item)
+    return
+
+  if max_in_flight is None:
+    max_in_flight = 2 * workers
+  max_in_flight = max(max_in_flight, workers)
+
+  items = iter(items)
+  pending = deque()
+  executor = ThreadPoolExecutor(max_workers=workers)
+  try:
+    for item in items:
+      pending.append(executor.submit(fn, item))
+      if len(pending) >= max_in_flight:
+        break
+    while pending:
+      yield pending.popleft().result()
+      for item in items:
+        pending.append(executor.submit(fn, item))
+        break
+  finally:
+    for future in pending:
+      future.cancel()
+    executor.shutdown(wait=True)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# usage: from crawl_journal import CrawlJournal
+__license__ = "Apache 2"
+
+import os
+import json
+import threading
+from datetime import datetime
+
+# Under .cache so a failed scheduled run's journal is kept with the CI cache
+CRAWL_JOURNAL = os.path.join('.cache', 'crawl.journal.ndjson')
+
+
+class CrawlJournal:
+  """Append-only NDJSON record of every data model finished during a crawl.
+
+  Each line holds the model id, the fetched timestamp, the listing summary
+  the model was crawled from and its v1 and v2 rows. Only byte offsets and
+  summaries are kept in memory; rows are read back on demand. With
+  resume=True an existing journal is re-indexed (dropping a torn last line)
+  so finished models can be skipped, otherwise it is started afresh. An entry
+  is only replayed while the listing still reports the same summary for its
+  model, so an old journal cannot pass off outdated records as current.
+  """
+
+  def __init__(self, filename=CRAWL_JOURNAL, resume=False):
+    self.filename = filename
+    self.offsets = {}
+    self.summaries = {}
+    self._lock = threading.Lock()
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    if resume and os.path.isfile(filename):
+      self._index()
+      print("Resuming crawl with", len(self.offsets), "data models from", filename)
+    else:
+      open(filename, 'w').close()
+    self._file = open(filename, 'ab')
+
+  def _index(self):
+    good = 0
+    with open(self.filename, 'rb') as journal:
+      offset = 0
+      for line in journal:
+        try:
+          entry = json.loads(line)
+          self.offsets[entry['id']] = offset
+        except (ValueError, KeyError):
+          break
+        self.summaries[entry['id']] = entry.get('summary', None)
+        offset += len(line)
+        good = offset
+    with open(self.filename, 'r+b') as journal:
+      journal.truncate(good)
+
+  def __contains__(self, id):
+    return id in self.offsets
+
+  def __len__(self):
+    return len(self.offsets)
+
+  def matches(self, id, summary):
+    """Whether id was recorded from a listing summary equal to summary"""
+    with self._lock:
+      return id in self.offsets and self.summaries.get(id, None) == summary
+
+  def record(self, id, row, row_v2, summary=None):
+    line = json.dumps({
+      'id': id,
+      'fetched': datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+      'summary': summary,
+      'row': row,
+      'row_v2': row_v2,
+    }).encode('utf-8') + b'\n'
+    with self._lock:
+      self._file.flush()
+      offset = self._file.tell()
+      self._file.write(line)
+      self._file.flush()
+      os.fsync(self._file.fileno())
+      self.offsets[id] = offset
+      self.summaries[id] = summary
+
+  def load(self, id):
+    """(row, row_v2) of a finished model"""
+    with self._lock:
+      offset = self.offsets[id]
+      self._file.flush()
+    with open(self.filename, 'rb') as journal:
+      journal.seek(offset)
+      entry = json.loads(journal.readline())
+    return entry['row'], entry['row_v2']
+
+  def complete(self):
+    """Remove the journal once the final outputs have been written"""
+    self._file.close()
+    os.remove(self.filename)
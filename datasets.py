@@ -5,7 +5,9 @@ __copyright__ = "Copyright (c) 2019-2020 Susheel Varma All Rights Reserved."
 __email__ = "susheel.varma@hdruk.ac.uk"
 __license__ = "Apache 2"
 
+import os
 import sys
+import time
 import csv
 import json
 import urllib
@@ -14,21 +16,101 @@ import uuid
 import itertools
 import requests
 from pprint import pprint
-
-API_BASE_URL="https://metadata-catalogue.org/hdruk/api"
+from urllib.parse import urlsplit
+from concurrency import ordered_map
+import transport
+import rate_limit
+from http_cache import ResponseCache, HTTP_CACHE_DIR, HTTP_CACHE_TTL
+from pid_index import PIDResolver, load_pid_index
+from revision_graph import RevisionGraph
+from model_cache import ModelSummaryCache, MODEL_SUMMARY_CACHE
+from json_stream import StreamingJSONWriter, NDJSONWriter, IndexedJSONRecords, iter_ndjson
+from crawl_journal import CrawlJournal, CRAWL_JOURNAL
+from table_export import SpooledCSVWriter, export_tables
+from catalogue_store import CatalogueStore, CATALOGUE_DB
+from metadata_decoder import decode_metadata, build_document
+from telemetry import RequestTelemetry, URLClassifier, OTHER, CRAWL_METRICS_JSON
+from listing import PagedListing, LISTING_PAGE_SIZE
+from tech_profile import TechnicalProfile
+
+API_BASE_URL = os.environ.get('MDC_API_BASE_URL', "https://metadata-catalogue.org/hdruk/api")
+GATEWAY_API_BASE_URL = os.environ.get('GATEWAY_API_BASE_URL', "https://api.www.healthdatagateway.org")
 DATA_MODELS = API_BASE_URL + "/dataModels"
+# Sorted by id so that pages do not reorder between requests
+DATA_MODELS_PAGE = DATA_MODELS + "?sort=id&order=asc&offset={OFFSET}&max={MAX}"
+DATA_MODEL = DATA_MODELS + "/{MODEL_ID}"
 DATA_MODEL_ID = API_BASE_URL + "/facets/{MODEL_ID}/profile/uk.ac.hdrukgateway/HdrUkProfilePluginService"
 DATA_MODEL_METADATA = API_BASE_URL + "/facets/{MODEL_ID}/metadata?all=true"
 DATA_MODEL_CLASSES = DATA_MODELS + "/{MODEL_ID}/dataClasses?all=true"
 DATA_MODEL_CLASS = DATA_MODELS + "/{MODEL_ID}/dataClasses/{CLASS_ID}"
-DATA_MODEL_CLASSES_ELEMENTS = DATA_MODELS + "/{MODEL_ID}/dataClasses/{CLASS_ID}/dataElements?all=true"
+DATA_MODEL_CLASSES_ELEMENTS_PAGE = DATA_MODELS + "/{MODEL_ID}/dataClasses/{CLASS_ID}/dataElements?offset={OFFSET}&max={MAX}"
 DATA_MODEL_SEMANTIC_LINKS = API_BASE_URL + "/catalogueItems/{MODEL_ID}/semanticLinks?all=true"
-DATA_MODEL_PIDS = "https://api.www.healthdatagateway.org/api/v1/datasets/pidList"
+DATA_MODEL_PIDS = GATEWAY_API_BASE_URL + "/api/v1/datasets/pidList"
+CRAWL_WORKERS = 4
+HARVEST_WORKERS = 4
+ELEMENTS_PAGE_SIZE = 1000
+DATASETS_JSON = "datasets.json"
+DATASETS_V2_JSON = "datasets.v2.json"
+DATASETS_NDJSON = "datasets.ndjson"
+DATASETS_V2_NDJSON = "datasets.v2.ndjson"
+CRAWL_STATE_JSON = "datasets.state.json"
+# Cheap fields from the /dataModels listing used to detect changed models
+MODEL_SUMMARY_FIELDS = ['label', 'lastUpdated', 'documentationVersion', 'finalised', 'modelVersion', 'branchName']
+
+# URL templates request_url calls are grouped by in reports/crawl_metrics.json
+URL_TEMPLATES = {
+  'DATA_MODELS': DATA_MODELS,
+  'DATA_MODELS_PAGE': DATA_MODELS_PAGE,
+  'DATA_MODEL': DATA_MODEL,
+  'DATA_MODEL_ID': DATA_MODEL_ID,
+  'DATA_MODEL_METADATA': DATA_MODEL_METADATA,
+  'DATA_MODEL_CLASSES': DATA_MODEL_CLASSES,
+  'DATA_MODEL_CLASS': DATA_MODEL_CLASS,
+  'DATA_MODEL_CLASSES_ELEMENTS_PAGE': DATA_MODEL_CLASSES_ELEMENTS_PAGE,
+  'DATA_MODEL_SEMANTIC_LINKS': DATA_MODEL_SEMANTIC_LINKS,
+  'DATA_MODEL_PIDS': DATA_MODEL_PIDS,
+}
+
+# On-disk response cache used by request_url, enabled by main()
+response_cache = None
+# Responses change detection is based on, never served from the cache on age alone
+LISTING_TEMPLATES = URLClassifier({name: URL_TEMPLATES[name] for name in ('DATA_MODELS', 'DATA_MODELS_PAGE', 'DATA_MODEL_PIDS')})
+# Listing summaries of the previous run by model id, read by main(), and the listed ids whose summary differs
+previous_state = {}
+changed_models = set()
+# Per-endpoint request metrics, reset by main()
+telemetry = RequestTelemetry(URL_TEMPLATES)
+
+def must_revalidate(URL):
+  """Whether a cached response for URL may be out of date however recently it was stored
+
+  The listing and the pidList are what the next run detects changes with, and
+  the stored responses of a model whose listing summary changed since the
+  previous run predate that change.
+  """
+  if LISTING_TEMPLATES.classify(URL) != OTHER:
+    return True
+  return any(part in changed_models for part in urlsplit(URL).path.split('/'))
+
+def note_changed_models(items):
+  """Record which listed models have a different summary than in the previous run"""
+  for d in items:
+    if previous_state.get(d['id'], None) != model_summary(d):
+      changed_models.add(d['id'])
 
 def request_url(URL):
   """HTTP GET request and load into data_model"""
   print(URL)
-  r = requests.get(URL)
+  start = time.perf_counter()
+  try:
+    if response_cache is not None:
+      r = response_cache.fetch(URL, transport.get)
+    else:
+      r = transport.get(URL)
+  except requests.RequestException as e:
+    telemetry.record(URL, time.perf_counter() - start, error=e)
+    raise
+  telemetry.record(URL, time.perf_counter() - start, r)
   if r.status_code == requests.codes.unauthorized:
     return {}
   elif r.status_code == requests.codes.not_found:
@@ -53,25 +135,61 @@ def export_json(data, filename, indent=2):
   with open(filename, 'w') as jsonfile:
     json.dump(data, jsonfile, indent=indent)
 
-def get_data_elements(data_model_id, data_class_id):
+def format_data_element(d):
+  print("Processing Data Element: ", d['id'], " : ", d['label'])
+  d.pop('domainType', None)
+  d['name'] = d.pop('label', None)
+  d.pop('breadcrumbs', None)
+  d.pop('dataModel', None)
+  d.pop('dataClass', None)
+  d['dataType'] = d['dataType']['label']
+  return d
+
+def get_data_elements(data_model_id, data_class_id, workers=1, page_size=ELEMENTS_PAGE_SIZE):
+  """Fetch a data class's elements in offset/max pages.
+
+  The first page reports the total count; any further pages are fetched
+  concurrently and appended in order as they arrive.
+  """
   print("Processing Data Elements...")
   data = []
-  URL = DATA_MODEL_CLASSES_ELEMENTS.format(MODEL_ID=data_model_id, CLASS_ID=data_class_id)
-  de_row = request_url(URL)
+  def get_page(offset):
+    URL = DATA_MODEL_CLASSES_ELEMENTS_PAGE.format(MODEL_ID=data_model_id, CLASS_ID=data_class_id,
+                                                  OFFSET=offset, MAX=page_size)
+    return request_url(URL)
+  de_row = get_page(0)
   data_element_count = int(de_row.get('count', 0))
   if data_element_count > 0:
-    for d in de_row['items']:
-      print("Processing Data Element: ", d['id'], " : ", d['label'])
-      d.pop('domainType', None)
-      d['name'] = d.pop('label', None)
-      d.pop('breadcrumbs', None)
-      d.pop('dataModel', None)
-      d.pop('dataClass', None)
-      d['dataType'] = d['dataType']['label']
-      data.append(d)
+    data.extend(format_data_element(d) for d in de_row['items'])
+    offsets = range(page_size, data_element_count, page_size)
+    for de_row in ordered_map(get_page, offsets, workers=workers):
+      data.extend(format_data_element(d) for d in de_row.get('items', []))
   return data
 
-def get_data_classes(data_model_id):
+def get_data_class(data_model_id, data_class_id, workers=1):
+  print("Processing Data Class: ", data_class_id)
+  URL = DATA_MODEL_CLASS.format(MODEL_ID=data_model_id, CLASS_ID=data_class_id)
+  dc_row = request_url(URL)
+  # del dc_row['id']
+  dc_row.pop('domainType', None)
+  dc_row['name'] = dc_row.pop('label', None)
+  dc_row.pop('breadcrumbs', None)
+  dc_row.pop('dataModel', None)
+  dc_row.pop('editable', None)
+  dc_row.pop('lastUpdated', None)
+
+  # Collecting DataElements
+  data_elements = get_data_elements(data_model_id, data_class_id, workers=workers)
+  dc_row['dataElementsCount'] = len(data_elements)
+  dc_row['dataElements'] = data_elements
+  return dc_row
+
+def get_data_classes(data_model_id, workers=1):
+  """Harvest a data model's classes and their elements on a bounded thread pool.
+
+  Class details and element pages are fetched concurrently, but classes are
+  kept in catalogue order.
+  """
   print("Processing Data Classes...")
   data = {}
   URL = DATA_MODEL_CLASSES.format(MODEL_ID=data_model_id)
@@ -80,185 +198,105 @@ def get_data_classes(data_model_id):
   data['dataClassesCount'] = data_model_count
   data_classes = []
   if data_model_count > 0:
-    for d in dm_row['items']:
-      print("Processing Data Class: ", d['id'], " : ", d['label'])
-      URL = DATA_MODEL_CLASS.format(MODEL_ID=data_model_id, CLASS_ID=d['id'])
-      dc_row = request_url(URL)
-      # del dc_row['id']
-      dc_row.pop('domainType', None)
-      dc_row['name'] = dc_row.pop('label', None)
-      dc_row.pop('breadcrumbs', None)
-      dc_row.pop('dataModel', None)
-      dc_row.pop('editable', None)
-      dc_row.pop('lastUpdated', None)
-      
-      # Collecting DataElements
-      data_elements = get_data_elements(data_model_id, d['id'])
-      dc_row['dataElementsCount'] = len(data_elements)
-      dc_row['dataElements'] = data_elements
-      data_classes.append(dc_row)
+    class_ids = [d['id'] for d in dm_row['items']]
+    data_classes = list(ordered_map(lambda id: get_data_class(data_model_id, id, workers=workers),
+                                    class_ids, workers=workers))
   data['dataClasses'] = data_classes
   return data
 
-def get_semantic_links(data_model_id, data=None, seen_ids=[], latest=None):
+def get_semantic_links(data_model_id):
   print("Processing Semantic Links...", data_model_id)
-  if data is None:
-    data = {}
   URL = DATA_MODEL_SEMANTIC_LINKS.format(MODEL_ID=data_model_id)
-  ret = request_url(URL)
-  if ret.get('count', None) is None:
-    return { 'revisions': data }
-  if ret['count'] > 0:
-    for links in ret['items']:
-      src_ver = links['source']['documentationVersion']
-      src_id = links['source']['id']
-      data[src_ver] = src_id
-
-      tar_ver = links['target']['documentationVersion']
-      tar_id = links['target']['id']
-      data[tar_ver] = tar_id
-  seen_ids.append(data_model_id)
-  revision_ids = list(set(list(data.values())) - set(seen_ids))
-  for id in revision_ids:
-    new_data = get_semantic_links(id, data, seen_ids, latest)
-    data.update(new_data['revisions'])
-  data['latest'] = latest
-  return { 'revisions': data }
-
-def fix_dates(revisions):
+  return request_url(URL)
+
+def get_data_model(data_model_id):
+  URL = DATA_MODEL.format(MODEL_ID=data_model_id)
+  return request_url(URL)
+
+def fix_dates(revisions, model_cache):
+  """modified/issued for a version family, from the shared model summary cache"""
   print("Fixing Dates...")
-  from datetime import datetime
-  data = {}
-  last_updated = []
-  date_finalised = []
-  for version, id in revisions.items():
-    URL = DATA_MODELS + "/" + id
-    ret = request_url(URL)
-    if ret.get("lastUpdated", None) is not None:
-      try:
-        lu = datetime.strptime(ret["lastUpdated"], "%Y-%m-%dT%H:%M:%S.%fZ")
-      except ValueError:
-        lu = datetime.strptime(ret["lastUpdated"], "%Y-%m-%dT%H:%M:%SZ")
-    else:
-      lu = None
-    if ret.get("dateFinalised", None) is not None:
-      try:
-        du = datetime.strptime(ret["dateFinalised"], "%Y-%m-%dT%H:%M:%S.%fZ")
-      except ValueError:
-        du = datetime.strptime(ret["dateFinalised"], "%Y-%m-%dT%H:%M:%SZ")
-    else:
-      du = lu
-    if lu is not None: last_updated.append(lu)
-    if du is not None: date_finalised.append(du)
-  if len(last_updated) > 0:
-    data['modified'] = max(last_updated).strftime("%Y-%m-%dT%H:%M:%SZ")
-  else:
-    data['modified'] = None
-  if len(date_finalised) > 0:
-    data['issued'] = min(date_finalised).strftime("%Y-%m-%dT%H:%M:%SZ")
-  else:
-    data['issued'] = None
-  return data
+  return model_cache.family_dates(revisions)
 
 def get_structural_metadata_counts(data_classes):
-  DATA = {
-    'structuralMetadata.dataClassesCount': len(data_classes),
-    'structuralMetadata.tableName': len([dc['name'] for dc in data_classes if dc.get('name', None) is not None]),
-    'structuralMetadata.tableDescription': len([dc['description'] for dc in data_classes if dc.get('description', None) is not None]),
-    'structuralMetadata.dataElementsCount': sum([int(dc['dataElementsCount']) for dc in data_classes if dc.get('dataElementsCount', None) is not None]),
-    'structuralMetadata.columnName': 0,
-    'structuralMetadata.columnDescription': 0,
-    'structuralMetadata.dataType': 0,
-    'structuralMetadata.sensitive': 0
+  return TechnicalProfile([data_classes]).structural_metadata_counts()[0]
+
+def process_data_model(d, pids, revision_graph, model_cache, harvest_workers=1, superseded_by=None):
+  """Collect the v1 and v2 records for a single listed data model.
+
+  When superseded_by names the current version of the dataset, the data
+  classes and elements are not harvested: the records carry supersededBy
+  instead of dataClasses / structuralMetadata, and the quality checks leave
+  them out rather than score them as having no technical metadata.
+  """
+  print("Processing Data Model: {}".format(d['id']))
+  row = {
+    "@schema": {
+      "type": "Dataset",
+      "version": "2.0.1",
+      "url": "https://raw.githubusercontent.com/HDRUK/schemata/master/schema/dataset/latest/dataset.schema.json"
+    }
   }
-  for dc in data_classes:
-    DATA['structuralMetadata.columnName'] += len([de['name'] for de in dc.get('dataElements') if de.get('name', None) is not None])
-    DATA['structuralMetadata.columnDescription'] += len([de['description'] for de in dc.get('dataElements') if de.get('description', None) is not None])
-    DATA['structuralMetadata.dataType'] += len([de['dataType'] for de in dc.get('dataElements') if de.get('dataType', None) is not None])
-    # DATA['structuralMetadata.sensitive'] += len([de['sensitive'] for de in dc.get('dataElements') if de.get('sensitive', None) is not None])
-  return DATA
-
 
-def process_data_models(data_models_list):
-  print("Processing Data Models...")
-  headers = []
-  data = {}
-  data['count'] = data_models_list['count']
-  data_models = []
-  data_models_v2 = []
+  # Get PID for Dataset
+  pid = pids.resolve(d['id'])
+  if pid is not None:
+    row['pid'] = pid
   
-  # Collect PIDs for Datasets
-  pid_list = request_url(DATA_MODEL_PIDS)
-  export_json(pid_list, "pids.json")
-  # pid_list = read_json("pids.json")
-  i = 0
-  for d in data_models_list['items']:
-    i += 1
-    print("{}/{}: Processing Data Model: {}".format(i, data['count'], d['id']))
-    row = {
-      "@schema": {
-        "type": "Dataset",
-        "version": "2.0.1",
-        "url": "https://raw.githubusercontent.com/HDRUK/schemata/master/schema/dataset/latest/dataset.schema.json"
-      }
-    }
-
-    # Get PID for Dataset
-    for p in pid_list['data']:
-      if d['id'] in p['datasetIds']:
-        row['pid'] = p['pid']
-    
-    # Collect Data Model
-    URL = DATA_MODELS + "/{ID}".format(ID=d['id'])
-    dm = request_url(URL)
-    row.update(dm)
-    row['version'] = row.pop('documentationVersion', None)
-    
-    # Collect HDR UK Profile information
-    URL = DATA_MODEL_ID.format(MODEL_ID=d['id'])
-    dm = request_url(URL)
-    row.update(dm)
-
-    row_v2 = {
-      "@schema": {
-        "type": "Dataset",
-        "version": "2.0.1",
-        "url": "https://raw.githubusercontent.com/HDRUK/schemata/master/schema/dataset/latest/dataset.schema.json"
-      },
-      "pid": row.get('pid', None),
-      "id": row['id'],
-      "identifier": "https://web.www.healthdatagateway.org/dataset/" + dm['id'],
-      "version": row.get("version", None),
-      "lastUpdated": row.get('lastUpdated', None),
-      "dateFinalised": row.get('dateFinalised', None),
-      "summary": {
-        "title": row.get('label', None)
-      },
-      "documentation": {
-        "description": row.get('description', None)
-      }
+  # Collect Data Model
+  dm = model_cache.model(d['id'])
+  row.update(dm)
+  row['version'] = row.pop('documentationVersion', None)
+  
+  # Collect HDR UK Profile information
+  URL = DATA_MODEL_ID.format(MODEL_ID=d['id'])
+  dm = request_url(URL)
+  row.update(dm)
+
+  row_v2 = {
+    "@schema": {
+      "type": "Dataset",
+      "version": "2.0.1",
+      "url": "https://raw.githubusercontent.com/HDRUK/schemata/master/schema/dataset/latest/dataset.schema.json"
+    },
+    "pid": row.get('pid', None),
+    "id": row['id'],
+    "identifier": "https://web.www.healthdatagateway.org/dataset/" + dm['id'],
+    "version": row.get("version", None),
+    "lastUpdated": row.get('lastUpdated', None),
+    "dateFinalised": row.get('dateFinalised', None),
+    "summary": {
+      "title": row.get('label', None)
+    },
+    "documentation": {
+      "description": row.get('description', None)
     }
+  }
 
-    # Collect SemanticLinks
-    semantic_links = get_semantic_links(d['id'], latest=d['id'])
-    row.update(semantic_links)
-    row_v2.update(semantic_links)
-
-    # Fix Dates
-    dates = fix_dates(row['revisions'])
-    row.update(dates)
-    row_v2.update(dates)
-    row.pop('lastUpdated', None)
-    row.pop('dateFinalised', None)
-    row_v2.pop('lastUpdated', None)
-    row_v2.pop('dateFinalised', None)
-
-    # Collect HDR UK V2 Metadata Profile information
-    metadata_v2 = get_v2_metadata(row['id'])
-    row_v2 = generate_nested_dict(row_v2, metadata_v2)
-
-    # Collecting Data Classes
-    data_classes = get_data_classes(d['id'])
+  # Collect SemanticLinks
+  semantic_links = {'revisions': revision_graph.revisions(d['id'])}
+  row.update(semantic_links)
+  row_v2.update(semantic_links)
+
+  # Fix Dates
+  dates = fix_dates(row['revisions'], model_cache)
+  row.update(dates)
+  row_v2.update(dates)
+  row.pop('lastUpdated', None)
+  row.pop('dateFinalised', None)
+  row_v2.pop('lastUpdated', None)
+  row_v2.pop('dateFinalised', None)
+
+  # Collect HDR UK V2 Metadata Profile information
+  metadata_v2 = get_v2_metadata(row['id'])
+  row_v2 = generate_nested_dict(row_v2, metadata_v2)
+
+  # Collecting Data Classes
+  if superseded_by is not None:
+    row['supersededBy'] = superseded_by
+    row_v2['supersededBy'] = superseded_by
+  else:
+    data_classes = get_data_classes(d['id'], workers=harvest_workers)
     row.update(data_classes)
     data_classes = data_classes['dataClasses']
     structuralMetadataCount = get_structural_metadata_counts(data_classes)
@@ -269,17 +307,269 @@ def process_data_models(data_models_list):
       }
     })
 
+  if len(metadata_v2) == 0:
+    row_v2 = None
+  return row, row_v2
+
+def model_summary(d):
+  """Fingerprint of a listed data model, compared between runs to detect changes"""
+  return {k: d.get(k, None) for k in MODEL_SUMMARY_FIELDS}
+
+def baseline_summary(row):
+  """The parts of a previous run's v1 record the reuse decisions look at"""
+  return {'revisions': row.get('revisions', None) or {}, 'structural': 'dataClasses' in row}
+
+def load_baseline(v1_filename=DATASETS_JSON, v2_filename=DATASETS_V2_JSON, state_filename=CRAWL_STATE_JSON):
+  """Index the previous run's outputs as a baseline for an incremental crawl.
+
+  The records stay on disk: 'v1' and 'v2' map data model ids to records that
+  are read back one at a time when a model is reused, and only the revisions
+  of each v1 record are held in memory, in baseline['v1'].summaries.
+
+  @return: dict with 'v1', 'v2' (IndexedJSONRecords) and 'state' indexed by
+           data model id, or None if any of the previous outputs is missing
+  """
+  if not all(os.path.isfile(f) for f in (v1_filename, v2_filename, state_filename)):
+    return None
+  try:
+    baseline = {
+      'v1': IndexedJSONRecords(v1_filename, summarise=baseline_summary),
+      'v2': IndexedJSONRecords(v2_filename),
+      'state': read_json(state_filename).get('models', {}),
+    }
+  except ValueError as e:
+    print("Not reusing the previous run:", e)
+    return None
+  print("Indexed baseline of", len(baseline['v1']), "V1 &", len(baseline['v2']), "V2 records.")
+  return baseline
+
+def find_unchanged_models(items, baseline):
+  """Listed model ids whose summary, and that of every listed revision, match the baseline"""
+  if baseline is None:
+    return set()
+  summaries = {d['id']: model_summary(d) for d in items}
+  candidates = set(
+    id for id, summary in summaries.items()
+    if id in baseline['v1'] and baseline['state'].get(id, None) == summary
+  )
+  unchanged = set()
+  for id in candidates:
+    revision_ids = [rid for v, rid in baseline['v1'].summaries[id]['revisions'].items() if v != 'latest']
+    if all(rid in candidates or rid not in summaries for rid in revision_ids):
+      unchanged.add(id)
+  return unchanged
+
+def reuse_data_model(id, baseline, pids):
+  """Rebuild the v1 and v2 records of an unchanged model from the baseline"""
+  row = baseline['v1'][id]
+  row_v2 = baseline['v2'].get(id, None)
+  pid = pids.resolve(id)
+  if pid is not None:
+    row['pid'] = pid
+  else:
+    row.pop('pid', None)
+  if row_v2 is not None:
+    row_v2['pid'] = pid
+  return row, row_v2
+
+def stale_revisions(ids, revision_graph, baseline, reused):
+  """Reused model ids whose stored revisions differ from the family of a model being crawled"""
+  stale = set()
+  for id in ids:
+    revisions = {v: rid for v, rid in revision_graph.revisions(id).items() if v != 'latest'}
+    for rid in revisions.values():
+      if rid in reused:
+        stored = {v: i for v, i in baseline['v1'].summaries[rid]['revisions'].items() if v != 'latest'}
+        if stored != revisions:
+          stale.add(rid)
+  return stale
+
+def current_version(id, pids, revision_graph):
+  """Id of the current version of a data model's dataset.
+
+  The candidates are the datasetIds sharing the model's PID, or its revision
+  family when it has no PID, ordered by the documentationVersion recorded in
+  the revision graph. The model itself is returned when no newer version is known.
+  """
+  pid = pids.resolve(id)
+  if pid is not None:
+    candidates = pids.dataset_ids(pid)
+  else:
+    candidates = [rid for v, rid in revision_graph.revisions(id).items() if v != 'latest']
+  current = revision_graph.latest([id] + candidates)
+  return id if current is None else current
+
+def with_pid_versions(ids, pids):
+  """ids followed by every other datasetId sharing a PID with one of them"""
+  ids = list(ids)
+  versions = [rid for id in ids for rid in pids.dataset_ids(pids.resolve(id))]
+  return list(dict.fromkeys(ids + versions))
+
+def crawl_state(items):
+  return {'models': {d['id']: model_summary(d) for d in items}}
+
+def listing_summary(d):
+  """The parts of a /dataModels listing item the crawl keeps"""
+  summary = model_summary(d)
+  summary['id'] = d['id']
+  return summary
+
+def get_data_models(page_size=LISTING_PAGE_SIZE):
+  """Paged /dataModels listing; its count is available as soon as this returns"""
+  def get_page(offset, max):
+    return request_url(DATA_MODELS_PAGE.format(OFFSET=offset, MAX=max))
+  return PagedListing(get_page, page_size=page_size, summarise=listing_summary)
+
+def iter_data_models(listing, workers=1, max_in_flight=None, baseline=None, model_cache=None,
+                     harvest_workers=1, journal=None, latest_only=False):
+  """Yield (row, row_v2) for every listed data model, in listing order.
+
+  Models are fetched concurrently when workers > 1, with at most max_in_flight
+  finished-but-unconsumed models held in memory. A full crawl starts on each
+  listing page as soon as it arrives. When a baseline from the previous run is
+  given, the whole listing is read first and models whose listing summary is
+  unchanged are reused from the baseline instead of being crawled again. Data
+  model responses and their dates are shared through model_cache. row_v2 is
+  None for models without v2 metadata. Every crawled model is recorded in
+  journal as soon as it is finished, and models already in the journal, under
+  the listing summary reported now, are read back instead of being crawled.
+
+  With latest_only, data classes and elements are only harvested for the
+  current version of each dataset (see current_version); superseded versions
+  get records without structural metadata, marked supersededBy.
+  """
+  print("Processing Data Models...")
+  count = listing.count
+
+  # Collect PIDs for Datasets
+  pids = PIDResolver(request_url(DATA_MODEL_PIDS))
+  pids.save()
+
+  if model_cache is None:
+    model_cache = ModelSummaryCache(get_data_model, workers=workers)
+  revision_graph = RevisionGraph(get_semantic_links)
+  def finished(d):
+    """Whether d is in the journal, recorded from the summary the listing reports now"""
+    return journal is not None and journal.matches(d['id'], model_summary(d))
+
+  reused = set()
+  # current version of each reused record that was stored without structural metadata
+  reused_superseded = {}
+  if baseline is not None:
+    # Reuse compares every listed summary with the baseline, so it needs the whole listing
+    items = list(listing)
+    note_changed_models(items)
+    model_cache.admit(items)
+    reused = find_unchanged_models(items, baseline)
+    # Baseline records without structural metadata are only reusable while they are still superseded
+    partial = set(id for id in reused if not baseline['v1'].summaries[id]['structural'])
+    if latest_only:
+      revision_graph.build(with_pid_versions(sorted(partial), pids), workers=workers)
+      reused_superseded = {id: current_version(id, pids, revision_graph) for id in partial}
+      partial = set(id for id, current in reused_superseded.items() if current == id)
+    reused -= partial
+    pending = [d['id'] for d in items if d['id'] not in reused]
+    while len(pending):
+      revision_graph.build(with_pid_versions(pending, pids) if latest_only else pending, workers=workers)
+      # Re-crawl reused family members whose revisions changed under them
+      stale = stale_revisions(pending, revision_graph, baseline, reused)
+      reused -= stale
+      pending = sorted(stale)
+    print("Reusing", len(reused), "unchanged data models from the previous run.")
+    pages = [items]
+  else:
+    pages = listing.pages()
+
+  def planned():
+    for page in pages:
+      if baseline is None:
+        # Complete the version families of this page before its models are crawled
+        note_changed_models(page)
+        model_cache.admit(page)
+        ids = [d['id'] for d in page if not finished(d)]
+        revision_graph.build(with_pid_versions(ids, pids) if latest_only else ids, workers=workers)
+      for d in page:
+        yield d
+
+  superseded = []
+  def collect(d):
+    if d['id'] in reused:
+      row, row_v2 = reuse_data_model(d['id'], baseline, pids)
+      if d['id'] in reused_superseded:
+        # the dataset may have gained a newer version since the record was stored
+        for record in (row, row_v2):
+          if record is not None:
+            record['supersededBy'] = reused_superseded[d['id']]
+      return row, row_v2
+    if finished(d):
+      return journal.load(d['id'])
+    superseded_by = None
+    if latest_only:
+      current = current_version(d['id'], pids, revision_graph)
+      if current != d['id']:
+        superseded_by = current
+        superseded.append(d['id'])
+    row, row_v2 = process_data_model(d, pids, revision_graph, model_cache, harvest_workers, superseded_by)
+    if journal is not None:
+      journal.record(d['id'], row, row_v2, model_summary(d))
+    return row, row_v2
+
+  for i, (row, row_v2) in enumerate(ordered_map(collect, planned(), workers=workers, max_in_flight=max_in_flight),
+                                    start=1):
+    print("{}/{}: Processed Data Model: {}".format(i, count, row['id']))
+    yield row, row_v2
+  if latest_only:
+    print("Skipped structural metadata of", len(superseded), "superseded data model versions.")
+
+def process_data_models(listing, workers=1, max_in_flight=None, baseline=None, model_cache=None,
+                        harvest_workers=1, journal=None, latest_only=False):
+  """Crawl every listed data model and collect the v1 and v2 records in listing order"""
+  data = {}
+  data['count'] = listing.count
+  data_models = []
+  data_models_v2 = []
+  rows_v2 = []
+  for row, row_v2 in iter_data_models(listing, workers=workers, max_in_flight=max_in_flight,
+                                      baseline=baseline, model_cache=model_cache,
+                                      harvest_workers=harvest_workers, journal=journal,
+                                      latest_only=latest_only):
     data_models.append(row)
-    if len(metadata_v2) > 0:
+    rows_v2.append(row_v2)
+    if row_v2 is not None:
       data_models_v2.append(row_v2)
     
   data['dataModels'] = data_models
+  # v2 row (or None) for each v1 row, in the same order
+  data['rowsV2'] = rows_v2
   data['dataModelsV2'] = data_models_v2
   data['count_v1'] = len(data_models)
   data['count_v2'] = len(data_models_v2)
+  data['state'] = crawl_state(listing.items)
   print("Retrieved ", data['count_v1'], "V1 records & ", data['count_v2'], " V2 records.")
   return data
 
+def stream_data_models(models, store):
+  """Write each crawled model to datasets(.v2).json and .ndjson as soon as it is finished.
+
+  Each model is also added to the SQLite catalogue store. Only the model ids
+  are kept afterwards, so the element trees of a model can be released as
+  soon as it has been written.
+  @return: lightweight v1 index used for the sitemap and v2 record count
+  """
+  data_models = []
+  with StreamingJSONWriter(DATASETS_JSON) as v1_json, StreamingJSONWriter(DATASETS_V2_JSON) as v2_json, \
+       NDJSONWriter(DATASETS_NDJSON) as v1_ndjson, NDJSONWriter(DATASETS_V2_NDJSON) as v2_ndjson:
+    for row, row_v2 in models:
+      v1_json.write(row)
+      v1_ndjson.write(row)
+      if row_v2 is not None:
+        v2_json.write(row_v2)
+        v2_ndjson.write(row_v2)
+      store.write_data_model(row, row_v2)
+      data_models.append({'id': row['id']})
+  print("Retrieved ", v1_json.count, "V1 records & ", v2_json.count, " V2 records.")
+  return {'count': v1_json.count, 'dataModels': data_models}, v2_json.count
+
 def get_leaves(item, key=None):
   if isinstance(item, dict):
     leaves = {}
@@ -296,60 +586,18 @@ def get_leaves(item, key=None):
 
 
 def export_csv_tables(data, filename):
-  # First parse all entries to get the complete fieldname list
-  fieldnames = set()
-
-  for entry in data['dataModels']:
-    fieldnames.update(get_leaves(entry).keys())
-  
-  with open(filename, 'w', newline='') as csv_file:
-    csv_output = csv.DictWriter(csv_file, fieldnames=sorted(fieldnames), delimiter=',', quotechar='\"')
-    csv_output.writeheader()
-    csv_output.writerows(get_leaves(entry) for entry in data['dataModels'])
-
-def format_csv_tables(data):
-  tables = {
-    'dataModels': {'data': [], 'headers': []},
-    'dataClasses': {'data': [], 'headers': []},
-    'dataElements': {'data': [], 'headers': []},
-  }
-  for dm in data['dataModels']:
-    for dc in dm['structuralMetadata'].get('dataClasses', []):
-      for de in dc.get('dataElements', []):
-        # de['dataTypeLabel'] = de['dataType']['label']
-        de['dataType'] = de.get('dataType', None)
-        de['dataModel'] = dm.get('id', None)
-        de['dataClass'] = dc.get('id', None)
-        # Append dataElement to tables
-        tables['dataElements']['data'].append(de)
-        tables['dataElements']['headers'].extend(de.keys())
-      # Add dataElement IDs to dataClass
-      data_elements = [de['id'] for de in dc['dataElements']]
-      dc['dataElements'] = ", ".join(data_elements)
-      # Append dataClass to tables
-      tables['dataClasses']['data'].append(dc)
-      tables['dataClasses']['headers'].extend(dc.keys())
-    # Add dataClasses to dataModel
-    data_classes = [dc.get('id', None) for dc in dm['structuralMetadata'].get('dataClasses', [])]
-    data_classes = [dc for dc in data_classes if dc is not None]
-    data['dataClasses'] = ", ".join(data_classes)
-    tables['dataModels']['data'].append(dm)
-    tables['dataModels']['headers'].extend(dm.keys())
-  tables['dataModels']['headers'] = list(set(tables['dataModels']['headers']))
-  tables['dataClasses']['headers'] = list(set(tables['dataClasses']['headers']))
-  tables['dataElements']['headers'] = list(set(tables['dataElements']['headers']))
-  print("Count: DM ", data['count'], len(data['dataModels']), len(tables['dataModels']['data']))
-  print("Count: DC ", len(tables['dataClasses']['data']))
-  print("Count: DE ", len(tables['dataElements']['data']))
-  return tables
-
-def lookup_pids(data):
-  pid_list = request_url(DATA_MODEL_PIDS)
+  # Single pass: the fieldname list is collected while rows are spooled
+  with SpooledCSVWriter(filename) as csv_output:
+    for entry in data['dataModels']:
+      csv_output.write(get_leaves(entry))
+
+def lookup_pids(data, pids=None):
+  if pids is None:
+    pids = PIDResolver(request_url(DATA_MODEL_PIDS))
   for d in data['dataModels']:
-    id = d['id']
-    for p in pid_list['data']:
-      if id in p['datasetIds']:
-        d['pid'] = p['pid']
+    pid = pids.resolve(d['id'])
+    if pid is not None:
+      d['pid'] = pid
   return data
 
 
@@ -382,64 +630,110 @@ def nested_set(dic, keys, value):
   dic[keys[-1]] = value
 
 def generate_nested_dict(metadata, data):
-  for d in data:
-    nested_set(metadata, d[0], d[1])
-  return metadata
+  return build_document(metadata, data)
 
 def get_v2_metadata(id):
-  import ast
   print("Downloading V2 metadata...")
   URL = DATA_MODEL_METADATA.format(MODEL_ID=id)
   data = request_url(URL)
-  metadata = []
-  for md in data['items']:
-    # TODO: FIX MDW Bug
-    if md['key'] == "properties/observations/observations":
-      md['key'] = "properties/observations"
-    if md['value'].startswith("[") and md['value'].endswith("]"):
-      md['value'] = ast.literal_eval(md['value'])
-    if md['namespace'] == 'org.healthdatagateway':
-      if md['key'] == "structuralMetadata":
-        metadata.append(([md['key']], md['value']))
-      elif md['key'].startswith('properties/'):
-        key = str(md['key'].split('properties/')[1])
-        keys = key.split("/")
-        metadata.append((keys, md['value']))
-      # FIXME: Gateway dataModel attributes without properties/ prefix :(
-      else:
-        keys = md['key'].split("/")
-        metadata.append((keys, md['value']))
-  return metadata
-
-
-def main():
-  data_models_list = request_url(DATA_MODELS)
-  print(data_models_list['count'])
-
-  data = process_data_models(data_models_list)
-  data_v1 = {
-    'count': data['count_v1'],
-    'dataModels': data['dataModels']
-  }
-  data_v2 = {
-    'count': data['count_v2'],
-    'dataModels': data['dataModelsV2']
-  }
-
-  export_json(data_v1, 'datasets.json')
-  export_json(data_v2, 'datasets.v2.json')
+  return decode_metadata(data['items'])
+
+
+def main(workers=1, max_in_flight=None, cache_dir=HTTP_CACHE_DIR, cache_ttl=HTTP_CACHE_TTL, full=False,
+         harvest_workers=1, stream=False, resume=False, listing_page_size=LISTING_PAGE_SIZE, latest_only=False):
+  global response_cache, telemetry, previous_state, changed_models
+  previous_state = read_json(CRAWL_STATE_JSON).get('models', {}) if os.path.isfile(CRAWL_STATE_JSON) else {}
+  changed_models = set()
+  if cache_dir is not None:
+    response_cache = ResponseCache(cache_dir, ttl=cache_ttl, revalidate=must_revalidate)
+  telemetry = RequestTelemetry(URL_TEMPLATES)
+  rate_limit.controller.use_templates(URL_TEMPLATES)
+
+  listing = get_data_models(page_size=listing_page_size)
+  print(listing.count)
+
+  baseline = None if full else load_baseline()
+  model_cache = ModelSummaryCache(get_data_model, MODEL_SUMMARY_CACHE if cache_dir is not None else None,
+                                  workers=workers)
+  # Stored summaries are admitted as the listing pages arrive
+  model_cache.load()
+  journal = CrawlJournal(CRAWL_JOURNAL, resume=resume)
+  store = CatalogueStore(CATALOGUE_DB).create()
+  if stream:
+    models = iter_data_models(listing, workers=workers, max_in_flight=max_in_flight,
+                              baseline=baseline, model_cache=model_cache, harvest_workers=harvest_workers,
+                              journal=journal, latest_only=latest_only)
+    data_v1, count_v2 = stream_data_models(models, store)
+    data_v2 = {
+      'count': count_v2,
+      'dataModels': iter_ndjson(DATASETS_V2_NDJSON)
+    }
+  else:
+    data = process_data_models(listing, workers=workers, max_in_flight=max_in_flight,
+                               baseline=baseline, model_cache=model_cache, harvest_workers=harvest_workers,
+                               journal=journal, latest_only=latest_only)
+    data_v1 = {
+      'count': data['count_v1'],
+      'dataModels': data['dataModels']
+    }
+    data_v2 = {
+      'count': data['count_v2'],
+      'dataModels': data['dataModelsV2']
+    }
+    export_json(data_v1, DATASETS_JSON)
+    export_json(data_v2, DATASETS_V2_JSON)
+    for row, row_v2 in zip(data['dataModels'], data['rowsV2']):
+      store.write_data_model(row, row_v2)
+  model_cache.save()
+  baseline = None
+  export_json(crawl_state(listing.items), CRAWL_STATE_JSON)
+  store.write_pids(load_pid_index())
+  store.close()
+  journal.complete()
 
   # generate sitemap
   generate_sitemap(data_v1, 'sitemap.txt')
   
   # generate CSV tables
   # data_v2 = read_json('datasets.v2.json')
-  tables = format_csv_tables(data_v2)
-  export_csv(tables['dataModels']['data'], 'datasets.csv', tables['dataModels']['headers'])
-  export_csv(tables['dataClasses']['data'], 'dataclasses.csv', tables['dataClasses']['headers'])
-  export_csv(tables['dataElements']['data'], 'dataelements.csv', tables['dataElements']['headers'])
+  export_tables(data_v2['dataModels'], 'datasets.csv', 'dataclasses.csv', 'dataelements.csv')
+
+  if response_cache is not None:
+    print("HTTP cache:", response_cache.summary())
+  print("Rate limits:", rate_limit.controller.summary())
+  telemetry.write(CRAWL_METRICS_JSON, hosts=rate_limit.controller.summary())
 
 
 if __name__ == "__main__":
-    main()
+  import argparse
+  parser = argparse.ArgumentParser(description='Collect v1 and v2 datasets from the Metadata Catalogue')
+  parser.add_argument('--workers', metavar='N', type=int, default=CRAWL_WORKERS,
+                      help='Number of data models crawled concurrently (1 = serial)')
+  parser.add_argument('--harvest-workers', metavar='N', dest='harvest_workers', type=int, default=HARVEST_WORKERS,
+                      help='Number of data classes and element pages fetched concurrently per data model')
+  parser.add_argument('--max-in-flight', metavar='N', dest='max_in_flight', type=int, default=None,
+                      help='Maximum data models queued or in progress at once (default: 2 x workers)')
+  parser.add_argument('--cache-dir', metavar='DIR', dest='cache_dir', type=str, default=HTTP_CACHE_DIR,
+                      help='Directory for the on-disk HTTP response cache')
+  parser.add_argument('--cache-ttl', metavar='SECONDS', dest='cache_ttl', type=int, default=HTTP_CACHE_TTL,
+                      help='Reuse cached responses without ETag/Last-Modified for this many seconds, '
+                           'except for the listing, the pidList and models whose listing summary changed')
+  parser.add_argument('--no-cache', dest='cache_dir', action='store_const', const=None,
+                      help='Disable the HTTP response cache')
+  parser.add_argument('--stream', action='store_true',
+                      help='Write each data model to datasets(.v2).json and datasets(.v2).ndjson as soon as it is crawled')
+  parser.add_argument('--resume', action='store_true',
+                      help='Skip data models already recorded in the crawl journal by an interrupted run')
+  parser.add_argument('--full', action='store_true',
+                      help='Crawl every data model instead of reusing unchanged ones from the previous run')
+  parser.add_argument('--listing-page-size', metavar='N', dest='listing_page_size', type=int,
+                      default=LISTING_PAGE_SIZE, help='Data models requested per /dataModels listing page')
+  parser.add_argument('--latest-only', dest='latest_only', action='store_true',
+                      help='Harvest data classes and elements only for the current version of each dataset')
+  args = parser.parse_args()
+
+  main(workers=args.workers, max_in_flight=args.max_in_flight,
+       cache_dir=args.cache_dir, cache_ttl=args.cache_ttl, full=args.full,
+       harvest_workers=args.harvest_workers, stream=args.stream,
+       resume=args.resume, listing_page_size=args.listing_page_size, latest_only=args.latest_only)
 
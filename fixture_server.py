@@ -0,0 +1,459 @@
+#!/usr/bin/env python
+# usage: fixture_server.py [--port 8765] [--models 300] [--latency 0.05] [--error-rate 0.01] [--throttle-rate 0.01]
+#
+# Local stand-in for the Metadata Catalogue and Gateway APIs. Point the crawl scripts at it with
+#   MDC_API_BASE_URL=http://127.0.0.1:8765/hdruk/api GATEWAY_API_BASE_URL=http://127.0.0.1:8765 python datasets.py
+__license__ = "Apache 2"
+
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from urllib.parse import urlsplit, parse_qs, quote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+FIXTURE_PORT = 8765
+MDC_PREFIX = "/hdruk/api"
+# Where --record fetches fixtures that are not on disk yet
+UPSTREAMS = {
+  MDC_PREFIX: "https://metadata-catalogue.org",
+  "/api/": "https://api.www.healthdatagateway.org",
+}
+
+
+def _query_int(query, name, default):
+  try:
+    return int(query.get(name, [default])[0])
+  except ValueError:
+    return default
+
+
+def _page(items, query):
+  """Sort and slice items by the sort/order/offset/max parameters the Metadata Catalogue understands"""
+  if 'sort' in query:
+    sort = query['sort'][0]
+    items = sorted(items, key=lambda item: str(item.get(sort, '')), reverse=query.get('order', ['asc'])[0] == 'desc')
+  if 'offset' not in query and 'max' not in query:
+    return items
+  offset = _query_int(query, 'offset', 0)
+  return items[offset:offset + _query_int(query, 'max', len(items))]
+
+
+class SyntheticCatalogue:
+  """Deterministic catalogue of data models, grouped into PID version families.
+
+  Every response is computed from the model and class indices, so a given
+  configuration always serves the same catalogue.
+  """
+
+  def __init__(self, models=300, family_size=3, classes=4, elements=25, base_url=""):
+    """
+    @param models: number of listed data models
+    @param family_size: versions per PID, linked by semantic links
+    @param classes: data classes per model
+    @param elements: data elements per class
+    @param base_url: address of this server, used for URLs inside Gateway records
+    """
+    self.count = models
+    self.family_size = family_size
+    self.classes = classes
+    self.elements = elements
+    self.base_url = base_url
+    self.ids = ["{:08x}-0000-4000-8000-{:012x}".format(i, i) for i in range(models)]
+    self.index = {id: i for i, id in enumerate(self.ids)}
+    self.routes = [
+      (re.compile(r"^/hdruk/api/dataModels$"), self.data_models),
+      (re.compile(r"^/hdruk/api/dataModels/([^/]+)$"), self.data_model),
+      (re.compile(r"^/hdruk/api/facets/([^/]+)/profile/.+$"), self.profile),
+      (re.compile(r"^/hdruk/api/facets/([^/]+)/metadata$"), self.metadata),
+      (re.compile(r"^/hdruk/api/catalogueItems/([^/]+)/semanticLinks$"), self.semantic_links),
+      (re.compile(r"^/hdruk/api/dataModels/([^/]+)/dataClasses$"), self.data_classes),
+      (re.compile(r"^/hdruk/api/dataModels/([^/]+)/dataClasses/([^/]+)$"), self.data_class),
+      (re.compile(r"^/hdruk/api/dataModels/([^/]+)/dataClasses/([^/]+)/dataElements$"), self.data_elements),
+      (re.compile(r"^/api/v1/datasets/pidList$"), self.pid_list),
+      (re.compile(r"^/api/v2/datasets$"), self.gateway_datasets),
+    ]
+
+  def resolve(self, path, query):
+    """JSON body for a request path, or None when nothing is served there"""
+    for pattern, handler in self.routes:
+      m = pattern.match(path)
+      if m is not None:
+        return handler(query, *m.groups())
+    return None
+
+  def _model_index(self, id):
+    return self.index.get(id, None)
+
+  def _family(self, i):
+    start = i - i % self.family_size
+    return list(range(start, min(start + self.family_size, self.count)))
+
+  def _summary(self, i):
+    family = self._family(i)
+    return {
+      'id': self.ids[i],
+      'domainType': 'DataModel',
+      'label': "Dataset {}".format(i // self.family_size),
+      'documentationVersion': "{}.0.0".format(family.index(i) + 1),
+      'lastUpdated': "2021-{:02d}-{:02d}T10:00:00.{:03d}Z".format(i % 12 + 1, i % 28 + 1, i % 1000),
+      'finalised': True,
+      'modelVersion': "{}.0.0".format(family.index(i) + 1),
+      'branchName': 'main',
+    }
+
+  def data_models(self, query):
+    return {'count': self.count, 'items': _page([self._summary(i) for i in range(self.count)], query)}
+
+  def data_model(self, query, id):
+    i = self._model_index(id)
+    if i is None:
+      return None
+    dm = self._summary(i)
+    dm.update({
+      'description': "Synthetic data model {} for crawl benchmarking".format(i),
+      'dateFinalised': "2020-{:02d}-{:02d}T09:00:00Z".format(i % 12 + 1, i % 28 + 1),
+      'author': "Benchmark",
+      'organisation': "Publisher {}".format(i % 7),
+      'editable': False,
+    })
+    return dm
+
+  def profile(self, query, id):
+    i = self._model_index(id)
+    if i is None:
+      return None
+    return {
+      'id': id,
+      'title': "Dataset {}".format(i // self.family_size),
+      'publisher': "ALLIANCE > PUBLISHER {}".format(i % 7),
+      'abstract': "Abstract of dataset {}".format(i),
+      'keywords': "benchmark,synthetic,dataset{}".format(i % 5),
+      'contactPoint': "dataset{}@example.org".format(i),
+      'accessRights': "{}/pages/access/{}".format(self.base_url, i),
+    }
+
+  def metadata(self, query, id):
+    i = self._model_index(id)
+    if i is None:
+      return None
+    if i % 10 == 9:
+      # Some models have no v2 metadata and are left out of datasets.v2.json
+      return {'count': 0, 'items': []}
+    values = [
+      ("properties/summary/abstract", "Abstract of dataset {}".format(i)),
+      ("properties/summary/publisher/name", "PUBLISHER {}".format(i % 7)),
+      ("properties/summary/keywords", json.dumps(["benchmark", "synthetic", "dataset{}".format(i % 5)])),
+      ("properties/documentation/description", "Synthetic data model {}".format(i)),
+      ("properties/coverage/spatial", "United Kingdom"),
+      ("properties/provenance/temporal/accrualPeriodicity", "Monthly"),
+      ("properties/accessibility/access/accessRights", "['{}/pages/access/{}']".format(self.base_url, i)),
+      ("properties/observations/observations",
+       "[{'observedNode': 'PERSONS', 'measuredValue': %d, 'measuredProperty': 'Count'}]" % (1000 * i)),
+    ]
+    items = [{'namespace': 'org.healthdatagateway', 'key': k, 'value': v} for k, v in values]
+    items.append({'namespace': 'org.example', 'key': 'ignored', 'value': 'ignored'})
+    return {'count': len(items), 'items': items}
+
+  def semantic_links(self, query, id):
+    i = self._model_index(id)
+    if i is None:
+      return None
+    family = self._family(i)
+    items = []
+    for older, newer in zip(family, family[1:]):
+      if i in (older, newer):
+        items.append({
+          'linkType': 'Superseded By',
+          'source': {'id': self.ids[newer], 'documentationVersion': self._summary(newer)['documentationVersion']},
+          'target': {'id': self.ids[older], 'documentationVersion': self._summary(older)['documentationVersion']},
+        })
+    return {'count': len(items), 'items': items}
+
+  def _class_id(self, i, c):
+    return "{}-c{:03d}".format(self.ids[i], c)
+
+  def _class(self, i, c):
+    return {
+      'id': self._class_id(i, c),
+      'domainType': 'DataClass',
+      'label': "TABLE_{}".format(c),
+      'description': "Table {} of data model {}".format(c, i) if c % 4 != 3 else None,
+      'dataModel': self.ids[i],
+      'breadcrumbs': [{'id': self.ids[i], 'label': "Dataset {}".format(i // self.family_size)}],
+      'editable': False,
+      'lastUpdated': self._summary(i)['lastUpdated'],
+    }
+
+  def data_classes(self, query, id):
+    i = self._model_index(id)
+    if i is None:
+      return None
+    items = [self._class(i, c) for c in range(self.classes)]
+    return {'count': len(items), 'items': _page(items, query)}
+
+  def _class_index(self, i, class_id):
+    for c in range(self.classes):
+      if self._class_id(i, c) == class_id:
+        return c
+    return None
+
+  def data_class(self, query, id, class_id):
+    i = self._model_index(id)
+    c = self._class_index(i, class_id) if i is not None else None
+    if c is None:
+      return None
+    return self._class(i, c)
+
+  def data_elements(self, query, id, class_id):
+    i = self._model_index(id)
+    c = self._class_index(i, class_id) if i is not None else None
+    if c is None:
+      return None
+    items = [{
+      'id': "{}-e{:04d}".format(class_id, e),
+      'domainType': 'DataElement',
+      'label': "COLUMN_{}".format(e),
+      'description': "Column {} of table {}".format(e, c) if e % 5 != 4 else None,
+      'dataType': {'label': ['VARCHAR', 'INTEGER', 'DATE', 'DECIMAL'][e % 4]},
+      'dataModel': self.ids[i],
+      'dataClass': class_id,
+      'breadcrumbs': [],
+    } for e in range(self.elements)]
+    return {'count': len(items), 'items': _page(items, query)}
+
+  def pid_list(self, query):
+    pids = {}
+    for i in range(self.count):
+      pids.setdefault(i // self.family_size, []).append(self.ids[i])
+    return {'success': True, 'data': [
+      {'pid': "{:08x}-pid0-4000-8000-{:012x}".format(p, p), 'datasetIds': ids} for p, ids in pids.items()
+    ]}
+
+  def gateway_datasets(self, query):
+    latest = [family[-1] for family in (self._family(i) for i in range(0, self.count, self.family_size))]
+    datasets = [{
+      '_id': "{:024x}".format(i),
+      'name': "Dataset {}".format(i // self.family_size),
+      'pid': "{:08x}-pid0-4000-8000-{:012x}".format(i // self.family_size, i // self.family_size),
+      'datasetid': self.ids[i],
+      'submittedDataAccessRequests': 0,
+      'datasetfields': {'publisher': "ALLIANCE > PUBLISHER {}".format(i % 7)},
+      'datasetv2': {
+        'summary': {'publisher': {'name': "PUBLISHER {}".format(i % 7)}},
+        'documentation': {
+          'description': "See {}/pages/docs/{}".format(self.base_url, i),
+          'associatedMedia': ["{}/pages/media/{}".format(self.base_url, i)],
+        },
+        'accessibility': {
+          'usage': {'investigations': ["{}/pages/investigations/{}".format(self.base_url, i)]},
+          'access': {
+            'accessRights': ["{}/pages/access/{}".format(self.base_url, i)],
+            'accessService': "Safe haven",
+            'accessRequestCost': "{}/pages/cost/{}".format(self.base_url, i),
+          },
+        },
+        'enrichmentAndLinkage': {'tools': ["{}/pages/tools/{}".format(self.base_url, i)]},
+      },
+    } for i in latest]
+    if 'page' in query or 'limit' in query:
+      limit = _query_int(query, 'limit', 100)
+      page = _query_int(query, 'page', 1)
+      datasets = datasets[(page - 1) * limit:page * limit]
+    return {'success': True, 'datasets': datasets}
+
+
+class FixtureServer(ThreadingHTTPServer):
+  """HTTP server answering catalogue requests with injected latency and faults"""
+
+  daemon_threads = True
+
+  def __init__(self, address, catalogue, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0,
+               retry_after=1, fixtures=None, record=False, seed=0):
+    """
+    @param latency: seconds added to every response
+    @param jitter: extra random delay of up to this many seconds
+    @param error_rate: share of requests answered with 503
+    @param throttle_rate: share of requests answered with 429 and Retry-After
+    @param fixtures: directory of recorded JSON responses, served before synthetic ones
+    @param record: fetch missing fixtures from the live APIs and save them under fixtures
+    """
+    super().__init__(address, FixtureRequestHandler)
+    self.catalogue = catalogue
+    self.latency = latency
+    self.jitter = jitter
+    self.error_rate = error_rate
+    self.throttle_rate = throttle_rate
+    self.retry_after = retry_after
+    self.fixtures = fixtures
+    self.record = record
+    self.random = random.Random(seed)
+    self.stats = {'requests': 0, 'statuses': {}, 'bytes': 0}
+    self._lock = threading.Lock()
+
+  def fault(self):
+    """HTTP status to inject for the next request, or None"""
+    with self._lock:
+      draw = self.random.random()
+      delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter > 0 else 0)
+    if delay > 0:
+      time.sleep(delay)
+    if draw < self.throttle_rate:
+      return 429
+    if draw < self.throttle_rate + self.error_rate:
+      return 503
+    return None
+
+  def count(self, status, size):
+    with self._lock:
+      self.stats['requests'] += 1
+      self.stats['bytes'] += size
+      self.stats['statuses'][str(status)] = self.stats['statuses'].get(str(status), 0) + 1
+
+  def fixture_file(self, path, query_string):
+    name = quote(path + ('?' + query_string if query_string else ''), safe='')
+    return os.path.join(self.fixtures, name + '.json')
+
+  def recorded(self, path, query_string):
+    """Recorded response body for a request, fetching it first when recording"""
+    if self.fixtures is None:
+      return None
+    filename = self.fixture_file(path, query_string)
+    if not os.path.isfile(filename) and self.record:
+      import transport
+      for prefix, upstream in UPSTREAMS.items():
+        if path.startswith(prefix):
+          r = transport.get(upstream + path + ('?' + query_string if query_string else ''))
+          if r.status_code == 200:
+            os.makedirs(self.fixtures, exist_ok=True)
+            with open(filename, 'wb') as fixture:
+              fixture.write(r.content)
+          break
+    if os.path.isfile(filename):
+      with open(filename, 'rb') as fixture:
+        return fixture.read()
+    return None
+
+
+class FixtureRequestHandler(BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+  # Headers and body are written separately; without TCP_NODELAY keep-alive
+  # responses stall on delayed ACKs and the server, not the crawl, is measured
+  disable_nagle_algorithm = True
+
+  def log_message(self, format, *args):
+    pass
+
+  def send_body(self, status, body, content_type='application/json', headers=None):
+    self.send_response(status)
+    self.send_header('Content-Type', content_type)
+    self.send_header('Content-Length', str(len(body)))
+    for k, v in (headers or {}).items():
+      self.send_header(k, v)
+    self.end_headers()
+    self.wfile.write(body)
+    self.server.count(status, len(body))
+
+  def do_GET(self):
+    url = urlsplit(self.path)
+    if url.path == '/__stats':
+      with self.server._lock:
+        body = json.dumps(self.server.stats).encode('utf-8')
+      self.send_response(200)
+      self.send_header('Content-Type', 'application/json')
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+      return
+    status = self.server.fault()
+    if status == 429:
+      self.send_body(429, b'{"error": "Too Many Requests"}', headers={'Retry-After': str(self.server.retry_after)})
+      return
+    if status is not None:
+      self.send_body(status, b'{"error": "Service Unavailable"}')
+      return
+    if url.path.startswith('/pages/'):
+      self.send_body(200, b'<html><body>OK</body></html>', content_type='text/html')
+      return
+    body = self.server.recorded(url.path, url.query)
+    if body is None:
+      data = self.server.catalogue.resolve(url.path, parse_qs(url.query))
+      if data is None:
+        self.send_body(404, b'{"error": "Not Found"}')
+        return
+      body = json.dumps(data).encode('utf-8')
+    etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+    if self.headers.get('If-None-Match', None) == etag:
+      self.send_response(304)
+      self.send_header('ETag', etag)
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+      self.server.count(304, 0)
+      return
+    self.send_body(200, body, headers={'ETag': etag})
+
+
+def start_server(port=0, host='127.0.0.1', **kwargs):
+  """Start a fixture server on a background thread.
+
+  @param port: port to listen on (0 picks a free one)
+  @param kwargs: SyntheticCatalogue sizes (models, family_size, classes, elements) and FixtureServer options
+  @return: the running server; its address is server.base_url
+  """
+  catalogue_options = {k: kwargs.pop(k) for k in ('models', 'family_size', 'classes', 'elements') if k in kwargs}
+  catalogue = SyntheticCatalogue(**catalogue_options)
+  server = FixtureServer((host, port), catalogue, **kwargs)
+  server.base_url = "http://{}:{}".format(host, server.server_address[1])
+  catalogue.base_url = server.base_url
+  thread = threading.Thread(target=server.serve_forever, daemon=True)
+  thread.start()
+  return server
+
+
+def server_environment(base_url):
+  """Environment variables pointing datasets.py, test_urls.py and friends at base_url"""
+  return {
+    'MDC_API_BASE_URL': base_url + MDC_PREFIX,
+    'GATEWAY_API_BASE_URL': base_url,
+  }
+
+
+if __name__ == "__main__":
+  import argparse
+  parser = argparse.ArgumentParser(description='Serve a local stand-in for the Metadata Catalogue and Gateway APIs')
+  parser.add_argument('--host', type=str, default='127.0.0.1')
+  parser.add_argument('--port', metavar='N', type=int, default=FIXTURE_PORT)
+  parser.add_argument('--models', metavar='N', type=int, default=300, help='Number of synthetic data models')
+  parser.add_argument('--family-size', metavar='N', dest='family_size', type=int, default=3,
+                      help='Versions per PID')
+  parser.add_argument('--classes', metavar='N', type=int, default=4, help='Data classes per data model')
+  parser.add_argument('--elements', metavar='N', type=int, default=25, help='Data elements per data class')
+  parser.add_argument('--latency', metavar='SECONDS', type=float, default=0.0, help='Delay added to every response')
+  parser.add_argument('--jitter', metavar='SECONDS', type=float, default=0.0, help='Extra random delay per response')
+  parser.add_argument('--error-rate', metavar='P', dest='error_rate', type=float, default=0.0,
+                      help='Share of requests answered with 503')
+  parser.add_argument('--throttle-rate', metavar='P', dest='throttle_rate', type=float, default=0.0,
+                      help='Share of requests answered with 429')
+  parser.add_argument('--retry-after', metavar='SECONDS', dest='retry_after', type=int, default=1,
+                      help='Retry-After sent with injected 429 responses')
+  parser.add_argument('--fixtures', metavar='DIR', type=str, default=None,
+                      help='Directory of recorded responses served before the synthetic catalogue')
+  parser.add_argument('--record', action='store_true',
+                      help='Fetch responses missing from --fixtures from the live APIs and save them')
+  parser.add_argument('--seed', metavar='N', type=int, default=0, help='Seed for latency and fault injection')
+  args = parser.parse_args()
+
+  server = start_server(port=args.port, host=args.host, models=args.models, family_size=args.family_size,
+                        classes=args.classes, elements=args.elements, latency=args.latency, jitter=args.jitter,
+                        error_rate=args.error_rate, throttle_rate=args.throttle_rate, retry_after=args.retry_after,
+                        fixtures=args.fixtures, record=args.record, seed=args.seed)
+  for k, v in server_environment(server.base_url).items():
+    print("export {}={}".format(k, v))
+  try:
+    while True:
+      time.sleep(3600)
+  except KeyboardInterrupt:
+    server.shutdown()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# usage: from http_cache import ResponseCache
+__license__ = "Apache 2"
+
+import os
+import json
+import time
+import hashlib
+import threading
+
+HTTP_CACHE_DIR = os.path.join('.cache', 'http')
+# Outlives the 12-hourly scheduled crawl, so a run can reuse the previous run's responses
+HTTP_CACHE_TTL = 24 * 60 * 60
+
+
+class CachedResponse:
+  """Minimal stand-in for requests.Response served from the cache"""
+
+  from_cache = True
+
+  def __init__(self, url, text, revalidated=False):
+    self.url = url
+    self.text = text
+    self.status_code = 200
+    self.headers = {}
+    # True when the server confirmed the entry with a 304
+    self.revalidated = revalidated
+
+  def json(self):
+    return json.loads(self.text)
+
+  def raise_for_status(self):
+    pass
+
+
+class ResponseCache:
+  """On-disk HTTP response cache keyed by URL.
+
+  Responses carrying an ETag or Last-Modified header are revalidated with
+  If-None-Match / If-Modified-Since on every use. Responses without
+  validators are served as-is until they are older than ttl seconds, unless
+  revalidate(url) says the URL may have changed since it was stored.
+  """
+
+  def __init__(self, cache_dir=HTTP_CACHE_DIR, ttl=HTTP_CACHE_TTL, revalidate=None):
+    """
+    @param revalidate: optional callable(url), true for URLs that must not be served on age alone
+    """
+    self.cache_dir = cache_dir
+    self.ttl = ttl
+    self.revalidate = revalidate
+    self.stats = {'hits': 0, 'misses': 0, 'revalidations': 0, 'stores': 0, 'bytes_saved': 0}
+    self._lock = threading.Lock()
+    os.makedirs(cache_dir, exist_ok=True)
+
+  def _path(self, url):
+    key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+    return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+  def _count(self, stat, nbytes=0):
+    with self._lock:
+      self.stats[stat] += 1
+      self.stats['bytes_saved'] += nbytes
+
+  def lookup(self, url):
+    path = self._path(url)
+    if not os.path.isfile(path):
+      return None
+    try:
+      with open(path, 'r') as cache_file:
+        entry = json.load(cache_file)
+    except (OSError, ValueError):
+      return None
+    return entry if entry.get('url') == url else None
+
+  def store(self, url, response):
+    entry = {
+      'url': url,
+      'etag': response.headers.get('ETag'),
+      'last_modified': response.headers.get('Last-Modified'),
+      'stored_at': time.time(),
+      'body': response.text,
+    }
+    path = self._path(url)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+    with open(tmp_path, 'w') as cache_file:
+      json.dump(entry, cache_file)
+    os.replace(tmp_path, path)
+    self._count('stores')
+
+  def is_fresh(self, entry):
+    if entry.get('etag') or entry.get('last_modified'):
+      return False
+    return time.time() - entry.get('stored_at', 0) < self.ttl
+
+  def fetch(self, url, get):
+    """Return a response for url, using get(url, headers=...) only when needed.
+
+    A 304 Not Modified is turned into a 200 CachedResponse, and fresh 200
+    responses are written back to the cache. Any other status is returned
+    untouched so the caller can handle it.
+    """
+    entry = self.lookup(url)
+    if entry is not None and self.is_fresh(entry) and (self.revalidate is None or not self.revalidate(url)):
+      self._count('hits', len(entry['body']))
+      return CachedResponse(url, entry['body'])
+
+    headers = {}
+    if entry is not None:
+      if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+      if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    r = get(url, headers=headers)
+    if r.status_code == 304 and entry is not None:
+      self._count('revalidations', len(entry['body']))
+      return CachedResponse(url, entry['body'], revalidated=True)
+    self._count('misses')
+    if r.status_code == 200:
+      self.store(url, r)
+    return r
+
+  def summary(self):
+    with self._lock:
+      stats = dict(self.stats)
+    requests_total = stats['hits'] + stats['revalidations'] + stats['misses']
+    stats['hit_rate'] = round((stats['hits'] + stats['revalidations']) / requests_total, 4) if requests_total else 0
+    return stats
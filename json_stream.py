@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# usage: from json_stream import StreamingJSONWriter, NDJSONWriter, IndexedJSONRecords, iter_ndjson
+__license__ = "Apache 2"
+
+import os
+import json
+import shutil
+
+
+class StreamingJSONWriter:
+  """Write a {count, <key>: [...]} envelope one record at a time.
+
+  Records are spooled to a temporary file as they are written; on close the
+  envelope is assembled around them, so the output is byte-identical to
+  json.dump({'count': n, key: records}, indent=indent) without ever holding
+  the records in memory.
+  """
+
+  def __init__(self, filename, key='dataModels', indent=2):
+    self.filename = filename
+    self.key = key
+    self.indent = indent
+    self.count = 0
+    self._spool_name = filename + '.part'
+    self._spool = open(self._spool_name, 'w')
+
+  def write(self, record):
+    prefix = ' ' * (2 * self.indent)
+    text = json.dumps(record, indent=self.indent)
+    if self.count > 0:
+      self._spool.write(',\n')
+    self._spool.write('\n'.join(prefix + line for line in text.split('\n')))
+    self.count += 1
+
+  def close(self):
+    if self._spool is None:
+      return
+    self._spool.close()
+    self._spool = None
+    pad = ' ' * self.indent
+    tmp_name = self.filename + '.tmp'
+    with open(tmp_name, 'w') as jsonfile:
+      jsonfile.write('{\n')
+      jsonfile.write('{}"count": {},\n'.format(pad, json.dumps(self.count)))
+      if self.count == 0:
+        jsonfile.write('{}{}: []\n}}'.format(pad, json.dumps(self.key)))
+      else:
+        jsonfile.write('{}{}: [\n'.format(pad, json.dumps(self.key)))
+        with open(self._spool_name, 'r') as spool:
+          shutil.copyfileobj(spool, jsonfile)
+        jsonfile.write('\n{}]\n}}'.format(pad))
+    os.replace(tmp_name, self.filename)
+    os.remove(self._spool_name)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is None:
+      self.close()
+    else:
+      # Leave the previous output in place if the crawl failed
+      self._spool.close()
+      self._spool = None
+      os.remove(self._spool_name)
+
+
+class NDJSONWriter:
+  """Write one compact JSON record per line, replacing filename on close"""
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.count = 0
+    self._part_name = filename + '.part'
+    self._file = open(self._part_name, 'w')
+
+  def write(self, record):
+    self._file.write(json.dumps(record))
+    self._file.write('\n')
+    self.count += 1
+
+  def close(self):
+    if self._file is None:
+      return
+    self._file.close()
+    self._file = None
+    os.replace(self._part_name, self.filename)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is None:
+      self.close()
+    else:
+      self._file.close()
+      self._file = None
+      os.remove(self._part_name)
+
+
+def iter_ndjson(filename):
+  """Yield the records of an NDJSON file one at a time"""
+  with open(filename, 'r') as ndjson_file:
+    for line in ndjson_file:
+      if line.strip():
+        yield json.loads(line)
+
+
+class IndexedJSONRecords:
+  """Records of a {count, <key>: [...]} envelope, read back by id without loading the file.
+
+  The file is scanned once, one record at a time, noting the byte range of
+  every record and an optional small summary of it; a record is parsed from
+  disk again each time it is asked for. The layout is the one
+  StreamingJSONWriter and json.dump(..., indent=indent) write, with each
+  record starting and ending on its own line.
+  """
+
+  def __init__(self, filename, key='dataModels', indent=2, summarise=None):
+    """
+    @param summarise: optional callable reducing a record to what is kept in memory, in .summaries
+    """
+    self.filename = filename
+    self.ranges = {}
+    self.summaries = {}
+    self._index(key, ' ' * (2 * indent), summarise)
+
+  def _index(self, key, prefix, summarise):
+    start_line = (prefix + '{').encode('utf-8')
+    end_line = (prefix + '}').encode('utf-8')
+    with open(self.filename, 'rb') as json_file:
+      header = json_file.readline() + json_file.readline() + json_file.readline()
+      if not header.startswith(b'{\n') or '{}: ['.format(json.dumps(key)).encode('utf-8') not in header:
+        raise ValueError("{} is not an indented {{count, {}: [...]}} envelope".format(self.filename, key))
+      offset = len(header)
+      start = None
+      for line in json_file:
+        stripped = line.rstrip(b',\r\n')
+        if start is None and stripped == start_line:
+          start = offset
+        elif start is not None and stripped == end_line:
+          end = offset + len(stripped)
+          json_file.seek(start)
+          record = json.loads(json_file.read(end - start))
+          json_file.seek(offset + len(line))
+          self.ranges[record['id']] = (start, end - start)
+          if summarise is not None:
+            self.summaries[record['id']] = summarise(record)
+          start = None
+        offset += len(line)
+
+  def __contains__(self, id):
+    return id in self.ranges
+
+  def __len__(self):
+    return len(self.ranges)
+
+  def __getitem__(self, id):
+    start, length = self.ranges[id]
+    with open(self.filename, 'rb') as json_file:
+      json_file.seek(start)
+      return json.loads(json_file.read(length))
+
+  def get(self, id, default=None):
+    return self[id] if id in self.ranges else default
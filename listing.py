@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# usage: from listing import PagedListing
+__license__ = "Apache 2"
+
+from concurrent.futures import ThreadPoolExecutor
+
+LISTING_PAGE_SIZE = 100
+# Reads of the whole listing before a listing that keeps changing is given up on
+LISTING_PASSES = 3
+
+
+class PagedListing:
+  """Catalogue listing read in offset/max pages, one page ahead of its consumer.
+
+  The first page is fetched on construction so the total count is known before
+  any model is processed. Iterating yields the listed items page by page while
+  the next page is already being fetched; items are reduced with summarise as
+  they arrive, so the full listing response is never held in memory. A listing
+  can be iterated once; the reduced items seen so far stay in .items.
+
+  Models added or removed while paging shift the items behind the offset, so
+  a read is only trusted when every page reported the same count and it
+  listed that many models. Otherwise the listing is read again from the
+  start, yielding only models not yielded before, up to LISTING_PASSES times
+  before giving up with a RuntimeError rather than returning a short
+  catalogue. .count is the latest count reported.
+  """
+
+  def __init__(self, fetch_page, page_size=LISTING_PAGE_SIZE, summarise=None):
+    """
+    @param fetch_page: callable(offset, max) returning a {'count': ..., 'items': [...]} page
+    @param page_size: items requested per page
+    @param summarise: optional callable reducing each listed item to what the crawl needs
+    """
+    self.fetch_page = fetch_page
+    self.page_size = page_size
+    self.summarise = summarise
+    self.items = []
+    self._first = fetch_page(0, page_size)
+    self.count = int(self._first.get('count', 0))
+
+  def pages(self):
+    """Yield the listing one page (list of items) at a time"""
+    if self._first is None:
+      raise RuntimeError("PagedListing can only be iterated once")
+    page, self._first = self._first, None
+    seen = set()
+    for _ in range(LISTING_PASSES):
+      if page is None:
+        page = self.fetch_page(0, self.page_size)
+      listed = set()
+      counts = set()
+      offset = 0
+      with ThreadPoolExecutor(max_workers=1) as prefetch:
+        while True:
+          self.count = int(page.get('count', self.count))
+          counts.add(self.count)
+          items = page.get('items', [])
+          offset += len(items)
+          following = None
+          if len(items) and offset < self.count:
+            following = prefetch.submit(self.fetch_page, offset, self.page_size)
+          # Models added while paging shift later pages; skip anything already listed
+          fresh = []
+          for d in items:
+            listed.add(d['id'])
+            if d['id'] not in seen:
+              seen.add(d['id'])
+              fresh.append(self.summarise(d) if self.summarise is not None else d)
+          self.items.extend(fresh)
+          yield fresh
+          if following is None:
+            break
+          page = following.result()
+      if len(counts) == 1 and len(listed) >= self.count:
+        return
+      print("Listing changed while paging: read {} of {} models; reading it again".format(len(listed), self.count))
+      page = None
+    raise RuntimeError("Listing still incomplete after {} reads: {} of {} models".format(
+      LISTING_PASSES, len(listed), self.count))
+
+  def __iter__(self):
+    for page in self.pages():
+      for d in page:
+        yield d
@@ -1,7 +1,8 @@
 import os
 import csv
 import json
-import requests
+import transport
+from pid_index import load_pid_index
 
 METADATA_QUALITY_V1_JSON = 'reports/v1.1.7/metadata_quality.json'
 METADATA_QUALITY_V2_JSON = 'reports/latest/metadata_quality.v2.json'
@@ -15,7 +16,7 @@ def get_json(json_uri):
         with open(json_uri, 'r') as json_file:
             return json.load(json_file)
     elif json_uri.startswith('http'):
-        return requests.get(json_uri).json()
+        return transport.get(json_uri).json()
     else:
         raise Exception
 
@@ -51,7 +52,9 @@ def read_csv(filename):
       data.append(row)
   return data, header
 
-def update_utility_scores(quality_scores, utility_scores, headers=None):
+def update_utility_scores(quality_scores, utility_scores, headers=None, pid_index=None):
+    if pid_index is None:
+        pid_index = {}
     DATA = []
     for score in quality_scores:
         id = score['id']
@@ -60,6 +63,7 @@ def update_utility_scores(quality_scores, utility_scores, headers=None):
         if len(us):
             d.update(us[0])
         d['id'] = score['id']
+        d['pid'] = pid_index.get(id, d['pid'])
         d['publisher'] = score['publisher']
         d['title'] = score['title']
         d['metadata_richness'] = score['weighted_quality_rating']
@@ -67,8 +71,10 @@ def update_utility_scores(quality_scores, utility_scores, headers=None):
     return DATA
 
 def main():
+    pid_index = load_pid_index()
     headers = []
     for score in metadata_quality_v1:
+        score['pid'] = pid_index.get(score['id'], score.get('pid', None))
         v2_score = get_v2_quality_score(score['id'])
         if v2_score is not None:
             score['schema_version'] = v2_score['schema_version']
@@ -91,7 +97,7 @@ def main():
 
     # Generate Data Utility Framework scores
     utility_scores, headers = read_csv('reports/data_utility.csv')
-    utility_scores = update_utility_scores(metadata_quality_v1, utility_scores, headers)
+    utility_scores = update_utility_scores(metadata_quality_v1, utility_scores, headers, pid_index)
     export_json(utility_scores,'reports/data_utility.json')
     export_csv(utility_scores, 'reports/data_utility.csv', headers)
 
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# usage: from metadata_decoder import decode_metadata, build_document
+__license__ = "Apache 2"
+
+import ast
+import copy
+import json
+import functools
+
+GATEWAY_NAMESPACE = 'org.healthdatagateway'
+METADATA_VALUE_CACHE_SIZE = 4096
+
+# Metadata keys published under the wrong path, mapped to where they belong
+KEY_REWRITES = {
+  # TODO: FIX MDW Bug
+  "properties/observations/observations": "properties/observations",
+}
+
+
+@functools.lru_cache(maxsize=METADATA_VALUE_CACHE_SIZE)
+def _decode_list(value):
+  try:
+    return json.loads(value)
+  except ValueError:
+    return ast.literal_eval(value)
+
+
+def decode_value(value):
+  """Decode a list-valued metadata string; any other value is returned unchanged.
+
+  Most values are valid JSON, so json.loads is tried before ast.literal_eval.
+  Decoded values are memoised by their string and every caller gets its own copy.
+  """
+  if not isinstance(value, str) or not (value.startswith("[") and value.endswith("]")):
+    return value
+  decoded = _decode_list(value)
+  if all(isinstance(v, (str, int, float, bool, type(None))) for v in decoded):
+    return list(decoded)
+  return copy.deepcopy(decoded)
+
+
+@functools.lru_cache(maxsize=None)
+def compile_key(key):
+  """Path of a gateway metadata key in the v2 document, as a tuple of keys"""
+  key = KEY_REWRITES.get(key, key)
+  if key == "structuralMetadata":
+    return (key,)
+  if key.startswith('properties/'):
+    key = str(key.split('properties/')[1])
+  # FIXME: Gateway dataModel attributes without properties/ prefix :(
+  return tuple(key.split("/"))
+
+
+def decode_metadata(items, namespace=GATEWAY_NAMESPACE):
+  """(path, value) pairs for the metadata items of one namespace, in catalogue order"""
+  return [(compile_key(md['key']), decode_value(md['value'])) for md in items if md['namespace'] == namespace]
+
+
+def build_document(document, metadata):
+  """Merge (path, value) pairs into document in a single pass.
+
+  The result is the same as setting each path in turn, but every branch dict
+  is created once and looked up by its path prefix afterwards, instead of
+  walking down from the root for every value.
+  """
+  branches = {(): document}
+  for path, value in metadata:
+    path = tuple(path)
+    parent = branches.get(path[:-1], None)
+    if parent is None:
+      parent = document
+      for i, key in enumerate(path[:-1]):
+        parent = parent.setdefault(key, {})
+        branches[path[:i + 1]] = parent
+    parent[path[-1]] = value
+    if path in branches:
+      # A value replaced a whole branch; forget the branch and everything below it
+      for prefix in [p for p in branches if p[:len(path)] == path]:
+        del branches[prefix]
+  return document
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# usage: from model_cache import ModelSummaryCache
+__license__ = "Apache 2"
+
+import os
+import json
+import threading
+from datetime import datetime
+
+from concurrency import ordered_map
+
+MODEL_SUMMARY_CACHE = os.path.join('.cache', 'model_summaries.json')
+SUMMARY_FIELDS = ['lastUpdated', 'dateFinalised']
+
+
+def parse_catalogue_date(value):
+  """Parse a Metadata Catalogue timestamp, with or without fractional seconds"""
+  if value is None:
+    return None
+  try:
+    return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%fZ")
+  except ValueError:
+    return datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ")
+
+
+class ModelSummaryCache:
+  """Per-run cache of GET /dataModels/{id} responses and their parsed dates.
+
+  Each model id is fetched at most once, even when several crawl threads ask
+  for it at the same time. An optional persistent tier keeps the
+  lastUpdated/dateFinalised summaries between runs; a stored summary is only
+  trusted while the listing still reports the same lastUpdated for that model.
+  """
+
+  def __init__(self, fetch_model, filename=None, workers=1):
+    """
+    @param fetch_model: callable returning the data model JSON for a model id
+    @param filename: optional JSON file backing the persistent summary tier
+    @param workers: threads used to fetch a family's missing summaries
+    """
+    self.fetch_model = fetch_model
+    self.filename = filename
+    self.workers = workers
+    self.models = {}
+    self.summaries = {}
+    self.dates = {}
+    self.families = {}
+    self.stored = {}
+    self._lock = threading.Lock()
+    self._fetching = {}
+
+  def load(self, data_models_list=None):
+    """Read the persistent tier; its summaries are used once their models are admitted.
+
+    @param data_models_list: optional listing whose items are admitted straight away
+    """
+    if self.filename is None or not os.path.isfile(self.filename):
+      return 0
+    with open(self.filename, 'r') as cache_file:
+      self.stored = json.load(cache_file)
+    print("Read", len(self.stored), "data model summaries from", self.filename)
+    if data_models_list is not None:
+      return self.admit(data_models_list['items'])
+    return 0
+
+  def admit(self, items):
+    """Seed summaries of listed models whose lastUpdated is unchanged since they were stored"""
+    loaded = 0
+    with self._lock:
+      for d in items:
+        summary = self.stored.pop(d['id'], None)
+        if summary is not None and summary.get('lastUpdated', None) == d.get('lastUpdated', None):
+          self.summaries.setdefault(d['id'], summary)
+          loaded += 1
+    return loaded
+
+  def save(self):
+    if self.filename is None:
+      return
+    os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+    with open(self.filename, 'w') as cache_file:
+      json.dump(self.summaries, cache_file, sort_keys=True)
+
+  def prime(self, id, dm):
+    """Record a data model response that has already been fetched"""
+    with self._lock:
+      self.models[id] = dm
+      self.summaries[id] = {k: dm.get(k, None) for k in SUMMARY_FIELDS}
+      self.dates.pop(id, None)
+
+  def _fetch(self, id):
+    with self._lock:
+      lock = self._fetching.setdefault(id, threading.Lock())
+    with lock:
+      with self._lock:
+        if id in self.models:
+          return self.models[id]
+      dm = self.fetch_model(id)
+      self.prime(id, dm)
+      return dm
+
+  def model(self, id):
+    """Full GET /dataModels/{id} response, fetched once per run"""
+    with self._lock:
+      if id in self.models:
+        return self.models[id]
+    return self._fetch(id)
+
+  def summary(self, id):
+    with self._lock:
+      if id in self.summaries:
+        return self.summaries[id]
+    self._fetch(id)
+    return self.summaries[id]
+
+  def parsed_dates(self, id):
+    """(lastUpdated, dateFinalised) as datetimes; dateFinalised falls back to lastUpdated"""
+    with self._lock:
+      if id in self.dates:
+        return self.dates[id]
+    summary = self.summary(id)
+    lu = parse_catalogue_date(summary.get('lastUpdated', None))
+    du = parse_catalogue_date(summary.get('dateFinalised', None))
+    if du is None:
+      du = lu
+    with self._lock:
+      self.dates[id] = (lu, du)
+    return lu, du
+
+  def family_dates(self, revisions):
+    """Resolve modified/issued for a whole version family in one pass.
+
+    Missing member summaries are fetched together and the result is shared by
+    every model whose revisions map names the same set of ids.
+    """
+    key = frozenset(revisions.values())
+    with self._lock:
+      if key in self.families:
+        return dict(self.families[key])
+    parsed = list(ordered_map(self.parsed_dates, sorted(key), workers=self.workers))
+    last_updated = [lu for lu, _ in parsed if lu is not None]
+    date_finalised = [du for _, du in parsed if du is not None]
+    data = {}
+    if len(last_updated) > 0:
+      data['modified'] = max(last_updated).strftime("%Y-%m-%dT%H:%M:%SZ")
+    else:
+      data['modified'] = None
+    if len(date_finalised) > 0:
+      data['issued'] = min(date_finalised).strftime("%Y-%m-%dT%H:%M:%SZ")
+    else:
+      data['issued'] = None
+    with self._lock:
+      self.families[key] = data
+    return dict(data)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# usage: from pid_index import PIDResolver, load_pid_index
+__license__ = "Apache 2"
+
+import os
+import json
+
+PIDS_JSON = "pids.json"
+PID_INDEX_JSON = "pids.index.json"
+
+
+def build_pid_index(pid_list):
+  """Map every datasetId in a Gateway pidList to its PID.
+
+  Later entries win when a datasetId is listed under more than one PID,
+  matching the order-dependent behaviour of the original linear scan.
+  """
+  index = {}
+  for p in pid_list.get('data', []):
+    for dataset_id in p.get('datasetIds', []):
+      index[dataset_id] = p['pid']
+  return index
+
+
+def build_pid_members(pid_list):
+  """Map every PID in a Gateway pidList to its datasetIds, one per version of the dataset"""
+  members = {}
+  for p in pid_list.get('data', []):
+    members.setdefault(p['pid'], []).extend(p.get('datasetIds', []))
+  return members
+
+
+def load_pid_index(filename=PID_INDEX_JSON):
+  """Read a persisted datasetId -> PID index, or an empty index if there is none"""
+  if not os.path.isfile(filename):
+    return {}
+  with open(filename, 'r') as index_file:
+    return json.load(index_file)
+
+
+class PIDResolver:
+  """datasetId -> PID lookups over a pidList downloaded once per run"""
+
+  def __init__(self, pid_list):
+    self.pid_list = pid_list
+    self.index = build_pid_index(pid_list)
+    self.members = build_pid_members(pid_list)
+
+  def resolve(self, dataset_id):
+    return self.index.get(dataset_id, None)
+
+  def dataset_ids(self, pid):
+    """Every datasetId listed under a PID"""
+    return list(self.members.get(pid, []))
+
+  def pids(self):
+    return set(self.index.values())
+
+  def changes(self, previous_index):
+    """PIDs added or removed compared with a previously persisted index"""
+    previous = set(previous_index.values())
+    current = self.pids()
+    return {
+      'added': sorted(current - previous),
+      'removed': sorted(previous - current),
+    }
+
+  def save(self, pids_filename=PIDS_JSON, index_filename=PID_INDEX_JSON):
+    """Persist the raw pidList and the index next to it, returning the PID changes"""
+    changes = self.changes(load_pid_index(index_filename))
+    with open(pids_filename, 'w') as pids_file:
+      json.dump(self.pid_list, pids_file, indent=2)
+    with open(index_filename, 'w') as index_file:
+      json.dump(self.index, index_file, indent=2, sort_keys=True)
+    print("PIDs:", len(self.pids()), "added:", len(changes['added']), "removed:", len(changes['removed']))
+    for pid in changes['added']:
+      print("  + ", pid)
+    for pid in changes['removed']:
+      print("  - ", pid)
+    return changes
@@ -5,7 +5,7 @@ __copyright__ = "Copyright (c) 2019-2020 Susheel Varma All Rights Reserved."
 __email__ = "susheel.varma@hdruk.ac.uk"
 __license__ = "Apache 2"
 
-import copy
+import os
 import math
 from statistics import mean, stdev
 import csv
@@ -13,10 +13,14 @@ import json
 import urllib
 import requests
 from pprint import pprint
-from validate_schema import get_json, validate_schema, \
+from validate_schema import get_json, validate_schema, ReportingView, \
                             generate_baseline_from_sections, generate_attribute_list, \
-                            import_dm_tm, check_dm_completeness, check_attribute_validation, flatten_reporting_dict
+                            import_dm_tm, current_data_models, check_dm_completeness, check_attribute_validation, flatten_reporting_dict
 from datasets import export_csv, export_json
+from schema_registry import get_schema, get_validator, schema_hash
+from validation_pool import validate_map, VALIDATION_WORKERS
+from result_cache import ResultCache, RESULT_CACHE_DIR
+from scoring_engine import ScoringEngine, medallion_ratings
 
 DATASET_SCHEMA = 'https://raw.githubusercontent.com/HDRUK/schemata/master/schema/dataset/1.1.7/dataset.schema.json'
 DATASETS_JSON = 'datasets.json'
@@ -40,6 +44,14 @@ METADATA_SECTIONS = {
 REPORTING_LEVELS = ["A: Summary", "B: Business", "C: Coverage & Detail",
                     "D: Format & Structure", "E: Attribution", "F: Technical Metadata"]
 
+# min excluding < score <= max including, as in medallions.v2.json
+QUALITY_RATINGS = {
+    "Not Rated": {"min excluding": float('-inf'), "max including": 66},
+    "Bronze": {"min excluding": 66, "max including": 76},
+    "Silver": {"min excluding": 76, "max including": 86},
+    "Gold": {"min excluding": 86, "max including": float('inf')},
+}
+
 def nullScore(d):
     ''' CHECK WITH HEIKO: Do we need this anymore? '''
     count = 0
@@ -59,18 +71,12 @@ def nullScore(d):
         # Process total counts
         if v is None:
             nulls = nulls + 1
-            d[k] = False
-        else:
-            if k not in ["id", "publisher", "title"]:
-                d[k] = True
-        # data.update(d)
     data['missing_attributes'] = nulls
     data['total_attributes'] = count
     return data
 
-def completeness_check():
+def completeness_check(data_models):
     schema = generate_baseline_from_sections(METADATA_SECTIONS, REPORTING_LEVELS)
-    data_models = get_json(DATASETS_JSON)
     data = []
     header = []
     for dm in data_models['dataModels']:
@@ -81,50 +87,58 @@ def completeness_check():
             'publisher': dm.get('publisher',None),
             'title': dm.get('title',None)
         }
-        for attribute in (set(dm.keys()) - set(schema.keys())):
-            dm.pop(attribute, None) # any attribute not in the schema, drop from the data model
-        s = copy.deepcopy(schema)
-        s.update(dm)
+        # attributes missing from the data model keep their baseline value (None)
+        s = ReportingView(dm, schema.keys(), baseline=schema)
         score = nullScore(s)
         score.update(d)
         header.extend(score.keys())
         data.append(score)
     return data, list(set(header))
 
-def schema_validation_check():
-    schema = get_json(DATASET_SCHEMA)
-    data_models = get_json(DATASETS_JSON)
+def schema_validation_check(data_models, workers=1, cache=None):
     validation_attributes = set(generate_attribute_list(METADATA_SECTIONS, REPORTING_LEVELS))
-    data = []
+    # only the projections travel to the worker processes
+    views = [(ReportingView(dm, validation_attributes),
+              {'pid': dm.get('pid', None), 'id': dm.get('id', None),
+               'publisher': dm.get('publisher', None), 'title': dm.get('title', None)})
+             for dm in data_models['dataModels']]
+    if cache is not None:
+        data = cache.map('schema_validation', [schema_hash(DATASET_SCHEMA)], schema_validation, views,
+                         workers=workers, schemas=[DATASET_SCHEMA])
+    else:
+        data = validate_map(schema_validation, views, workers=workers, schemas=[DATASET_SCHEMA])
     headers = []
-    for dm in data_models['dataModels']:
-        dm_validate = copy.deepcopy(dm)
-        for attribute in (set(dm_validate.keys()) - validation_attributes):
-            dm_validate.pop(attribute, None)
-        errors = validate_schema(schema, dm_validate)
-        d = {
-            'pid': dm.get('pid', None),
-            'id': dm.get('id',None),
-            'publisher': dm.get('publisher',None),
-            'title': dm.get('title',None),
-            'schema_error_count': len(errors),
-            'errors': errors
-        }
+    for d in data:
         headers.extend(d.keys())
-        data.append(d)
     return data, list(set(headers))
 
-def generate_quality_score():
-    '''Reads the completeness and error json reports, and calculates the metadata quality scores.
+def schema_validation(view):
+    '''Validate one projected data model for schema_validation_check.
+
+    Keyword arguments:
+    view -- (ReportingView of the data model, its pid/id/publisher/title)
+    '''
+    dm_validate, d = view
+    errors = validate_schema(get_validator(DATASET_SCHEMA), dm_validate)
+    d['schema_error_count'] = len(errors)
+    d['errors'] = errors
+    return d
+
+def generate_quality_score(scores, errors):
+    '''Calculates the metadata quality scores from the attribute completeness and error results.
+
+    Keyword arguments:
+    scores -- attribute completeness of each data model, as from check_dm_completeness
+    errors -- attribute errors of each data model, as from check_attribute_validation
 
     return summary_data, list(set(headers))
     '''
 
     # Generate completeness percent & weighted completeness percent
-    scores = get_json('reports/v1.1.7/attribute_completeness.json')
-    completion_weightings = get_json(WEIGHTS)
+    weightings = get_json(WEIGHTS)
+    weighted_completeness = attribute_weighted_scores(scores, weightings)
     data = {}
-    for s in scores:
+    for s, weighted_score in zip(scores, weighted_completeness):
         data[s['id']] = {
             'schema_version': "1.1.7",
             'pid': s['pid'],
@@ -133,67 +147,50 @@ def generate_quality_score():
             'title': s['title']
         }
         c_score = round((s['filled_attributes'] / s['total_attributes']) * 100, 2) #completion score
-        wc_score = round(attribute_weighted_score(s, completion_weightings) *100, 2) # weighted completion score
+        wc_score = round(weighted_score *100, 2) # weighted completion score
         data[s['id']]['completeness_percent'] = c_score
         data[s['id']]['weighted_completeness_percent'] = wc_score
     
     # Generate error percent and weighted error percent
-    schema = get_json(DATASET_SCHEMA)
+    schema = get_schema(DATASET_SCHEMA)
     total_attributes = len(list(schema['properties'].keys()))
-    errors = get_json('reports/v1.1.7/attribute_errors.json')
-    error_weightings = get_json(WEIGHTS)
-    for e in errors:
+    weighted_errors = attribute_weighted_scores(errors, weightings)
+    for e, weighted_score in zip(errors, weighted_errors):
         e_score = round((e['attributes_with_errors'] / total_attributes) * 100, 2)
-        we_score = round(attribute_weighted_score(e, error_weightings) * 100, 2)
+        we_score = round(weighted_score * 100, 2)
         data[e['id']]['error_percent'] = e_score
         data[e['id']]['weighted_error_percent'] = we_score
 
     # Generate quality score, weighted quality score, quality score rating, and weighted quality score rating
+    avg_scores = [round(mean([d['completeness_percent'], 100-d['error_percent']]), 2) for d in data.values()]
+    weighted_avg_scores = [round(mean([d['weighted_completeness_percent'], 100-d['weighted_error_percent']]), 2)
+                           for d in data.values()]
+    ratings = zip(avg_scores, medallion_ratings(avg_scores, QUALITY_RATINGS),
+                  weighted_avg_scores, medallion_ratings(weighted_avg_scores, QUALITY_RATINGS))
     summary_data = []
     headers = []
-    for id, d in data.items():
-        avg_score = round(mean([data[id]['completeness_percent'], 100-data[id]['error_percent']]), 2)
+    for d, (avg_score, rating, weighted_avg_score, weighted_rating) in zip(data.values(), ratings):
         d['quality_score'] = avg_score
-        d['quality_rating'] = quality_ratings(d['quality_score'])
+        d['quality_rating'] = rating
 
-        weighted_avg_score = round(mean([data[id]['weighted_completeness_percent'], 100-data[id]['weighted_error_percent']]), 2)
         d['weighted_quality_score'] = weighted_avg_score
-        d['weighted_quality_rating'] = quality_ratings(d['weighted_quality_score'])
+        d['weighted_quality_rating'] = weighted_rating
 
         headers.extend(d.keys())
         summary_data.append(d)
 
     return summary_data, list(set(headers))
 
-def quality_ratings(s):
-    '''Takes in a score and returns the resulting quality rating
+def attribute_weighted_scores(results, w):
+    '''Applies the provided attribute weightings to the completeness or error results of every data model at once.
 
     Keyword arguments:
-    s -- score: a single score from the dictionary of metadata scores
-
-    '''
-    if s <= 66:
-        return "Not Rated"
-    elif s > 66 and s <= 76:
-        return "Bronze"
-    elif s > 76 and s <= 86:
-        return "Silver"
-    elif s > 86:
-        return "Gold"
-
-def attribute_weighted_score(s, w):
-    '''Applies the provided attribute weightings to the completeness and error score.
-
-    Keyword arguments:
-    s -- score: a dictionary of metadata scores
+    results -- a list of dictionaries of metadata scores, one per data model
     w -- weights: a dictionary of metadata attributes and weights
     '''
-    score = 0
-    for section in REPORTING_LEVELS:
-        section_score = s[section]
-        for att_name, att_weights in w[section].items():
-            score = score + (section_score[att_name]*att_weights)
-    return score
+    engine = ScoringEngine({(section, att_name): att_weight
+                            for section in REPORTING_LEVELS for att_name, att_weight in w[section].items()})
+    return engine.scores([{key: s[key[0]][key[1]] for key in engine.attributes} for s in results])
 
 def read_csv(filename):
   header = []
@@ -221,20 +218,30 @@ def read_csv(filename):
 #         DATA.append(d)
 #     return DATA
 
-def main():
+def main(workers=1, targeted=False, cache_dir=RESULT_CACHE_DIR):
+    # Results of data models unchanged since the last run are reused
+    cache = None
+    if cache_dir is not None:
+        cache = ResultCache(os.path.join(cache_dir, 'quality_checks.json'))
+        cache.load()
+
+    # Parse the catalogue once; every check below works on the same in-memory data models,
+    # and the reports are only written, never read back
+    data_models = current_data_models(get_json(DATASETS_JSON))
+
     # Compile Metadata Completeness Score
-    completeness_score, headers = completeness_check()
+    completeness_score, headers = completeness_check(data_models)
     export_json(completeness_score,'reports/v1.1.7/completeness.json')
     export_csv(completeness_score, 'reports/v1.1.7/completeness.csv', headers)
 
     # Compile Schema Validation Error Score
-    schema_errors, headers = schema_validation_check()
+    schema_errors, headers = schema_validation_check(data_models, workers=workers, cache=cache)
     export_json(schema_errors,'reports/v1.1.7/schema_errors.json')
     export_csv(schema_errors, 'reports/v1.1.7/schema_errors.csv', headers)
 
     # Attribute level checks
-    # read in datasets
-    data_models = import_dm_tm(DATASETS_JSON)
+    # add the technical metadata profile to the data models
+    data_models = import_dm_tm(data_models)
 
     # Compile Attribute Completeness Score
     attribute_completeness_score = check_dm_completeness(data_models)
@@ -243,16 +250,21 @@ def main():
     export_csv(csv_data, 'reports/v1.1.7/attribute_completeness.csv', headers)
 
     # Compile Attribute Schema Validation Error Score
-    attribute_schema_errors = check_attribute_validation(data_models)
+    attribute_schema_errors = check_attribute_validation(data_models, workers=workers, targeted=targeted,
+                                                         cache=cache)
     export_json(attribute_schema_errors,'reports/v1.1.7/attribute_errors.json')
     csv_data, headers = flatten_reporting_dict(attribute_schema_errors)
     export_csv(csv_data, 'reports/v1.1.7/attribute_errors.csv', headers)
 
     # Summarise Average Quality Score
-    summary_score, headers = generate_quality_score()
+    summary_score, headers = generate_quality_score(attribute_completeness_score, attribute_schema_errors)
     export_json(summary_score,'reports/v1.1.7/metadata_quality.json')
     export_csv(summary_score, 'reports/v1.1.7/metadata_quality.csv', headers)
 
+    if cache is not None:
+        cache.save()
+        print("Result cache:", cache.summary())
+
     # # # Generate Data Utility Framework scores
     # utility_scores, headers = read_csv('reports/data_utility.csv')
     # # utility_scores = update_utility_scores(summary_score, utility_scores, headers)
@@ -262,4 +274,16 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description='Score v1 metadata quality')
+    parser.add_argument('--workers', metavar='N', type=int, default=VALIDATION_WORKERS,
+                        help='Number of validation processes (default: one per core, 1 = serial)')
+    parser.add_argument('--targeted', action='store_true',
+                        help='Validate only the reported attributes, each against its own part of the schema')
+    parser.add_argument('--cache-dir', metavar='DIR', dest='cache_dir', type=str, default=RESULT_CACHE_DIR,
+                        help='Directory for the validation results kept between runs')
+    parser.add_argument('--no-cache', dest='cache_dir', action='store_const', const=None,
+                        help='Validate every data model, ignoring and not updating the result cache')
+    args = parser.parse_args()
+
+    main(workers=args.workers, targeted=args.targeted, cache_dir=args.cache_dir)
\ No newline at end of file
@@ -8,12 +8,20 @@ __license__ = "Apache 2"
 # load packages
 import copy
 import datetime
+import functools
 import json
 import jsonschema
 import os
 import pandas as pd
 import requests
 import platform
+import transport
+from catalogue_store import load_catalogue
+from pid_index import load_pid_index
+from schema_registry import get_validator, get_attribute_validators, schema_hash
+from validation_pool import validate_map, VALIDATION_WORKERS
+from result_cache import ResultCache, RESULT_CACHE_DIR
+from scoring_engine import ScoringEngine, medallion_ratings
 from openpyxl import load_workbook
 
 CWD = os.getcwd()
@@ -96,7 +104,7 @@ def get_json(json_uri):
         with open(json_uri, 'r') as json_file:
             return json.load(json_file)
     elif json_uri.startswith('http'):
-        return requests.get(json_uri).json()
+        return transport.get(json_uri).json()
     else:
         raise Exception
 
@@ -133,8 +141,14 @@ def write_excel(fname, worksheets, idx=False):
 
 
 def get_datamodels(jason_uri):
-    raw_data = get_json(jason_uri)
-    return raw_data.get('dataModels', [])
+    # Scoring only needs structuralMetadataCount, so the class trees are left in the store
+    raw_data = load_catalogue(jason_uri, version=2, with_classes=False)
+    data_models = raw_data.get('dataModels', [])
+    # superseded versions crawled with --latest-only carry no structural metadata to score
+    current = [data_model for data_model in data_models if not data_model.get('supersededBy', None)]
+    if len(current) < len(data_models):
+        write_timestamp(f"skipping {len(data_models) - len(current)} superseded datasets")
+    return current
 
 
 def get_validation_weights(val_weights_path):
@@ -203,10 +217,12 @@ def flatten_datamodel(data_model):
 
 
 def assess_completeness(completeness, data_model):
-    dm_completeness = copy.deepcopy(completeness)
+    dm_completeness = {comp_key: dict(comp_score) for comp_key, comp_score in completeness.items()}
     flat_dm = flatten_datamodel(data_model)
 
-    total_count, total_weight = 0, 0
+    # the scoring engine's row for this data model: the multiple of each weight it earns
+    indicators = {}
+    total_count = 0
     for comp_key, comp_score in dm_completeness.items():
         dm_data = flat_dm.get(comp_key, None)
         if 'identifier' == comp_key:
@@ -214,41 +230,36 @@ def assess_completeness(completeness, data_model):
             # if flat_dm.get('HOP_status', None):
             dm_completeness[comp_key]['score'] = comp_score['weight']
             total_count += 1
-            total_weight += comp_score['weight']
+            indicators[comp_key] = 1
             continue
         elif 'structuralMetadata' == comp_key[:18]:
             dm_completeness[comp_key]['score'] = dm_data * comp_score['weight']
             dm_completeness[comp_key]['value'] = f"{dm_data}"[:64]
             if dm_data > 0:
                 total_count += 1
-            total_weight += dm_data * comp_score['weight']
+            indicators[comp_key] = dm_data
             continue
         if dm_data:
             dm_completeness[comp_key]['score'] = comp_score['weight']
             dm_completeness[comp_key]['value'] = f"{dm_data}"[:64]
             total_count += 1
-            total_weight += comp_score['weight']
+            indicators[comp_key] = 1
 
     # special rules
     # - continuous data collection
     if flat_dm.get('provenance.temporal.accrualPeriodicity', None):
         if 'CONTINUOUS' == flat_dm['provenance.temporal.accrualPeriodicity']:
-            dm_completeness['provenance.temporal.endDate']['score'] = dm_completeness['provenance.temporal.endDate'][
-                'weight']
-            dm_completeness['provenance.temporal.endDate']['value'] = 'continuous data collection'
-            total_count += 1
-            total_weight += dm_completeness['provenance.temporal.endDate']['score']
-            dm_completeness['provenance.temporal.distributionReleaseDate']['score'] = \
-            dm_completeness['provenance.temporal.distributionReleaseDate']['weight']
-            dm_completeness['provenance.temporal.distributionReleaseDate']['value'] = 'continuous data collection'
-            total_count += 1
-            total_weight += dm_completeness['provenance.temporal.distributionReleaseDate']['score']
+            for comp_key in ['provenance.temporal.endDate', 'provenance.temporal.distributionReleaseDate']:
+                dm_completeness[comp_key]['score'] = dm_completeness[comp_key]['weight']
+                dm_completeness[comp_key]['value'] = 'continuous data collection'
+                total_count += 1
+                indicators[comp_key] = indicators.get(comp_key, 0) + 1
 
-    return {'count': total_count, 'weight': total_weight, 'completeness': dm_completeness}
+    return {'count': total_count, 'indicators': indicators, 'completeness': dm_completeness}
 
 
-def assess_errors(validator, validation_errors, data_model):
-    dm_errors = copy.deepcopy(validation_errors)
+def assess_errors(validator, validation_errors, data_model, attribute_validators=None):
+    dm_errors = {error_key: dict(error_score) for error_key, error_score in validation_errors.items()}
 
     # special rules
     error_exceptions = ['accessibility.usage.isReferencedBy']
@@ -262,8 +273,20 @@ def assess_errors(validator, validation_errors, data_model):
                 error_exceptions.extend(
                     ['provenance.temporal.accrualPeriodicity', 'provenance.temporal.distributionReleaseDate'])
 
-    error_count, error_weight = 0, 0
-    errors = sorted(validator.iter_errors(data_model), key=lambda e: e.path)
+    # the scoring engine's row for this data model: how many times each weight counts as an error
+    indicators = {}
+    error_count = 0
+    # targeted: each weighted attribute checked against its own sub-schema, and counted once
+    if attribute_validators is not None:
+        for error_key, message in attribute_validators.failures(data_model).items():
+            if error_key not in error_exceptions:
+                dm_errors[error_key]['score'] = dm_errors[error_key]['weight']
+                error_count += 1
+                indicators[error_key] = indicators.get(error_key, 0) + 1
+                dm_errors[error_key]['err_msg'] = message[-128:]
+        errors = []
+    else:
+        errors = sorted(validator.iter_errors(data_model), key=lambda e: e.path)
     for e in errors:
         validation_path = [f"{token}" for token in list(e.absolute_path)]
         if len(validation_path) < 1:
@@ -283,7 +306,7 @@ def assess_errors(validator, validation_errors, data_model):
             if error_key not in error_exceptions:
                 dm_errors[error_key]['score'] = dm_errors[error_key]['weight']
                 error_count += 1
-                error_weight += dm_errors[error_key]['weight']
+                indicators[error_key] = indicators.get(error_key, 0) + 1
                 dm_errors[error_key]['err_msg'] = e.message[-128:]
 
     metadataCount = data_model.get('structuralMetadata', {})
@@ -297,65 +320,45 @@ def assess_errors(validator, validation_errors, data_model):
            'structuralMetadata.dataType': metadataCount.get('structuralMetadata.dataType', 0),
            'structuralMetadata.sensitive': metadataCount.get('structuralMetadata.sensitive', 0), }
 
-    denominator = smd['structuralMetadata.dataClassesCount']
-    if denominator > 0:
-        if denominator > smd['structuralMetadata.tableName']:
-            score = (denominator - smd['structuralMetadata.tableName']) / denominator
-            dm_errors['structuralMetadata.tableName']['score'] = score * dm_errors['structuralMetadata.tableName'][
-                'weight']
-            error_count += 1
-            error_weight += dm_errors['structuralMetadata.tableName']['score']
-        if denominator > smd['structuralMetadata.tableDescription']:
-            score = (denominator - smd['structuralMetadata.tableDescription']) / denominator
-            dm_errors['structuralMetadata.tableDescription']['score'] = score * dm_errors[
-                'structuralMetadata.tableDescription']['weight']
-            error_count += 1
-            error_weight += dm_errors['structuralMetadata.tableDescription']['score']
-    else:
-        dm_errors['structuralMetadata.dataClassesCount']['score'] = dm_errors['structuralMetadata.dataClassesCount'][
-            'weight']
-        error_count += 1
-        error_weight += dm_errors['structuralMetadata.dataClassesCount']['weight']
-        dm_errors['structuralMetadata.tableName']['score'] = dm_errors['structuralMetadata.tableName']['weight']
-        error_count += 1
-        error_weight += dm_errors['structuralMetadata.tableName']['weight']
-        dm_errors['structuralMetadata.tableDescription']['score'] = dm_errors['structuralMetadata.tableDescription'][
-            'weight']
-        error_count += 1
-        error_weight += dm_errors['structuralMetadata.tableDescription']['weight']
-    denominator = smd['structuralMetadata.dataElementsCount']
-    if denominator > 0:
-        if denominator > smd['structuralMetadata.columnName']:
-            score = (denominator - smd['structuralMetadata.columnName']) / denominator
-            dm_errors['structuralMetadata.columnName']['score'] = score * dm_errors['structuralMetadata.columnName'][
-                'weight']
-            error_count += 1
-            error_weight += dm_errors['structuralMetadata.columnName']['score']
-        if denominator > smd['structuralMetadata.columnDescription']:
-            score = (denominator - smd['structuralMetadata.columnDescription']) / denominator
-            dm_errors['structuralMetadata.columnDescription']['score'] = score * dm_errors[
-                'structuralMetadata.columnDescription']['weight']
-            error_count += 1
-            error_weight += dm_errors['structuralMetadata.columnDescription']['score']
-        if denominator > smd['structuralMetadata.dataType']:
-            score = (denominator - smd['structuralMetadata.dataType']) / denominator
-            dm_errors['structuralMetadata.dataType']['score'] = score * dm_errors['structuralMetadata.dataType'][
-                'weight']
-            error_count += 1
-            error_weight += dm_errors['structuralMetadata.dataType']['score']
-    else:
-        dm_errors['structuralMetadata.columnName']['score'] = dm_errors['structuralMetadata.columnName']['weight']
-        error_count += 1
-        error_weight += dm_errors['structuralMetadata.columnName']['score']
-        dm_errors['structuralMetadata.columnDescription']['score'] = dm_errors['structuralMetadata.columnDescription'][
-            'weight']
-        error_count += 1
-        error_weight += dm_errors['structuralMetadata.columnDescription']['score']
-        dm_errors['structuralMetadata.dataType']['score'] = dm_errors['structuralMetadata.dataType']['weight']
-        error_count += 1
-        error_weight += dm_errors['structuralMetadata.dataType']['score']
+    # the share of tables (columns) missing a name, description or data type counts as that share of an error
+    coverage = {'structuralMetadata.dataClassesCount': ['structuralMetadata.tableName',
+                                                        'structuralMetadata.tableDescription'],
+                'structuralMetadata.dataElementsCount': ['structuralMetadata.columnName',
+                                                         'structuralMetadata.columnDescription',
+                                                         'structuralMetadata.dataType']}
+    for count_key, error_keys in coverage.items():
+        denominator = smd[count_key]
+        if denominator > 0:
+            for error_key in error_keys:
+                if denominator > smd[error_key]:
+                    score = (denominator - smd[error_key]) / denominator
+                    dm_errors[error_key]['score'] = score * dm_errors[error_key]['weight']
+                    error_count += 1
+                    indicators[error_key] = indicators.get(error_key, 0) + score
+        else:
+            # no tables counts the table count itself as an error, no columns does not
+            if 'structuralMetadata.dataClassesCount' == count_key:
+                error_keys = [count_key] + error_keys
+            for error_key in error_keys:
+                dm_errors[error_key]['score'] = dm_errors[error_key]['weight']
+                error_count += 1
+                indicators[error_key] = indicators.get(error_key, 0) + 1
+
+    return {'count': error_count, 'indicators': indicators, 'errors': dm_errors}
+
 
-    return {'count': error_count, 'weight': error_weight, 'errors': dm_errors}
+def assess_schema_errors(val_schema_path, validation_errors, data_model, targeted=False):
+    # runs in the validation worker processes; the validators are compiled once per process
+    if targeted:
+        attributes = [attr for attr in validation_errors if not attr.startswith('structuralMetadata.')]
+        return assess_errors(None, validation_errors, data_model,
+                             get_attribute_validators(val_schema_path, attributes))
+    return assess_errors(get_validator(val_schema_path), validation_errors, data_model)
+
+
+def assess_data_model(val_schema_path, completeness, validation_errors, data_model, targeted=False):
+    return {'completeness': assess_completeness(completeness, data_model),
+            'errors': assess_schema_errors(val_schema_path, validation_errors, data_model, targeted)}
 
 
 def explain_score(dm_completeness, dm_errors):
@@ -384,21 +387,14 @@ def explain_score(dm_completeness, dm_errors):
     return score_details
 
 
-def determine_medallion(medallions, dm_score):
-    for medallion, rules in medallions.items():
-        if rules['min excluding'] < dm_score['weighted_quality_score'] <= rules['max including']:
-            dm_score['weighted_quality_rating'] = medallion
-            return
-    return
-
-
-def score_data_models(val_schema_path, val_weights_path, m_path, data_models, debug_out=False):
+def score_data_models(val_schema_path, val_weights_path, m_path, data_models, debug_out=False, workers=1,
+                      targeted=False, cache=None):
     write_timestamp(f"scoring {len(data_models)} datasets")
-    validation_schema = get_json(val_schema_path)
-    dm_validator = jsonschema.Draft7Validator(validation_schema, format_checker=jsonschema.draft7_format_checker)
     completeness = get_validation_weights(val_weights_path)
     validation_errors = get_validation_weights(val_weights_path)
     medallions = get_json(m_path)
+    # the PIDs of this run's pidList, persisted by datasets.py
+    pid_index = load_pid_index()
 
     score_json = {'schema_version': '2.0.1',
                 'pid': '',
@@ -424,28 +420,45 @@ def score_data_models(val_schema_path, val_weights_path, m_path, data_models, de
         if not data_model.get('id', None):
             write_timestamp(
                 f"  ERR: no id for {data_model['summary']['publisher']['name']}>'{data_model['summary']['title']}'")
-            continue
+    data_models = [data_model for data_model in data_models if data_model.get('id', None)]
+    # schema validation dominates scoring, so it runs on the process pool ahead of the rest
+    assess = functools.partial(assess_data_model, val_schema_path, completeness, validation_errors, targeted=targeted)
+    if cache is not None:
+        # unchanged data models keep their scores while the schema and weights stay the same
+        context = [schema_hash(val_schema_path), completeness, targeted]
+        assessed = cache.map('data_model_scoring', context, assess, data_models, workers=workers,
+                             schemas=[val_schema_path])
+    else:
+        assessed = validate_map(assess, data_models, workers=workers, schemas=[val_schema_path])
+    # weighted completeness and errors of every data model, one matrix-vector product each
+    engine = ScoringEngine({attr: score['weight'] for attr, score in completeness.items()})
+    completeness_weights = engine.scores([dm_assessed['completeness']['indicators'] for dm_assessed in assessed])
+    error_weights = engine.scores([dm_assessed['errors']['indicators'] for dm_assessed in assessed])
+    quality_scores = [round(50 * (cmpl_weight + (1 - err_weight)), 2)
+                      for cmpl_weight, err_weight in zip(completeness_weights, error_weights)]
+    ratings = medallion_ratings(quality_scores, medallions, score_json['weighted_quality_rating'])
+    scored = zip(data_models, assessed, completeness_weights, error_weights, ratings)
+    for data_model, dm_assessed, cmpl_weight, err_weight, rating in scored:
         # if 'NHS DIGITAL'!=data_model['summary']['publisher']['name'].upper():
         #     continue
         dm_score = copy.deepcopy(score_json)
-        dm_score['pid'] = data_model['pid']
+        dm_score['pid'] = pid_index.get(data_model['id'], data_model['pid'])
         dm_score['id'] = data_model['id']
         dm_score['publisher'] = f"{data_model['summary']['publisher']['memberOf']} > {data_model['summary']['publisher']['name']}"
         dm_score['title'] = data_model['summary']['title']
-        dm_completeness = assess_completeness(completeness, data_model)
-        dm_errors = assess_errors(dm_validator, validation_errors, data_model)
+        dm_completeness, dm_errors = dm_assessed['completeness'], dm_assessed['errors']
         all_scores['Organisation'].append(data_model['summary']['publisher'].get('name', 'no org'))
         all_scores['Title'].append(data_model['summary'].get('title', 'no title'))
         all_scores['id'].append(data_model['id'])
-        cmpl_sc = (100 * dm_completeness['weight'])
+        cmpl_sc = (100 * cmpl_weight)
         dm_score['weighted_completeness_percent'] = round(cmpl_sc, 2)
         all_scores['Completeness'].append(f"{cmpl_sc:.2f}%")
-        err_sc = (100 * dm_errors['weight'])
+        err_sc = (100 * err_weight)
         dm_score['weighted_error_percent'] = round(err_sc, 2)
         all_scores['Errors'].append(f"{err_sc:.2f}%")
-        total_sc = 50 * ((dm_completeness['weight']) + (1 - dm_errors['weight']))
+        total_sc = 50 * (cmpl_weight + (1 - err_weight))
         dm_score['weighted_quality_score'] = round(total_sc, 2)
-        determine_medallion(medallions, dm_score)
+        dm_score['weighted_quality_rating'] = rating
         all_scores['Score'].append(f"{total_sc:.2f}%")
         reference_key = f"data-model-{reference_counter:04d}"
         reference_counter -= 1
@@ -485,20 +498,42 @@ def write_metadata_quality(dm_scores):
     return
 
 
-def main():
+def main(workers=1, targeted=False, cache_dir=RESULT_CACHE_DIR):
     write_header()
 
+    cache = None
+    if cache_dir is not None:
+        cache = ResultCache(os.path.join(cache_dir, 'quality_checks_v2.json'))
+        cache.load()
+
     data_models = get_datamodels(DM_JSON_PATH)
 
-    dm_scores = score_data_models(VALIDATION_SCHEMA_PATH, VALIDATION_WEIGHTS_PATH, MEDALLIONS, data_models, True)
+    dm_scores = score_data_models(VALIDATION_SCHEMA_PATH, VALIDATION_WEIGHTS_PATH, MEDALLIONS, data_models, True,
+                                  workers=workers, targeted=targeted, cache=cache)
 
     write_metadata_quality(dm_scores)
 
+    if cache is not None:
+        cache.save()
+        write_timestamp(f"result cache: {cache.summary()}")
+
     # TODO: Incorporate Utility scores from V1
 
     write_timestamp(f"done")
 
 
 if '__main__' == __name__:
-    main()
+    import argparse
+    parser = argparse.ArgumentParser(description='Score v2 metadata quality')
+    parser.add_argument('--workers', metavar='N', type=int, default=VALIDATION_WORKERS,
+                        help='Number of validation processes (default: one per core, 1 = serial)')
+    parser.add_argument('--targeted', action='store_true',
+                        help='Validate only the weighted attributes, each against its own part of the schema')
+    parser.add_argument('--cache-dir', metavar='DIR', dest='cache_dir', type=str, default=RESULT_CACHE_DIR,
+                        help='Directory for the scoring results kept between runs')
+    parser.add_argument('--no-cache', dest='cache_dir', action='store_const', const=None,
+                        help='Score every data model, ignoring and not updating the result cache')
+    args = parser.parse_args()
+
+    main(workers=args.workers, targeted=args.targeted, cache_dir=args.cache_dir)
     print(f" bye ...")
\ No newline at end of file
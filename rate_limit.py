@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# usage: from rate_limit import controller
+__license__ = "Apache 2"
+
+import os
+import json
+import time
+import threading
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+from telemetry import URLClassifier, OTHER
+
+# Defaults for any host; RATE_LIMITS (JSON of host -> overrides) tunes individual hosts, e.g.
+#   RATE_LIMITS='{"metadata-catalogue.org": {"rate": 40, "max_concurrency": 32}}'
+# A rate of None leaves the token bucket unlimited, so only the adaptive window applies.
+DEFAULT_LIMITS = {
+  'rate': float(os.environ['RATE_LIMIT_RATE']) if 'RATE_LIMIT_RATE' in os.environ else None,
+  'burst': float(os.environ.get('RATE_LIMIT_BURST', 20)),
+  'max_concurrency': int(os.environ.get('RATE_LIMIT_MAX_CONCURRENCY', 16)),
+  'min_concurrency': 1,
+  'latency_tolerance': 3.0,
+}
+HOST_LIMITS = {
+  # The Gateway API used to be paged with a fixed one second pause
+  'api.www.healthdatagateway.org': {'rate': 2, 'burst': 2, 'max_concurrency': 4},
+}
+HOST_LIMITS.update(json.loads(os.environ.get('RATE_LIMITS', '{}')))
+
+CONGESTION_STATUSES = (429, 503)
+DECREASE_FACTOR = 0.5
+# Latencies below this are never treated as congestion, however much they vary
+MIN_LATENCY_SIGNAL = 0.05
+
+
+def retry_after_seconds(r):
+  """Seconds requested by a Retry-After header (delta-seconds or HTTP date), or None"""
+  value = getattr(r, 'headers', {}).get('Retry-After', None)
+  if value is None:
+    return None
+  try:
+    return max(0.0, float(value))
+  except ValueError:
+    pass
+  try:
+    return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+  except (TypeError, ValueError):
+    return None
+
+
+class HostLimiter:
+  """Token bucket plus AIMD concurrency window for one upstream host.
+
+  Every request takes a token (refilled at `rate` per second, up to `burst`)
+  and a slot in the concurrency window. The token bucket is the host's hard
+  ceiling; the window adapts below it. Successful responses grow the window
+  by one slot per window's worth of requests, while a 429/503 or latency well
+  above the best seen halves it, at most once per cooldown. Latency is
+  tracked per endpoint (URL template), so a heavy endpoint is compared with
+  its own best rather than with the host's cheapest calls. A Retry-After
+  header pauses the whole host.
+  """
+
+  def __init__(self, host, rate, burst, max_concurrency, min_concurrency, latency_tolerance):
+    self.host = host
+    self.rate = float('inf') if rate is None else rate
+    self.burst = max(1.0, burst)
+    self.tokens = self.burst
+    self.max_concurrency = max_concurrency
+    self.min_concurrency = min(min_concurrency, max_concurrency)
+    self.window = float(max_concurrency)
+    self.latency_tolerance = latency_tolerance
+    self.in_flight = 0
+    self.paused_until = 0.0
+    # Latency EWMA and best latency of each endpoint
+    self.latency = {}
+    self.best_latency = {}
+    self.last_decrease = 0.0
+    self.stats = {'requests': 0, 'congestion': 0, 'paused_seconds': 0.0}
+    self._updated = time.monotonic()
+    self._cond = threading.Condition()
+
+  def _refill(self, now):
+    if self.rate == float('inf'):
+      self.tokens = self.burst
+    else:
+      self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+    self._updated = now
+
+  def acquire(self):
+    """Block until the host is not paused, a token is available and the window has room"""
+    with self._cond:
+      while True:
+        now = time.monotonic()
+        self._refill(now)
+        if now < self.paused_until:
+          wait = self.paused_until - now
+        elif self.in_flight >= int(self.window):
+          wait = None
+        elif self.tokens < 1:
+          wait = (1 - self.tokens) / self.rate
+        else:
+          self.tokens -= 1
+          self.in_flight += 1
+          self.stats['requests'] += 1
+          return
+        self._cond.wait(wait)
+
+  def _decrease(self, now, latency):
+    # One decrease per cooldown, so a burst of concurrent 429s counts once
+    cooldown = max(1.0, 2 * (latency or 0))
+    if now - self.last_decrease < cooldown:
+      return
+    self.last_decrease = now
+    self.window = max(self.min_concurrency, self.window * DECREASE_FACTOR)
+    self.stats['congestion'] += 1
+
+  def release(self, status=None, latency=None, retry_after=None, endpoint=OTHER):
+    """Return the slot and adapt to the outcome of the request.
+
+    @param status: HTTP status, or None when the request raised
+    @param latency: seconds the request took
+    @param retry_after: seconds the server asked us to wait, if any
+    @param endpoint: URL template of the request, whose latency baseline it is compared with
+    """
+    with self._cond:
+      now = time.monotonic()
+      self.in_flight -= 1
+      congested = status in CONGESTION_STATUSES
+      if latency is not None and status is not None and not congested:
+        average = self.latency.get(endpoint, None)
+        average = self.latency[endpoint] = latency if average is None else 0.8 * average + 0.2 * latency
+        best = self.best_latency.get(endpoint, None)
+        if best is None or latency < best:
+          best = latency
+        else:
+          # Let the baseline drift up slowly so a one-off fast response does not pin it
+          best += 0.01 * (latency - best)
+        self.best_latency[endpoint] = best
+        congested = average > MIN_LATENCY_SIGNAL and average > self.latency_tolerance * best
+      if retry_after is not None and retry_after > 0:
+        if now + retry_after > self.paused_until:
+          self.stats['paused_seconds'] += now + retry_after - max(now, self.paused_until)
+          self.paused_until = now + retry_after
+      if congested:
+        self._decrease(now, self.latency.get(endpoint, None))
+      elif status is not None and status < 400:
+        self.window = min(self.max_concurrency, self.window + 1.0 / self.window)
+      self._cond.notify_all()
+
+  def summary(self):
+    with self._cond:
+      return dict(self.stats, window=round(self.window, 2),
+                  latency={endpoint: round(average, 4) for endpoint, average in sorted(self.latency.items())})
+
+
+class RateController:
+  """Per-host HostLimiters shared by every fetcher in the process"""
+
+  def __init__(self, defaults=None, host_limits=None, templates=None):
+    """
+    @param templates: dict of name -> URL template, the endpoints latency is tracked by
+    """
+    self.defaults = dict(DEFAULT_LIMITS if defaults is None else defaults)
+    self.host_limits = dict(HOST_LIMITS if host_limits is None else host_limits)
+    self.classifier = URLClassifier(templates or {})
+    self.limiters = {}
+    self._lock = threading.Lock()
+
+  def configure(self, host, **limits):
+    """Set limits for a host (rate, burst, max_concurrency, min_concurrency, latency_tolerance)"""
+    with self._lock:
+      self.host_limits[host] = dict(self.host_limits.get(host, {}), **limits)
+      self.limiters.pop(host, None)
+
+  def use_templates(self, templates):
+    """Track latency per URL template (e.g. datasets.URL_TEMPLATES) instead of per host"""
+    self.classifier = URLClassifier(templates)
+
+  def limiter(self, url):
+    host = urlsplit(url).netloc
+    with self._lock:
+      limiter = self.limiters.get(host, None)
+      if limiter is None:
+        limits = dict(self.defaults, **self.host_limits.get(host, {}))
+        limiter = self.limiters[host] = HostLimiter(host, **limits)
+      return limiter
+
+  def call(self, url, send):
+    """Run send() for url inside the host's limits and feed the outcome back.
+
+    @param send: callable making the request and returning the response
+    @return: whatever send() returns; exceptions are re-raised after release
+    """
+    limiter = self.limiter(url)
+    endpoint = self.classifier.classify(url)
+    limiter.acquire()
+    start = time.monotonic()
+    try:
+      r = send()
+    except Exception:
+      limiter.release(None, time.monotonic() - start, endpoint=endpoint)
+      raise
+    limiter.release(r.status_code, time.monotonic() - start, retry_after_seconds(r), endpoint)
+    return r
+
+  def summary(self):
+    with self._lock:
+      limiters = dict(self.limiters)
+    return {host: limiter.summary() for host, limiter in limiters.items()}
+
+
+controller = RateController()
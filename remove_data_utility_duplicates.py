@@ -7,8 +7,9 @@ Created on Wed Oct 13 11:10:12 2021
 
 
 
+import os
 import pandas as pd
-import requests
+import transport
 
 
 
@@ -17,8 +18,8 @@ import requests
 def Update_Utility_scores(csv_df,api_url):
     
     #This section gets the Active datasets from HDR API
-    r = requests.get(
-            url = api_url+'/api/v2/datasets',
+    r = transport.get(
+            api_url+'/api/v2/datasets',
             params = {'fields': 'name,pid,datasetid,datasetfields.publisher','activeflag':'active'}
         )
     
@@ -75,7 +76,7 @@ def Update_Utility_scores(csv_df,api_url):
 
 def main():
     # ASSUMING THIS BOTTOM SECTION CAN BE REMOVED
-    api_url = 'https://api.www.healthdatagateway.org/'
+    api_url = os.environ.get('GATEWAY_API_BASE_URL', 'https://api.www.healthdatagateway.org')
     #Add a word cleanup as well (trialling spaces etc.)
     filepath = 'C:/Users/DamonChow/Box/Damon Chow/Working/github Data utility/data_utility_original.csv'
     final_df = Update_Utility_scores(filepath,api_url)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# usage: from result_cache import ResultCache
+__license__ = "Apache 2"
+
+import os
+import json
+import hashlib
+
+from validation_pool import validate_map
+
+RESULT_CACHE_DIR = os.path.join('.cache', 'results')
+# Bump when the validation or scoring rules change, so cached results are not reused
+RESULT_CACHE_VERSION = 2
+
+
+def json_copy(result):
+  """Independent copy of a JSON-compatible result, as it reads back from the cache file"""
+  return json.loads(json.dumps(result))
+
+
+def fingerprint(*parts):
+  """sha256 of the canonical JSON of parts; equal content gives an equal fingerprint"""
+  content = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+  return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+  """Per-model validation and scoring results kept between runs.
+
+  A result is stored under the fingerprint of the stage that produced it, the
+  stage's context (schema content hash, weights, reporting options) and the
+  content of the projected data model it was computed from. A data model that
+  is byte-identical to one seen in an earlier run, under the same schema and
+  weights, gets its stored result back without being validated again; only
+  changed or new data models go to the validation pool. Results must survive a
+  JSON round trip unchanged. Saving keeps just the results used in this run.
+  """
+
+  def __init__(self, filename, version=RESULT_CACHE_VERSION):
+    """
+    @param filename: JSON file holding the stored results
+    @param version: cache format and rules version, part of every key
+    """
+    self.filename = filename
+    self.version = version
+    self.stored = {}
+    self.results = {}
+    self.stats = {}
+
+  def load(self):
+    if not os.path.isfile(self.filename):
+      return 0
+    with open(self.filename, 'r') as cache_file:
+      self.stored = json.load(cache_file)
+    print("Read", len(self.stored), "cached results from", self.filename)
+    return len(self.stored)
+
+  def save(self):
+    os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+    # one dumps call encodes far faster than dump's chunked writes
+    content = json.dumps(self.results, separators=(',', ':'))
+    with open(self.filename + '.part', 'w') as cache_file:
+      cache_file.write(content)
+    os.replace(self.filename + '.part', self.filename)
+
+  def map(self, stage, context, func, items, workers=1, schemas=(), content=None):
+    """validate_map(func, items) that only runs func for items without a stored result
+
+    @param stage: name of the check, e.g. 'schema_validation'
+    @param context: everything besides the item the result depends on
+    @param content: optional callable giving the part of an item the result depends on
+    @return: list of results, in input order
+    """
+    items = list(items)
+    keys = [fingerprint(self.version, stage, context, item if content is None else content(item)) for item in items]
+    results = [None] * len(items)
+    missing = []
+    for i, key in enumerate(keys):
+      if key in self.results:
+        results[i] = json_copy(self.results[key])
+      elif key in self.stored:
+        self.results[key] = self.stored.pop(key)
+        results[i] = json_copy(self.results[key])
+      else:
+        missing.append(i)
+    fresh = validate_map(func, [items[i] for i in missing], workers=workers, schemas=schemas)
+    for i, result in zip(missing, fresh):
+      # stored as it will read back, so cached and fresh reports are alike
+      self.results[keys[i]] = json_copy(result)
+      results[i] = result
+    hits, total = self.stats.get(stage, (0, 0))
+    self.stats[stage] = (hits + len(items) - len(missing), total + len(items))
+    return results
+
+  def summary(self):
+    """Hit rate of every stage, e.g. 'schema_validation 240/250 (96.0%)'"""
+    return ", ".join("{} {}/{} ({:.1f}%)".format(stage, hits, total, 100.0 * hits / total if total else 0.0)
+                     for stage, (hits, total) in self.stats.items())
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# usage: from revision_graph import RevisionGraph
+__license__ = "Apache 2"
+
+import re
+import threading
+
+from concurrency import ordered_map
+
+
+def version_key(version):
+  """Sort key for documentationVersion strings such as '2.0.1'; numeric parts compare as numbers"""
+  return tuple((int(part), '') if part.isdigit() else (-1, part) for part in re.split(r'[.\-]', version or ''))
+
+
+class RevisionGraph:
+  """Catalogue-wide graph of data model versions joined by semantic links.
+
+  Each model's semantic links are fetched at most once. Models connected by
+  links form a version family (a connected component) and every member of a
+  family shares the same documentationVersion -> model id map. The graph can
+  be extended with build() while other threads read revisions().
+  """
+
+  def __init__(self, fetch_links):
+    """
+    @param fetch_links: callable returning the semanticLinks response for a model id
+    """
+    self.fetch_links = fetch_links
+    self.links = {}
+    self.parent = {}
+    self._families = None
+    self._lock = threading.RLock()
+
+  def _find(self, id):
+    self.parent.setdefault(id, id)
+    root = id
+    while self.parent[root] != root:
+      root = self.parent[root]
+    while self.parent[id] != root:
+      self.parent[id], id = root, self.parent[id]
+    return root
+
+  def _union(self, a, b):
+    ra, rb = self._find(a), self._find(b)
+    if ra != rb:
+      self.parent[max(ra, rb)] = min(ra, rb)
+
+  def _fetch(self, id):
+    ret = self.fetch_links(id)
+    if ret.get('count', None) is None:
+      return id, None
+    links = []
+    if ret['count'] > 0:
+      for link in ret['items']:
+        links.append((link['source']['documentationVersion'], link['source']['id'],
+                      link['target']['documentationVersion'], link['target']['id']))
+    return id, links
+
+  def build(self, model_ids, workers=1):
+    """Fetch links breadth-first from model_ids until every reachable model is known"""
+    with self._lock:
+      frontier = [id for id in dict.fromkeys(model_ids) if id not in self.links]
+    while len(frontier):
+      discovered = []
+      for id, links in ordered_map(self._fetch, frontier, workers=workers):
+        with self._lock:
+          self.links[id] = links
+          self._find(id)
+          for _, src_id, _, tar_id in links or []:
+            self._union(src_id, tar_id)
+            discovered.extend([src_id, tar_id])
+      with self._lock:
+        frontier = [id for id in dict.fromkeys(discovered) if id not in self.links]
+    with self._lock:
+      self._families = None
+      self.families()
+    return self
+
+  def families(self):
+    """documentationVersion -> model id map for every family, keyed by family root"""
+    with self._lock:
+      if self._families is None:
+        families = {}
+        for id in sorted(self.links.keys()):
+          versions = families.setdefault(self._find(id), {})
+          for src_ver, src_id, tar_ver, tar_id in self.links[id] or []:
+            versions[src_ver] = src_id
+            versions[tar_ver] = tar_id
+        self._families = families
+      return self._families
+
+  def revisions(self, model_id):
+    """Revisions map for a model: its family's versions plus 'latest' set to the model itself"""
+    with self._lock:
+      known = model_id in self.links
+    if not known:
+      self.build([model_id])
+    with self._lock:
+      if self.links[model_id] is None:
+        return {}
+      data = dict(self.families().get(self._find(model_id), {}))
+    data['latest'] = model_id
+    return data
+
+  def latest(self, model_ids):
+    """Newest of model_ids by the documentationVersion their families record.
+
+    Ids with no recorded version are ignored; None if no version is known.
+    """
+    versions = {}
+    for id in model_ids:
+      for version, member_id in self.revisions(id).items():
+        if version != 'latest':
+          versions.setdefault(member_id, version)
+    known = [id for id in dict.fromkeys(model_ids) if id in versions]
+    if not len(known):
+      return None
+    return max(known, key=lambda id: (version_key(versions[id]), id))
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# usage: schema_registry.py [--refresh] [SCHEMA_URI ...]
+#
+# Pins JSON schemas to a local cache and prints their content hashes.
+__license__ = "Apache 2"
+
+import os
+import re
+import json
+import hashlib
+import threading
+
+import requests
+import transport
+from http_cache import ResponseCache, HTTP_CACHE_TTL
+from jsonschema import Draft7Validator, draft7_format_checker
+from attribute_validators import AttributeValidators
+
+SCHEMA_CACHE_DIR = os.path.join('.cache', 'schemas')
+SCHEMA_PINS_JSON = 'pins.json'
+# Path segments naming a released schema version, e.g. 1.1.7 or v2.0.2
+VERSION_SEGMENT = re.compile(r'^v?\d+(\.\d+)+$')
+
+
+def content_hash(content):
+  """sha256 hex digest of a schema document's bytes"""
+  return hashlib.sha256(content).hexdigest()
+
+
+def versioned_uri(uri):
+  """True if uri names a released schema version, whose content does not change once published"""
+  segments = uri.split('?')[0].split('/')
+  return 'latest' not in segments and any(VERSION_SEGMENT.match(segment) for segment in segments)
+
+
+def schema_bytes(schema):
+  """Canonical bytes of an in-memory schema, so equal schemas hash alike"""
+  return json.dumps(schema, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+class SchemaRegistry:
+  """JSON schemas fetched once, pinned on disk by content hash, and compiled once.
+
+  A remote schema is downloaded the first time it is asked for and stored, in
+  canonical JSON form, as <sha256>.json under cache_dir; pins.json maps its URI
+  to that hash. A versioned URI (.../1.1.7/...) is immutable, so later runs read
+  its pinned copy, after checking its hash, without touching the network, until
+  the pin is refreshed. A moving URI (.../latest/...) is revalidated on every
+  run through a ResponseCache under cache_dir/http, with ETag/Last-Modified or,
+  lacking those, after ttl seconds, and re-pinned when its content changes; its
+  pin is only served as-is, with a warning, when it cannot be revalidated. Every process holds one compiled
+  Draft7Validator per schema content, however many URIs or models use it, and
+  one set of per-attribute sub-validators per schema content and path list.
+  """
+
+  def __init__(self, cache_dir=SCHEMA_CACHE_DIR, refresh=False, ttl=HTTP_CACHE_TTL):
+    """
+    @param cache_dir: directory holding the pinned schemas and pins.json
+    @param refresh: fetch remote schemas again and re-pin them on first use
+    @param ttl: seconds a moving schema without ETag/Last-Modified is used before it is fetched again
+    """
+    self.cache_dir = cache_dir
+    self.refresh = refresh
+    self.ttl = ttl
+    self.pins = None
+    self.hashes = {}
+    self.schemas = {}
+    self.validators = {}
+    self.attribute_validators = {}
+    self._lock = threading.RLock()
+
+  def _pins_filename(self):
+    return os.path.join(self.cache_dir, SCHEMA_PINS_JSON)
+
+  def _load_pins(self):
+    if self.pins is None:
+      self.pins = {}
+      if os.path.isfile(self._pins_filename()):
+        with open(self._pins_filename(), 'r') as pins_file:
+          self.pins = json.load(pins_file)
+    return self.pins
+
+  def _pinned(self, uri, force=False):
+    """Bytes of the pinned copy of uri, or None if it is missing or does not match its hash
+
+    @param force: return the pin even when refreshing
+    """
+    digest = self._load_pins().get(uri, None)
+    if digest is None or (self.refresh and not force):
+      return None
+    filename = os.path.join(self.cache_dir, digest + '.json')
+    if not os.path.isfile(filename):
+      return None
+    with open(filename, 'rb') as schema_file:
+      content = schema_file.read()
+    if content_hash(content) != digest:
+      print("Pinned schema", filename, "does not match its hash; fetching", uri, "again")
+      return None
+    return content
+
+  def _pin(self, uri, content):
+    digest = content_hash(content)
+    os.makedirs(self.cache_dir, exist_ok=True)
+    filename = os.path.join(self.cache_dir, digest + '.json')
+    if not os.path.isfile(filename):
+      with open(filename + '.part', 'wb') as schema_file:
+        schema_file.write(content)
+      os.replace(filename + '.part', filename)
+    pins = self._load_pins()
+    pins[uri] = digest
+    with open(self._pins_filename() + '.part', 'w') as pins_file:
+      json.dump(pins, pins_file, indent=2, sort_keys=True)
+    os.replace(self._pins_filename() + '.part', self._pins_filename())
+    print("Pinned schema", uri, "as", digest)
+
+  def _read(self, uri):
+    """Canonical bytes of a schema file or URL, fetching and pinning remote schemas"""
+    if os.path.isfile(uri):
+      with open(uri, 'r') as schema_file:
+        return schema_bytes(json.load(schema_file))
+    if not uri.startswith('http'):
+      raise ValueError("Unknown schema location: {}".format(uri))
+    if not versioned_uri(uri) and not self.refresh:
+      return self._revalidate(uri)
+    content = self._pinned(uri)
+    if content is None:
+      r = transport.get(uri)
+      r.raise_for_status()
+      content = schema_bytes(r.json())
+      self._pin(uri, content)
+    return content
+
+  def _revalidate(self, uri):
+    """Current bytes of a moving schema URI, re-pinning it when its content has changed"""
+    cache = ResponseCache(os.path.join(self.cache_dir, 'http'), ttl=self.ttl)
+    try:
+      r = cache.fetch(uri, transport.get)
+      r.raise_for_status()
+    except requests.RequestException as e:
+      content = self._pinned(uri, force=True)
+      if content is None:
+        raise
+      print("WARNING: could not revalidate", uri, "({}); validating against its pinned copy {},"
+            " which may be out of date".format(e, self.pins[uri]))
+      return content
+    content = schema_bytes(r.json())
+    if self._load_pins().get(uri, None) != content_hash(content):
+      self._pin(uri, content)
+    return content
+
+  def _resolve(self, schema):
+    """Content hash of a schema given as a URI, file path or dict, loading it if needed"""
+    if isinstance(schema, dict):
+      digest = content_hash(schema_bytes(schema))
+      with self._lock:
+        self.schemas.setdefault(digest, schema)
+      return digest
+    with self._lock:
+      digest = self.hashes.get(schema, None)
+      if digest is None:
+        content = self._read(schema)
+        digest = content_hash(content)
+        self.schemas.setdefault(digest, json.loads(content))
+        self.hashes[schema] = digest
+      return digest
+
+  def hash(self, schema):
+    """sha256 of the schema's content; identifies the schema version in caches and reports"""
+    return self._resolve(schema)
+
+  def schema(self, schema):
+    """The schema document. It is shared by every caller, so treat it as read-only"""
+    return self.schemas[self._resolve(schema)]
+
+  def validator(self, schema):
+    """Draft7Validator for a schema URI, path or dict, compiled once per schema content"""
+    if isinstance(schema, Draft7Validator):
+      return schema
+    digest = self._resolve(schema)
+    with self._lock:
+      validator = self.validators.get(digest, None)
+      if validator is None:
+        validator = Draft7Validator(self.schemas[digest], format_checker=draft7_format_checker)
+        self.validators[digest] = validator
+      return validator
+
+  def attributes(self, schema, paths):
+    """AttributeValidators for the given attribute paths, compiled once per schema content and path list"""
+    key = (self._resolve(schema), tuple(paths))
+    with self._lock:
+      validators = self.attribute_validators.get(key, None)
+      if validators is None:
+        validators = AttributeValidators(self.schemas[key[0]], paths)
+        self.attribute_validators[key] = validators
+      return validators
+
+
+registry = SchemaRegistry(refresh=os.environ.get('SCHEMA_REFRESH', '') not in ('', '0'))
+
+
+def get_schema(schema):
+  return registry.schema(schema)
+
+
+def get_validator(schema):
+  return registry.validator(schema)
+
+
+def get_attribute_validators(schema, paths):
+  return registry.attributes(schema, paths)
+
+
+def schema_hash(schema):
+  return registry.hash(schema)
+
+
+if __name__ == "__main__":
+  import argparse
+  from validate_schema import DATASET_SCHEMA
+  from quality_checks_v2 import VALIDATION_SCHEMA_PATH
+  parser = argparse.ArgumentParser(description='Pin JSON schemas to the local schema cache')
+  parser.add_argument('schemas', metavar='SCHEMA_URI', nargs='*', default=[DATASET_SCHEMA, VALIDATION_SCHEMA_PATH])
+  parser.add_argument('--refresh', action='store_true', help='Fetch the schemas again and update their pins')
+  parser.add_argument('--cache-dir', metavar='DIR', dest='cache_dir', type=str, default=SCHEMA_CACHE_DIR)
+  args = parser.parse_args()
+
+  registry = SchemaRegistry(args.cache_dir, refresh=args.refresh)
+  for uri in args.schemas:
+    print(registry.hash(uri), uri)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# usage: from scoring_engine import ScoringEngine, medallion_ratings
+__license__ = "Apache 2"
+
+import numpy as np
+
+
+class ScoringEngine:
+  """Weighted scores of a whole catalogue as one matrix-vector product.
+
+  Each dataset is a row of indicators, one per weighted attribute: the
+  multiple of the attribute's weight the dataset earns (1 for a filled or
+  failing attribute, a fraction for the structural metadata coverage, 0 when
+  absent). The rows form a dense datasets x attributes matrix, and every
+  dataset's weighted score is its row times the weight vector.
+  """
+
+  def __init__(self, weights):
+    """
+    @param weights: mapping of attribute -> weight, in scoring order
+    """
+    self.attributes = list(weights)
+    self.index = {attribute: i for i, attribute in enumerate(self.attributes)}
+    self.weights = np.fromiter(weights.values(), dtype=np.float64, count=len(self.attributes))
+
+  def matrix(self, rows):
+    """datasets x attributes indicator matrix of rows of {attribute: indicator}; missing attributes are 0"""
+    matrix = np.zeros((len(rows), len(self.attributes)), dtype=np.float64)
+    for i, row in enumerate(rows):
+      for attribute, indicator in row.items():
+        matrix[i, self.index[attribute]] = indicator
+    return matrix
+
+  def scores(self, rows):
+    """Weighted score of every row, as a list of floats"""
+    if not len(rows):
+      return []
+    return (self.matrix(rows) @ self.weights).tolist()
+
+
+def medallion_ratings(scores, medallions, unrated='Not Rated'):
+  """Medallion of every score, from rules of the form min excluding < score <= max including
+
+  The bands are sorted by their upper bound and each score is placed with one
+  searchsorted; a score that falls in no band, e.g. on a lower bound or in a
+  gap between bands, is unrated.
+
+  @param medallions: {medallion: {'min excluding': ..., 'max including': ...}}, as in medallions.v2.json
+  @return: list of medallion names, in score order
+  """
+  bands = sorted(medallions.items(), key=lambda item: item[1]['max including'])
+  names = [medallion for medallion, _ in bands] + [unrated]
+  upper = np.array([rules['max including'] for _, rules in bands], dtype=np.float64)
+  # scores above every band land past the end, where no score clears the lower bound
+  lower = np.array([rules['min excluding'] for _, rules in bands] + [np.inf], dtype=np.float64)
+  scores = np.asarray(scores, dtype=np.float64)
+  band = np.searchsorted(upper, scores, side='left')
+  band = np.where(scores > lower[band], band, len(bands))
+  return [names[b] for b in band.tolist()]
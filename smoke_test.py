@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# usage: smoke_test.py [--models 12]
+#
+# Runs datasets.py --latest-only end to end against a local fixture_server.py, twice (full, then
+# incremental), and checks the records and tables it writes. Also collected by pytest.
+__license__ = "Apache 2"
+
+import os
+import sys
+import json
+import tempfile
+import subprocess
+
+from benchmark import start_fixture_server
+from fixture_server import server_environment
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SMOKE_MODELS = 12
+SMOKE_FAMILY_SIZE = 3
+
+
+def run_crawl(workdir, base_url, *args):
+  env = dict(os.environ)
+  env.update(server_environment(base_url))
+  result = subprocess.run([sys.executable, os.path.join(HERE, 'datasets.py'), '--no-cache'] + list(args),
+                          cwd=workdir, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+  assert result.returncode == 0, "datasets.py {} failed:\n{}".format(" ".join(args), result.stdout[-4000:])
+  return result.stdout
+
+
+def check_latest_only(workdir, models=SMOKE_MODELS, family_size=SMOKE_FAMILY_SIZE):
+  """Only the newest version of each family has structural metadata; the others are marked supersededBy"""
+  families = -(-models // family_size)
+  with open(os.path.join(workdir, 'datasets.json'), 'r') as json_file:
+    data_models = json.load(json_file)['dataModels']
+  assert len(data_models) == models, len(data_models)
+  current = set(dm['id'] for dm in data_models if not dm.get('supersededBy', None))
+  assert len(current) == families, len(current)
+  # not every model has v2 metadata, so the v2 records are checked one by one
+  for filename, structural_key in (('datasets.json', 'dataClasses'), ('datasets.v2.json', 'structuralMetadata')):
+    with open(os.path.join(workdir, filename), 'r') as json_file:
+      data_models = json.load(json_file)['dataModels']
+    for dm in data_models:
+      if dm.get('supersededBy', None):
+        assert structural_key not in dm, (filename, dm['id'])
+        assert dm['supersededBy'] in current, (filename, dm['id'])
+      else:
+        assert structural_key in dm, (filename, dm['id'])
+  for filename in ('datasets.csv', 'dataclasses.csv', 'dataelements.csv'):
+    assert os.path.isfile(os.path.join(workdir, filename)), filename
+
+  # the quality checks score only the current versions
+  cwd = os.getcwd()
+  os.chdir(workdir)
+  try:
+    from validate_schema import current_data_models, get_json
+    from quality_checks_v2 import get_datamodels
+    assert len(current_data_models(get_json('datasets.json'))['dataModels']) == families
+    v2_current = [dm for dm in get_json('datasets.v2.json')['dataModels'] if dm['id'] in current]
+    assert len(get_datamodels('datasets.v2.json')) == len(v2_current)
+  finally:
+    os.chdir(cwd)
+
+
+def test_latest_only_crawl(models=SMOKE_MODELS):
+  process, base_url = start_fixture_server(['--models', str(models), '--family-size', str(SMOKE_FAMILY_SIZE),
+                                            '--latency', '0', '--error-rate', '0', '--throttle-rate', '0'])
+  try:
+    with tempfile.TemporaryDirectory() as workdir:
+      run_crawl(workdir, base_url, '--latest-only', '--full')
+      check_latest_only(workdir, models)
+      # the second run reuses the previous records, including the superseded ones
+      output = run_crawl(workdir, base_url, '--latest-only')
+      assert "Reusing {} unchanged data models".format(models) in output, output[-4000:]
+      check_latest_only(workdir, models)
+  finally:
+    process.terminate()
+    process.wait()
+
+
+if __name__ == "__main__":
+  import argparse
+  parser = argparse.ArgumentParser(description='Smoke test datasets.py --latest-only against the fixture server')
+  parser.add_argument('--models', metavar='N', type=int, default=SMOKE_MODELS)
+  args = parser.parse_args()
+
+  test_latest_only_crawl(args.models)
+  print("OK")
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# usage: from table_export import export_tables
+__license__ = "Apache 2"
+
+import os
+import csv
+import json
+
+# Columns written first, in this order, when present; any other column
+# discovered while streaming follows in sorted order.
+DATA_MODELS_HEADERS = ['@schema', 'pid', 'id', 'identifier', 'version', 'revisions', 'modified', 'issued',
+                       'summary', 'documentation', 'coverage', 'provenance', 'accessibility',
+                       'enrichmentAndLinkage', 'observations', 'structuralMetadata']
+DATA_CLASSES_HEADERS = ['id', 'name', 'description', 'dataElementsCount', 'dataElements']
+DATA_ELEMENTS_HEADERS = ['id', 'name', 'description', 'dataType', 'dataModel', 'dataClass']
+
+
+def csv_value(value):
+  """Render a cell the way csv.DictWriter would, so it survives the spool round trip"""
+  if isinstance(value, (dict, list, tuple)):
+    return str(value)
+  return value
+
+
+class SpooledCSVWriter:
+  """CSV writer that discovers its columns while rows stream through.
+
+  Rows are spooled as NDJSON while their keys are collected; on close the
+  header is fixed (registry columns first, then new columns sorted) and the
+  spool is replayed into the CSV. Memory use is bounded by the column count,
+  not the row count, and the column order is the same on every run.
+  """
+
+  def __init__(self, filename, headers=None):
+    self.filename = filename
+    self.registry = list(headers or [])
+    self.columns = set()
+    self.count = 0
+    self._spool_name = filename + '.part'
+    self._spool = open(self._spool_name, 'w')
+
+  def write(self, row):
+    self.columns.update(row.keys())
+    self._spool.write(json.dumps({k: csv_value(v) for k, v in row.items()}))
+    self._spool.write('\n')
+    self.count += 1
+
+  def headers(self):
+    known = [h for h in self.registry if h in self.columns]
+    return known + sorted(self.columns - set(known))
+
+  def close(self):
+    if self._spool is None:
+      return
+    self._spool.close()
+    self._spool = None
+    with open(self.filename, 'w') as csvfile, open(self._spool_name, 'r') as spool:
+      writer = csv.DictWriter(csvfile, fieldnames=self.headers(), delimiter=',', quotechar='\"')
+      writer.writeheader()
+      for line in spool:
+        writer.writerow(json.loads(line))
+    os.remove(self._spool_name)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is None:
+      self.close()
+    else:
+      self._spool.close()
+      self._spool = None
+      os.remove(self._spool_name)
+
+
+def data_class_row(dc):
+  """dataClasses table row: the class with its elements replaced by their ids"""
+  row = dict(dc)
+  row['dataElements'] = ", ".join(de['id'] for de in dc.get('dataElements', []))
+  return row
+
+
+def data_element_row(de, dm, dc):
+  """dataElements table row: the element plus the ids of its model and class"""
+  row = dict(de)
+  row['dataType'] = de.get('dataType', None)
+  row['dataModel'] = dm.get('id', None)
+  row['dataClass'] = dc.get('id', None)
+  return row
+
+
+def data_model_row(dm):
+  """dataModels table row, with classes summarised as in the dataClasses table"""
+  row = dict(dm)
+  structural_metadata = dm.get('structuralMetadata', None)
+  if structural_metadata is not None:
+    structural_metadata = dict(structural_metadata)
+    structural_metadata['dataClasses'] = [data_class_row(dc) for dc in structural_metadata.get('dataClasses', [])]
+    row['structuralMetadata'] = structural_metadata
+  return row
+
+
+def export_tables(data_models, models_filename='datasets.csv', classes_filename='dataclasses.csv',
+                  elements_filename='dataelements.csv'):
+  """Write the dataModels, dataClasses and dataElements tables in a single pass over data_models.
+
+  data_models may be any iterable (e.g. an NDJSON reader); the source records
+  are neither copied wholesale nor modified.
+  @return: row counts for each table
+  """
+  with SpooledCSVWriter(models_filename, DATA_MODELS_HEADERS) as models, \
+       SpooledCSVWriter(classes_filename, DATA_CLASSES_HEADERS) as classes, \
+       SpooledCSVWriter(elements_filename, DATA_ELEMENTS_HEADERS) as elements:
+    for dm in data_models:
+      for dc in dm.get('structuralMetadata', {}).get('dataClasses', []):
+        for de in dc.get('dataElements', []):
+          elements.write(data_element_row(de, dm, dc))
+        classes.write(data_class_row(dc))
+      models.write(data_model_row(dm))
+  print("Count: DM ", models.count)
+  print("Count: DC ", classes.count)
+  print("Count: DE ", elements.count)
+  return {'dataModels': models.count, 'dataClasses': classes.count, 'dataElements': elements.count}
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# usage: from tech_profile import TechnicalProfile
+__license__ = "Apache 2"
+
+from itertools import chain
+
+import numpy as np
+
+# Thresholds of the v1 technical metadata checks, see validate_schema
+TM_NAME_LEN = 2
+TM_DESC_LEN = 6
+
+
+def text_length(item, key):
+  """Length of a field as the v1 checks measure it: str() of the value, '' when the key is absent"""
+  return len(str(item.get(key, '')))
+
+
+def has_data_type(de):
+  """v1 check for a populated dataType: a non-empty label, list or dict"""
+  data_type = de.get('dataType', [])
+  if data_type is None:
+    return False
+  if isinstance(data_type, (str, list, tuple, dict)):
+    return len(data_type) > 0
+  return True
+
+
+def length_column(items, key):
+  """text_length of key for every item, as an array"""
+  values = [item.get(key, '') for item in items]
+  # names and descriptions are nearly always strings, whose str() is themselves
+  if not set(map(type, values)) <= {str}:
+    values = list(map(str, values))
+  return np.fromiter(map(len, values), dtype=np.int64, count=len(items))
+
+
+def presence_column(items, key):
+  """Whether key holds a value other than None, for every item"""
+  return np.fromiter([item.get(key, None) is not None for item in items], dtype=bool, count=len(items))
+
+
+def data_type_column(items):
+  """has_data_type for every item, as an array"""
+  values = [item.get('dataType', []) for item in items]
+  if set(map(type, values)) <= {str, list, tuple, dict}:
+    return np.fromiter(map(len, values), dtype=np.int64, count=len(items)) > 0
+  return np.fromiter(map(has_data_type, items), dtype=bool, count=len(items))
+
+
+class TechnicalProfile:
+  """Columnar profile of the data classes and elements of many data models.
+
+  Every class and every element of every model is one row of a set of flat
+  numpy columns (owning model, owning class, name and description lengths,
+  and whether name, description and dataType are present). Columns are
+  extracted the first time a report needs them, and the per-table and
+  per-model coverage counts are computed with bincount group-bys over the
+  whole catalogue at once instead of by walking the class trees model by model.
+  """
+
+  def __init__(self, models, name_key='name'):
+    """
+    @param models: list of data class lists, one per data model
+    @param name_key: field holding class and element names ('label' in the v1 checks)
+    """
+    self.name_key = name_key
+    self.model_count = len(models)
+    self.classes = [dc for data_classes in models for dc in data_classes]
+    self.class_model = np.repeat(np.arange(self.model_count, dtype=np.int64),
+                                 [len(data_classes) for data_classes in models])
+    class_elements = [dc.get('dataElements', None) or [] for dc in self.classes]
+    self.elements = list(chain.from_iterable(class_elements))
+    self.element_class = np.repeat(np.arange(len(self.classes), dtype=np.int64),
+                                   [len(elements) for elements in class_elements])
+    self.element_model = self.class_model[self.element_class]
+    self._columns = {}
+
+  def column(self, name):
+    """One profile column, extracted on first use"""
+    if name not in self._columns:
+      key = {'name': self.name_key, 'description': 'description', 'type': 'dataType'}
+      table, kind, field = name.split('_')
+      items = self.classes if table == 'class' else self.elements
+      if kind == 'length':
+        column = length_column(items, key[field])
+      elif kind == 'present':
+        column = presence_column(items, key[field])
+      elif kind == 'typed':
+        column = data_type_column(items)
+      else:
+        column = np.fromiter((int(dc.get('dataElementsCount', None) or 0) for dc in items),
+                             dtype=np.int64, count=len(items))
+      self._columns[name] = column
+    return self._columns[name]
+
+  def _count(self, groups, mask, size):
+    """Rows per group where mask holds"""
+    return np.bincount(groups[mask], minlength=size)
+
+  def technical_metadata(self, name_len=TM_NAME_LEN, desc_len=TM_DESC_LEN):
+    """v1 technicalMetaDataValidation of every model, in input order"""
+    classes, models = len(self.classes), self.model_count
+    named = self.column('element_length_name') >= name_len
+    described = self.column('element_length_description') >= desc_len
+    typed = self.column('element_typed_type')
+    table_columns = np.bincount(self.element_class, minlength=classes)
+    table_names = self._count(self.element_class, named, classes)
+    table_descriptions = self._count(self.element_class, described, classes)
+    table_types = self._count(self.element_class, typed, classes)
+    named_tables = self.column('class_length_name') >= name_len
+    described_tables = self.column('class_length_description') >= desc_len
+
+    model_tables = np.bincount(self.class_model, minlength=models)
+    model_named_tables = self._count(self.class_model, named_tables, models)
+    model_described_tables = self._count(self.class_model, described_tables, models)
+    model_columns = np.bincount(self.element_model, minlength=models)
+    model_names = self._count(self.element_model, named, models)
+    model_descriptions = self._count(self.element_model, described, models)
+    model_types = self._count(self.element_model, typed, models)
+
+    # plain ints for the report, and much cheaper to index than numpy scalars
+    profiles = [{
+      'tableCount': tc,
+      'tableNames': tn,
+      'tableDescriptions': td,
+      'columnCount': cc,
+      'columnNames': cn,
+      'columnDescriptions': cd,
+      'dataTypes': dt,
+      'sensitive': 0,
+      'tables': [],
+    } for tc, tn, td, cc, cn, cd, dt in zip(model_tables.tolist(), model_named_tables.tolist(),
+                                            model_described_tables.tolist(), model_columns.tolist(),
+                                            model_names.tolist(), model_descriptions.tolist(), model_types.tolist())]
+    tables = zip(self.classes, self.class_model.tolist(), table_columns.tolist(), table_names.tolist(),
+                 table_descriptions.tolist(), table_types.tolist(), named_tables.tolist(), described_tables.tolist())
+    for dc, m, cc, cn, cd, dt, named_table, described_table in tables:
+      table_md = {
+        'table': dc.get(self.name_key, dc.get('id', '0')),
+        'columnCount': cc,
+        'columnNames': cn,
+        'columnDescriptions': cd,
+        'dataTypes': dt,
+      }
+      # the v1 report names the flag tableName when set and tableNames when not
+      if named_table:
+        table_md['tableName'] = 1
+      else:
+        table_md['tableNames'] = 0
+      table_md['tableDescription'] = 1 if described_table else 0
+      profiles[m]['tables'].append(table_md)
+    return profiles
+
+  def structural_metadata_counts(self):
+    """v2 structuralMetadataCount of every model, in input order"""
+    models = self.model_count
+    tables = np.bincount(self.class_model, minlength=models)
+    table_names = self._count(self.class_model, self.column('class_present_name'), models)
+    table_descriptions = self._count(self.class_model, self.column('class_present_description'), models)
+    elements = np.bincount(self.class_model, weights=self.column('class_count_elements'), minlength=models)
+    column_names = self._count(self.element_model, self.column('element_present_name'), models)
+    column_descriptions = self._count(self.element_model, self.column('element_present_description'), models)
+    data_types = self._count(self.element_model, self.column('element_present_type'), models)
+    counts = zip(tables.tolist(), table_names.tolist(), table_descriptions.tolist(), elements.astype(np.int64).tolist(),
+                 column_names.tolist(), column_descriptions.tolist(), data_types.tolist())
+    return [{
+      'structuralMetadata.dataClassesCount': tc,
+      'structuralMetadata.tableName': tn,
+      'structuralMetadata.tableDescription': td,
+      'structuralMetadata.dataElementsCount': ec,
+      'structuralMetadata.columnName': cn,
+      'structuralMetadata.columnDescription': cd,
+      'structuralMetadata.dataType': dt,
+      'structuralMetadata.sensitive': 0,
+    } for tc, tn, td, ec, cn, cd, dt in counts]
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# usage: from telemetry import RequestTelemetry
+__license__ = "Apache 2"
+
+import os
+import re
+import math
+import json
+import time
+import threading
+from datetime import datetime
+
+CRAWL_METRICS_JSON = os.path.join('reports', 'crawl_metrics.json')
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is unbounded
+LATENCY_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+OTHER = 'OTHER'
+
+
+def compile_template(template):
+  """Regex matching the URLs a str.format template such as DATA_MODEL_CLASSES produces"""
+  parts = re.split(r'\{[A-Z_]+\}', template)
+  return re.compile('^' + '[^/?&]+'.join(re.escape(p) for p in parts) + '$')
+
+
+def percentile(samples, p):
+  """Nearest-rank percentile of a sorted list"""
+  if not samples:
+    return None
+  rank = max(1, int(math.ceil(p / 100.0 * len(samples))))
+  return samples[min(rank, len(samples)) - 1]
+
+
+def response_size(r):
+  content = getattr(r, 'content', None)
+  if content is not None:
+    return len(content)
+  return len(r.text.encode('utf-8'))
+
+
+def response_retries(r):
+  """Statuses of the attempts retried before returning r (empty for cached responses)"""
+  retried_statuses = getattr(r, 'retried_statuses', None)
+  if retried_statuses is not None:
+    return retried_statuses
+  retries = getattr(getattr(r, 'raw', None), 'retries', None)
+  return [h.status for h in getattr(retries, 'history', None) or ()]
+
+
+class URLClassifier:
+  """Name of the URL template that produced a URL, or OTHER"""
+
+  def __init__(self, templates):
+    """
+    @param templates: dict of name -> URL template with {PLACEHOLDER} fields
+    """
+    # Most specific (longest) templates are tried first
+    self.templates = [(name, compile_template(t)) for name, t in
+                      sorted(templates.items(), key=lambda item: len(item[1]), reverse=True)]
+
+  def classify(self, url):
+    for name, pattern in self.templates:
+      if pattern.match(url):
+        return name
+    path = url.split('?', 1)[0]
+    for name, pattern in self.templates:
+      if pattern.match(path):
+        return name
+    return OTHER
+
+
+class RequestTelemetry:
+  """Counts, latencies, sizes, statuses and retries of outbound requests.
+
+  Requests are grouped by the URL template that produced them (e.g.
+  DATA_MODEL_CLASSES), so the report shows which endpoint family dominates
+  a crawl. URLs matching no template are grouped under OTHER.
+  """
+
+  def __init__(self, templates):
+    """
+    @param templates: dict of name -> URL template with {PLACEHOLDER} fields
+    """
+    self.classifier = URLClassifier(templates)
+    self.endpoints = {}
+    self.started = time.time()
+    self._lock = threading.Lock()
+
+  def classify(self, url):
+    return self.classifier.classify(url)
+
+  def _endpoint(self, name):
+    endpoint = self.endpoints.get(name, None)
+    if endpoint is None:
+      endpoint = self.endpoints[name] = {
+        'latencies': [], 'bytes': 0, 'max_bytes': 0, 'statuses': {},
+        'retries': 0, 'retry_statuses': {}, 'cache_hits': 0, 'revalidations': 0,
+      }
+    return endpoint
+
+  def record(self, url, elapsed, r=None, error=None):
+    """Record one request_url call.
+
+    @param elapsed: wall time in seconds, including retries and backoff
+    @param r: the response (a requests.Response or a cached stand-in)
+    @param error: exception raised instead of a response
+    """
+    name = self.classify(url)
+    size = response_size(r) if r is not None else 0
+    retries = response_retries(r) if r is not None else []
+    status = str(r.status_code) if r is not None else type(error).__name__
+    with self._lock:
+      endpoint = self._endpoint(name)
+      endpoint['latencies'].append(elapsed)
+      endpoint['bytes'] += size
+      endpoint['max_bytes'] = max(endpoint['max_bytes'], size)
+      endpoint['statuses'][status] = endpoint['statuses'].get(status, 0) + 1
+      endpoint['retries'] += len(retries)
+      for retry_status in retries:
+        key = str(retry_status)
+        endpoint['retry_statuses'][key] = endpoint['retry_statuses'].get(key, 0) + 1
+      if getattr(r, 'from_cache', False):
+        endpoint['revalidations' if r.revalidated else 'cache_hits'] += 1
+
+  def summary(self):
+    """Per-template metrics plus totals, ordered by total time spent"""
+    with self._lock:
+      endpoints = {name: dict(e, latencies=sorted(e['latencies'])) for name, e in self.endpoints.items()}
+    report = {}
+    for name, e in sorted(endpoints.items(), key=lambda item: -sum(item[1]['latencies'])):
+      latencies = e['latencies']
+      count = len(latencies)
+      histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+      for latency in latencies:
+        histogram[next((i for i, b in enumerate(LATENCY_BUCKETS) if latency <= b), len(LATENCY_BUCKETS))] += 1
+      report[name] = {
+        'count': count,
+        'latency': {
+          'total': round(sum(latencies), 3),
+          'mean': round(sum(latencies) / count, 4) if count else None,
+          'p50': round(percentile(latencies, 50), 4) if count else None,
+          'p95': round(percentile(latencies, 95), 4) if count else None,
+          'p99': round(percentile(latencies, 99), 4) if count else None,
+          'max': round(latencies[-1], 4) if count else None,
+          'histogram': {'le_{}'.format(b): n for b, n in zip(LATENCY_BUCKETS + ['inf'], histogram)},
+        },
+        'bytes': {
+          'total': e['bytes'],
+          'mean': round(e['bytes'] / count) if count else None,
+          'max': e['max_bytes'],
+        },
+        'statuses': e['statuses'],
+        'retries': e['retries'],
+        'retry_statuses': e['retry_statuses'],
+        'cache_hits': e['cache_hits'],
+        'revalidations': e['revalidations'],
+      }
+    return {
+      'generated': datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+      'wall_seconds': round(time.time() - self.started, 3),
+      'requests': sum(e['count'] for e in report.values()),
+      'request_seconds': round(sum(e['latency']['total'] for e in report.values()), 3),
+      'bytes': sum(e['bytes']['total'] for e in report.values()),
+      'retries': sum(e['retries'] for e in report.values()),
+      'endpoints': report,
+    }
+
+  def write(self, filename=CRAWL_METRICS_JSON, **extra):
+    """Write the summary, plus any extra top-level sections, to filename"""
+    summary = self.summary()
+    summary.update(extra)
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    with open(filename, 'w') as jsonfile:
+      json.dump(summary, jsonfile, indent=2)
+    print("Requests by endpoint (count, total s, p50 / p95 / p99 s, retries):")
+    for name, e in summary['endpoints'].items():
+      latency = e['latency']
+      print("  {}: {}, {}, {} / {} / {}, {}".format(name, e['count'], latency['total'], latency['p50'],
+                                                    latency['p95'], latency['p99'], e['retries']))
+    return summary
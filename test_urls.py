@@ -1,11 +1,13 @@
+import os
 import requests
 import re
-import time
 import pandas as pd
+import transport
+import rate_limit
 from functools import reduce
 
 # URL for the Innovation Gateway API
-API_URL = "https://api.www.healthdatagateway.org/api/v2/datasets"
+API_URL = os.environ.get('GATEWAY_API_BASE_URL', "https://api.www.healthdatagateway.org") + "/api/v2/datasets"
 
 # Regex pattern for finding URLs in strings
 URL_REGEX = "^https?:\\/\\/(?:www\\.)?[-a-zA-Z0-9@:%._\\+~#=]{1,256}\\.[a-zA-Z0-9()]{1,6}\\b(?:[-a-zA-Z0-9()@:%_\\+.~#?&\\/=]*)$"
@@ -38,15 +40,13 @@ def get_dataset_objects(api_url, params:dict = {}):
     # Loop through the API pages:
     for i in range(1, 100):
         params['page'] = i
-        r = requests.get(url = api_url, params = params)
+        r = transport.get(api_url, params = params)
         data = r.json()['datasets']
 
-        # Add the datasets from the page to the output list:
+        # Add the datasets from the page to the output list
+        # (transport paces the pages through the Gateway's rate limiter):
         out.extend(data)
 
-        # Wait 1 second before requesting the next page:
-        time.sleep(1)
-
         # Stop when there are less than 100 datasets on the page (i.e. the last page):
         if len(data) < 100:
             break
@@ -61,7 +61,7 @@ def reduce_dictionary(d, keys):
 
 def url_test(url):
     try:
-        status_code = requests.get(url, timeout=10.0).status_code
+        status_code = rate_limit.controller.call(url, lambda: requests.get(url, timeout=10.0)).status_code
         return status_code
     except requests.Timeout:
         return 'Timeout' 
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# usage: from transport import get
+__license__ = "Apache 2"
+
+import os
+import time
+import random
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import rate_limit
+
+CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 10))
+READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 120))
+MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 5))
+BACKOFF_FACTOR = float(os.environ.get('HTTP_BACKOFF_FACTOR', 0.5))
+BACKOFF_MAX = float(os.environ.get('HTTP_BACKOFF_MAX', 60))
+POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 32))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_settings = {
+  'timeout': (CONNECT_TIMEOUT, READ_TIMEOUT),
+  'retries': MAX_RETRIES,
+  'backoff_factor': BACKOFF_FACTOR,
+  'pool_size': POOL_SIZE,
+}
+_session = None
+_session_lock = threading.Lock()
+
+
+def equal_jitter(backoff):
+  """Half the capped backoff plus a random share of the other half"""
+  backoff = min(BACKOFF_MAX, backoff)
+  if backoff <= 0:
+    return 0
+  return backoff / 2 + random.uniform(0, backoff / 2)
+
+
+class JitteredRetry(Retry):
+  """urllib3 Retry with 'equal jitter' exponential backoff capped at BACKOFF_MAX.
+
+  Used for connection and read errors; retryable statuses are handled by get()
+  so that every attempt passes through the rate controller.
+  """
+
+  def get_backoff_time(self):
+    return equal_jitter(super().get_backoff_time())
+
+
+def configure(timeout=None, retries=None, backoff_factor=None, pool_size=None):
+  """Override the transport settings; the shared session is rebuilt on next use"""
+  global _session
+  with _session_lock:
+    if timeout is not None:
+      _settings['timeout'] = timeout
+    if retries is not None:
+      _settings['retries'] = retries
+    if backoff_factor is not None:
+      _settings['backoff_factor'] = backoff_factor
+    if pool_size is not None:
+      _settings['pool_size'] = pool_size
+    if _session is not None:
+      _session.close()
+    _session = None
+
+
+def get_session():
+  """Return the process-wide keep-alive session, creating it on first use"""
+  global _session
+  with _session_lock:
+    if _session is None:
+      retry = JitteredRetry(
+        total=_settings['retries'],
+        backoff_factor=_settings['backoff_factor'],
+        # 429/503 + Retry-After are left to get() and the rate controller
+        respect_retry_after_header=False,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        raise_on_status=False,
+      )
+      adapter = HTTPAdapter(pool_connections=_settings['pool_size'],
+                            pool_maxsize=_settings['pool_size'],
+                            max_retries=retry)
+      session = requests.Session()
+      session.mount('https://', adapter)
+      session.mount('http://', adapter)
+      _session = session
+    return _session
+
+
+def get(url, params=None, timeout=None, **kwargs):
+  """HTTP GET through the shared session with pooling, timeouts, rate limiting and retries.
+
+  Every attempt waits for the host's rate controller, which adapts to 429s,
+  Retry-After headers and latency. Transient 429/5xx responses are retried
+  with backoff (or after Retry-After, which pauses the whole host); the last
+  response is returned as-is so callers keep their own status handling. The
+  statuses of retried attempts are left on response.retried_statuses.
+  """
+  if timeout is None:
+    timeout = _settings['timeout']
+  session = get_session()
+  retries = _settings['retries']
+  retried_statuses = []
+  for attempt in range(retries + 1):
+    r = rate_limit.controller.call(url, lambda: session.get(url, params=params, timeout=timeout, **kwargs))
+    if r.status_code not in RETRY_STATUSES or attempt == retries:
+      r.retried_statuses = retried_statuses
+      return r
+    retried_statuses.append(r.status_code)
+    retry_after = rate_limit.retry_after_seconds(r)
+    r.close()
+    if retry_after is None:
+      time.sleep(equal_jitter(_settings['backoff_factor'] * (2 ** attempt)))
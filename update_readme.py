@@ -7,7 +7,8 @@ __license__ = "Apache 2"
 
 import os
 import json
-import requests
+import transport
+from catalogue_store import load_catalogue
 
 README_FILE = 'README.md'
 DATASETS_JSON = 'datasets.json'
@@ -19,7 +20,7 @@ def get_json(json_uri):
         with open(json_uri, 'r') as json_file:
             return json.load(json_file)
     elif json_uri.startswith('http'):
-        return requests.get(json_uri).json()
+        return transport.get(json_uri).json()
     else:
         raise Exception
 
@@ -102,7 +103,7 @@ This repo automatically collects the datasets published on the Gateway including
 
 
 def main():
-    datasets = get_json(DATASETS_JSON)
+    datasets = load_catalogue(DATASETS_JSON, version=1, with_classes=False)
     datasets = cleanup(datasets)
     publishers = get_publishers(datasets)
     generate_readme(datasets, publishers)
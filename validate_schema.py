@@ -8,9 +8,13 @@ __license__ = "Apache 2"
 import os
 import re
 import json
-import requests
-import copy
-from jsonschema import validate, Draft7Validator, FormatChecker, draft7_format_checker
+import functools
+import transport
+from jsonschema import validate, FormatChecker
+from schema_registry import get_validator, get_attribute_validators, schema_hash
+from validation_pool import validate_map, VALIDATION_WORKERS
+from result_cache import ResultCache, RESULT_CACHE_DIR
+from tech_profile import TechnicalProfile, TM_NAME_LEN, TM_DESC_LEN
 
 DATASET_SCHEMA = 'https://raw.githubusercontent.com/HDRUK/schemata/master/schema/dataset/1.1.7/dataset.schema.json'
 DATASETS_JSON = 'datasets.json'
@@ -33,9 +37,6 @@ REPORTING_ATTRIBUTES = {
 REPORTING_LEVELS = ["A: Summary", "B: Business", "C: Coverage & Detail",
                     "D: Format & Structure", "E: Attribution", "F: Technical Metadata"]
 
-TM_NAME_LEN = 2
-TM_DESC_LEN = 6
-
 REPORTING_ATTRIBUTES = {
     "A: Summary": ['identifier', 'title', 'abstract', 'publisher', 'contactPoint', 'accessRights', 'group'],
     "B: Business": ["description", "releaseDate", "accessRequestCost", "accessRequestDuration", "dataController",
@@ -62,7 +63,7 @@ def get_json(json_uri):
         with open(json_uri, 'r') as json_file:
             return json.load(json_file)
     elif json_uri.startswith('http'):
-        return requests.get(json_uri).json()
+        return transport.get(json_uri).json()
     else:
         raise Exception
 
@@ -72,11 +73,42 @@ def export_json(data, filename, indent=2):
         json.dump(data, jsonfile, indent=indent)
 
 
+class ReportingView(dict):
+    """
+    Read-only projection of a data model onto the reporting attributes.
+    Values are shared with the data model rather than copied, so building a
+    view costs one small dict however many dataClasses the model holds. It is
+    a dict, so jsonschema validates it as an object, and it pickles as a plain
+    dict copy of the projected attributes.
+    """
+
+    def __init__(self, data_model, attributes, derived=None, baseline=None):
+        """
+        @param data_model: data-model to project
+        @param attributes: attribute names the view exposes
+        @param derived: attributes computed from the data-model, overriding its own values
+        @param baseline: attribute defaults the view starts from, in their order
+        """
+        super().__init__(baseline or {})
+        attributes = set(attributes)
+        dict.update(self, ((k, v) for k, v in data_model.items() if k in attributes))
+        if derived:
+            dict.update(self, ((k, v) for k, v in derived.items() if k in attributes))
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("ReportingView is read-only")
+
+    __setitem__ = __delitem__ = _read_only
+    pop = popitem = clear = update = setdefault = _read_only
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+
 def validate_schema(schema, json):
-    schema = get_json(schema)
     json = get_json(json)
     
-    v = Draft7Validator(schema, format_checker=draft7_format_checker)
+    v = get_validator(schema)
     errors = sorted(v.iter_errors(json), key=lambda e: e.path)
     print(json['id'], ": Number of validation errors = ", len(errors))
     data = []
@@ -99,13 +131,11 @@ def validate_schema(schema, json):
 
 def validate_attribute_schema(schema, data_model):
     """ validate each attribute against JSON schema
-    @param schema: JSON validation schema
+    @param schema: JSON validation schema URI, dict or compiled validator
     @param data_model: uploaded data model
     @return: dictionary with all schema errors
     """
-    schema = get_json(schema)
-
-    v = Draft7Validator(schema, format_checker=draft7_format_checker)
+    v = get_validator(schema)
     errors = sorted(v.iter_errors(data_model), key=lambda e: e.path)
     print(data_model['id'], ": Number of validation errors = ", len(errors))
     err = {}
@@ -129,6 +159,20 @@ def validate_attribute_schema(schema, data_model):
     return err
 
 
+def validate_attributes(schema, data_model, attributes):
+    """ validate only the given attributes, each against its own compiled sub-schema
+    @param schema: JSON validation schema URI or dict
+    @param data_model: uploaded data model
+    @param attributes: attribute names to validate
+    @return: dictionary with the schema errors of each failing attribute
+    """
+    failures = get_attribute_validators(schema, attributes).failures(data_model)
+    print(data_model['id'], ": Number of failing attributes = ", len(failures))
+    for attribute, message in failures.items():
+        print(attribute, message, sep=": ")
+    return {attribute: [message] for attribute, message in failures.items()}
+
+
 def generate_baseline_from_sections(metadata_sections, metadata_levels=None):
     '''
     generate the baseline schema from METADATA_SECTIONS, a dictionary of dictionaries
@@ -170,70 +214,40 @@ def generate_attribute_list(metadata_sections=REPORTING_ATTRIBUTES, metadata_lev
 def import_dm_tm(datamodel_uri):
     """
     Import data-models and process technical metadata
-    @param dataset_uri: dataset URI or file path
+    @param datamodel_uri: dataset URI, file path or already parsed data-models, which are updated in place
     @return: all datasets as a list of JSON/dicts
     """
     data_models = get_json(datamodel_uri)
 
-    models_with_metadata = 0
-    for dm in data_models['dataModels']:
-        if dm.get('dataClassesCount', 0) > 0:
-            #dm['technicalMetaDataValidation'] = process_technical_metadata(dm.get('dataClasses', []))
-            technicalMetaDataValidation = process_technical_metadata(dm.get('dataClasses', []))
-            dm['technicalMetaDataValidation'] = technicalMetaDataValidation
-            models_with_metadata += 1
+    # profile the technical metadata of the whole catalogue in one pass
+    models_with_metadata = [dm for dm in data_models['dataModels'] if dm.get('dataClassesCount', 0) > 0]
+    profile = TechnicalProfile([dm.get('dataClasses', []) for dm in models_with_metadata], name_key='label')
+    for dm, technicalMetaDataValidation in zip(models_with_metadata, profile.technical_metadata(TM_NAME_LEN, TM_DESC_LEN)):
+        dm['technicalMetaDataValidation'] = technicalMetaDataValidation
 
     return data_models
 
 
+def current_data_models(data_models):
+    """
+    Leave out superseded versions crawled without structural metadata (datasets.py --latest-only)
+    @param data_models: data-models as read from datasets.json
+    @return: the same dictionary, holding only the data-models to score
+    """
+    current = [dm for dm in data_models['dataModels'] if not dm.get('supersededBy', None)]
+    if len(current) < len(data_models['dataModels']):
+        print("Skipping", len(data_models['dataModels']) - len(current), "superseded data models")
+    data_models['dataModels'] = current
+    return data_models
+
+
 def process_technical_metadata(data_classes):
     """
     Process technical metadata for an uploaded data-model
     @param data_classes: uploaded data-classes for a data-model
     @return: dictionary containing technical metadata
     """
-    technical_md = {}
-    technical_md['tableCount'] = len(data_classes)
-    technical_md['tableNames'] = 0
-    technical_md['tableDescriptions'] = 0
-    technical_md['columnCount'] = 0
-    technical_md['columnNames'] = 0
-    technical_md['columnDescriptions'] = 0
-    technical_md['dataTypes'] = 0
-    technical_md['sensitive'] = 0
-    technical_md['tables'] = []
-    for dc in data_classes:
-        table_md = {}
-        table_md['table'] = dc.get('label', dc.get('id', '0'))
-        table_md['columnCount'] = len(dc.get('dataElements', []))
-        table_md['columnNames'] = 0
-        table_md['columnDescriptions'] = 0
-        table_md['dataTypes'] = 0
-        if len(str(dc.get('label', ''))) >= TM_NAME_LEN:
-            table_md['tableName'] = 1
-            technical_md['tableNames'] += 1
-        else:
-            table_md['tableNames'] = 0
-        if len(str(dc.get('description', ''))) >= TM_DESC_LEN:
-            table_md['tableDescription'] = 1
-            technical_md['tableDescriptions'] += 1
-        else:
-            table_md['tableDescription'] = 0
-
-        for de in dc.get('dataElements', []):
-            technical_md['columnCount'] += 1
-            if len(str(de.get('label', ''))) >= TM_NAME_LEN:
-                table_md['columnNames'] += 1
-                technical_md['columnNames'] += 1
-            if len(str(de.get('description', ''))) >= TM_DESC_LEN:
-                table_md['columnDescriptions'] += 1
-                technical_md['columnDescriptions'] += 1
-            if len(list(de.get('dataType', []))) > 0:
-                table_md['dataTypes'] += 1
-                technical_md['dataTypes'] += 1
-        technical_md['tables'].append(table_md)
-
-    return technical_md
+    return TechnicalProfile([data_classes], name_key='label').technical_metadata(TM_NAME_LEN, TM_DESC_LEN)[0]
 
 
 def check_attribute_completeness(dm, metadata_sections=REPORTING_ATTRIBUTES, reporting_levels=REPORTING_LEVELS):
@@ -275,8 +289,7 @@ def check_dm_completeness(data_models):
     # schema = get_json(BASELINE_SAMPLE)
     schema = generate_baseline_from_sections(REPORTING_ATTRIBUTES, REPORTING_LEVELS, True)
     data = []
-    for data_model in data_models['dataModels']:
-        dm = copy.deepcopy(data_model)
+    for dm in data_models['dataModels']:
         print("Processing:", dm['id'])
         d = {
             'pid': dm.get('pid',None), 
@@ -284,77 +297,92 @@ def check_dm_completeness(data_models):
             'publisher': dm.get('publisher',None),
             'title': dm.get('title',None)
         }
-        compute_tech_md_completeness(dm)
-        for attribute in (set(dm.keys()) - set(schema.keys())):
-            dm.pop(attribute, None) # any attribute not in the schema, drop from the data model
-        s = copy.deepcopy(schema)
-        s.update(dm)
+        # attributes missing from the data model keep their baseline value (None)
+        s = ReportingView(dm, schema.keys(), tech_md_completeness(dm), baseline=schema)
         score = check_attribute_completeness(s)
         d.update(score)
         data.append(d)
     return data
 
 
-def check_attribute_validation(data_models, metadata_sections=REPORTING_ATTRIBUTES, reporting_levels=REPORTING_LEVELS):
+def check_attribute_validation(data_models, metadata_sections=REPORTING_ATTRIBUTES, reporting_levels=REPORTING_LEVELS,
+                               workers=1, targeted=False, cache=None):
     """
     Generate dictionary that validates each attribute against the JSON validation schema
     @param data_models: data-models for validation
     @param metadata_sections: reporting levels and attributes
     @param reporting_levels: reporting attributes
+    @param workers: number of validation processes
+    @param targeted: validate only the reported attributes, each with its own sub-validator
+    @param cache: optional ResultCache; only data-models without a stored result are validated
     @return: dictionary with validation for each attribute
     """
-    schema = get_json(DATASET_SCHEMA)
     validation_attributes = set(generate_attribute_list(metadata_sections, reporting_levels))
-    data = []
-    for dm in data_models['dataModels']:
-        total_errors, level_errors = 0, 0
-        dm_validate = copy.deepcopy(dm)
-        compute_tech_md_validation(dm_validate)
-        for attribute in (set(dm_validate.keys()) - validation_attributes):
-            dm_validate.pop(attribute, None)
-        errors = validate_attribute_schema(schema, dm_validate)
-        d = {
-            'pid': dm.get('pid', None),
-            'id': dm.get('id',None),
-            'publisher': dm.get('publisher',None),
-            'title': dm.get('title',None)
-        }
-        reporting_dict = init_reporting_dict(metadata_sections=metadata_sections,
-                                             reporting_levels=reporting_levels,
-                                             txt='attributes_with_errors')
-        total_errors = 0
-        for level in reporting_levels:
-            level_errors = 0
-            if "F: Technical Metadata" == level:
-                for k in reporting_dict[level].keys():
-                    if 'dataClassesCount' == k:
-                        i = dm_validate.get(k, 0)
-                        reporting_dict[level][k] = int( 1 - (i>1))
-                    elif 'attributes_with_errors' == k:
-                        continue
-                    elif 'total_attributes' == k:
-                        continue
-                    else:
-                        reporting_dict[level][k] = dm_validate.get(k, 0)
-                    level_errors += reporting_dict[level][k]
-                    total_errors += reporting_dict[level][k]
-            else:
-                for k in reporting_dict[level].keys():
-                    if 'attributes_with_errors' == k:
-                        continue
-                    elif 'total_attributes' == k:
-                        continue
-                    else:
-                        if k in errors:
-                            zzz_debug = errors[k]
-                            reporting_dict[level][k] = 1
-                            level_errors += 1
-                            total_errors += 1
-            reporting_dict[level]['attributes_with_errors'] = level_errors
-        d.update(reporting_dict)
-        d['attributes_with_errors'] = total_errors
-        data.append(d)
-    return data
+    # only the projections travel to the worker processes
+    views = [(ReportingView(dm, validation_attributes, tech_md_validation(dm)),
+              {'pid': dm.get('pid', None), 'id': dm.get('id', None),
+               'publisher': dm.get('publisher', None), 'title': dm.get('title', None)})
+             for dm in data_models['dataModels']]
+    check = functools.partial(attribute_validation, metadata_sections=metadata_sections,
+                              reporting_levels=reporting_levels, targeted=targeted)
+    if cache is not None:
+        context = [schema_hash(DATASET_SCHEMA), metadata_sections, reporting_levels, targeted]
+        return cache.map('attribute_validation', context, check, views, workers=workers, schemas=[DATASET_SCHEMA])
+    return validate_map(check, views, workers=workers, schemas=[DATASET_SCHEMA])
+
+
+def attribute_validation(view, metadata_sections=REPORTING_ATTRIBUTES, reporting_levels=REPORTING_LEVELS,
+                         targeted=False):
+    """
+    Validate one projected data-model for check_attribute_validation
+    @param view: (ReportingView of the data-model, its pid/id/publisher/title)
+    @param metadata_sections: reporting levels and attributes
+    @param reporting_levels: reporting attributes
+    @param targeted: validate only the schema-checked reporting attributes (all levels but F)
+    @return: dictionary with validation for each attribute
+    """
+    dm_validate, d = view
+    if targeted:
+        attributes = generate_attribute_list(metadata_sections,
+                                             [level for level in reporting_levels if level != "F: Technical Metadata"],
+                                             add_id=False)
+        errors = validate_attributes(DATASET_SCHEMA, dm_validate, attributes)
+    else:
+        errors = validate_attribute_schema(get_validator(DATASET_SCHEMA), dm_validate)
+    reporting_dict = init_reporting_dict(metadata_sections=metadata_sections,
+                                         reporting_levels=reporting_levels,
+                                         txt='attributes_with_errors')
+    total_errors = 0
+    for level in reporting_levels:
+        level_errors = 0
+        if "F: Technical Metadata" == level:
+            for k in reporting_dict[level].keys():
+                if 'dataClassesCount' == k:
+                    i = dm_validate.get(k, 0)
+                    reporting_dict[level][k] = int( 1 - (i>1))
+                elif 'attributes_with_errors' == k:
+                    continue
+                elif 'total_attributes' == k:
+                    continue
+                else:
+                    reporting_dict[level][k] = dm_validate.get(k, 0)
+                level_errors += reporting_dict[level][k]
+                total_errors += reporting_dict[level][k]
+        else:
+            for k in reporting_dict[level].keys():
+                if 'attributes_with_errors' == k:
+                    continue
+                elif 'total_attributes' == k:
+                    continue
+                else:
+                    if k in errors:
+                        reporting_dict[level][k] = 1
+                        level_errors += 1
+                        total_errors += 1
+        reporting_dict[level]['attributes_with_errors'] = level_errors
+    d.update(reporting_dict)
+    d['attributes_with_errors'] = total_errors
+    return d
 
 
 def generate_baseline_from_sections(metadata_sections=REPORTING_ATTRIBUTES, metadata_levels=REPORTING_LEVELS, add_id=True):
@@ -374,20 +402,31 @@ def generate_baseline_from_sections(metadata_sections=REPORTING_ATTRIBUTES, meta
     return baseline_dict
 
 
-def compute_tech_md_completeness(data_model):
+def tech_md_completeness(data_model):
     """
-    check if technical metadata is complete
+    technical metadata completeness fields for a data-model
     @param data_model: uploaded data-model
+    @return: dictionary of derived attributes, empty if the data-model has no data classes
     """
     if data_model.get('dataClassesCount', 0) < 1:
-        return
+        return {}
     tm = data_model.get('technicalMetaDataValidation', {})
-    data_model['tableName'] = 1 if tm.get('tableNames', 0) > 0 else 0
-    data_model['tableDescription'] = 1 if tm.get('tableDescriptions', 0) > 0 else 0
-    data_model['columnName'] = 1 if tm.get('columnNames', 0) > 0 else 0
-    data_model['columnDescription'] = 1 if tm.get('columnDescriptions', 0) > 0 else 0
-    data_model['dataType'] = 1 if tm.get('dataTypes', 0) > 0 else 0
-    data_model['sensitive'] = None
+    return {
+        'tableName': 1 if tm.get('tableNames', 0) > 0 else 0,
+        'tableDescription': 1 if tm.get('tableDescriptions', 0) > 0 else 0,
+        'columnName': 1 if tm.get('columnNames', 0) > 0 else 0,
+        'columnDescription': 1 if tm.get('columnDescriptions', 0) > 0 else 0,
+        'dataType': 1 if tm.get('dataTypes', 0) > 0 else 0,
+        'sensitive': None,
+    }
+
+
+def compute_tech_md_completeness(data_model):
+    """
+    check if technical metadata is complete
+    @param data_model: uploaded data-model
+    """
+    data_model.update(tech_md_completeness(data_model))
 
 
 def init_reporting_dict(metadata_sections = REPORTING_ATTRIBUTES, reporting_levels = REPORTING_LEVELS, txt='attribute_reporting'):
@@ -413,22 +452,33 @@ def init_reporting_dict(metadata_sections = REPORTING_ATTRIBUTES, reporting_leve
     return reporting_dict
 
 
-def compute_tech_md_validation(data_model):
+def tech_md_validation(data_model):
     """
-    validate technical meta-data
+    technical metadata validation fields for a data-model
     @param data_model: uploaded data-model
+    @return: dictionary of derived attributes, empty if the data-model has no data classes
     """
     if data_model.get('dataClassesCount', 0) < 1:
-        return
+        return {}
     tm = data_model.get('technicalMetaDataValidation', {})
     table_count = tm.get('tableCount', 0)
     column_count = tm.get('columnCount', 0)
-    data_model['tableName'] = 0 if tm.get('tableNames', 0) == table_count else 1
-    data_model['tableDescription'] = 0 if tm.get('tableDescriptions', 0) == table_count else 1
-    data_model['columnName'] = 0 if tm.get('columnNames', 0) == column_count else 1
-    data_model['columnDescription'] = 0 if tm.get('columnDescriptions', 0) == column_count else 1
-    data_model['dataType'] = 0 if tm.get('dataTypes', 0) == column_count else 1
-    data_model['sensitive'] = 1
+    return {
+        'tableName': 0 if tm.get('tableNames', 0) == table_count else 1,
+        'tableDescription': 0 if tm.get('tableDescriptions', 0) == table_count else 1,
+        'columnName': 0 if tm.get('columnNames', 0) == column_count else 1,
+        'columnDescription': 0 if tm.get('columnDescriptions', 0) == column_count else 1,
+        'dataType': 0 if tm.get('dataTypes', 0) == column_count else 1,
+        'sensitive': 1,
+    }
+
+
+def compute_tech_md_validation(data_model):
+    """
+    validate technical meta-data
+    @param data_model: uploaded data-model
+    """
+    data_model.update(tech_md_validation(data_model))
 
 
 def flatten_reporting_dict(data_models):
@@ -463,11 +513,15 @@ def flatten_reporting_dict(data_models):
     return data, headers
 
 
-def main():
+def main(workers=1, targeted=False, cache_dir=RESULT_CACHE_DIR):
     # validate_schema(DATASET_SCHEMA, BASELINE_SCHEMA)
+    cache = None
+    if cache_dir is not None:
+        cache = ResultCache(os.path.join(cache_dir, 'validate_schema.json'))
+        cache.load()
 
     # read in datasets
-    data_models = import_dm_tm(DATASETS_JSON)
+    data_models = import_dm_tm(current_data_models(get_json(DATASETS_JSON)))
 
     # Compile Metadata Completeness Score
     attribute_completeness_score = check_dm_completeness(data_models)
@@ -476,9 +530,25 @@ def main():
     data, headers = flatten_reporting_dict(attribute_completeness_score)
 
     # Compile Schema Validation Error Score
-    schema_errors = check_attribute_validation(data_models)
+    schema_errors = check_attribute_validation(data_models, workers=workers, targeted=targeted, cache=cache)
     export_json(schema_errors, 'reports/attribute_errors.json')
 
+    if cache is not None:
+        cache.save()
+        print("Result cache:", cache.summary())
+
 
 if __name__ == "__main__":
-    main()
+    import argparse
+    parser = argparse.ArgumentParser(description='Check v1 data model completeness and schema validation')
+    parser.add_argument('--workers', metavar='N', type=int, default=VALIDATION_WORKERS,
+                        help='Number of validation processes (default: one per core, 1 = serial)')
+    parser.add_argument('--targeted', action='store_true',
+                        help='Validate only the reported attributes, each against its own part of the schema')
+    parser.add_argument('--cache-dir', metavar='DIR', dest='cache_dir', type=str, default=RESULT_CACHE_DIR,
+                        help='Directory for the validation results kept between runs')
+    parser.add_argument('--no-cache', dest='cache_dir', action='store_const', const=None,
+                        help='Validate every data model, ignoring and not updating the result cache')
+    args = parser.parse_args()
+
+    main(workers=args.workers, targeted=args.targeted, cache_dir=args.cache_dir)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# usage: from validation_pool import validate_map, default_workers
+__license__ = "Apache 2"
+
+import os
+import math
+from concurrent.futures import ProcessPoolExecutor
+
+from schema_registry import get_validator
+
+# Tasks per worker the input is split into; a few per worker evens out slow data models
+CHUNKS_PER_WORKER = 4
+
+
+def default_workers():
+  """Processes to validate with: the cores this process may run on"""
+  if hasattr(os, 'sched_getaffinity'):
+    return max(1, len(os.sched_getaffinity(0)))
+  return max(1, os.cpu_count() or 1)
+
+
+VALIDATION_WORKERS = default_workers()
+
+
+def warm_validators(schemas):
+  """Compile the validators for schemas once, when a worker process starts"""
+  for schema in schemas:
+    get_validator(schema)
+
+
+def validate_map(func, items, workers=1, schemas=(), chunksize=None):
+  """map(func, items) on a process pool, with results in input order.
+
+  Validation is CPU-bound and independent per data model, so it scales with
+  processes rather than threads. Items are sent to the workers in chunks and
+  every worker compiles the validators for schemas once, before its first
+  chunk. func and the items must be picklable; with workers <= 1 everything
+  runs in this process.
+
+  @param func: module-level function (or functools.partial of one) applied to each item
+  @param schemas: schema URIs the workers look up through the schema registry
+  @return: list of results
+  """
+  items = list(items)
+  # Pins the schemas before any worker asks for them, so workers read them from disk
+  warm_validators(schemas)
+  if workers <= 1 or len(items) < 2:
+    return [func(item) for item in items]
+  workers = min(workers, len(items))
+  if chunksize is None:
+    chunksize = max(1, int(math.ceil(len(items) / float(workers * CHUNKS_PER_WORKER))))
+  with ProcessPoolExecutor(max_workers=workers, initializer=warm_validators, initargs=(tuple(schemas),)) as pool:
+    return list(pool.map(func, items, chunksize=chunksize))